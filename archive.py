@@ -0,0 +1,292 @@
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from db_pool import DATABASE_FILE
+
+# ==============================================================================
+# --- Configuration ---
+# ==============================================================================
+
+ARCHIVE_ENABLED = os.environ.get('CANTEEN_ARCHIVE', '1') != '0'
+ARCHIVE_AFTER_DAYS = int(os.environ.get('CANTEEN_ARCHIVE_AFTER_DAYS', '90'))
+# Orders moved per transaction; each batch holds the write lock for a few ms.
+ARCHIVE_BATCH_SIZE = int(os.environ.get('CANTEEN_ARCHIVE_BATCH_SIZE', '500'))
+# Pause between batches, so queued order writes get the lock in between.
+ARCHIVE_PAUSE_S = float(os.environ.get('CANTEEN_ARCHIVE_PAUSE_S', '0.05'))
+ARCHIVE_INTERVAL_S = float(os.environ.get('CANTEEN_ARCHIVE_INTERVAL_S', '3600'))
+# Orders in any other status are closed (Completed, Rejected) and can be archived.
+OPEN_STATUSES = ('Pending', 'Ready')
+
+logger = logging.getLogger('canteen.archive')
+
+
+# ==============================================================================
+# --- Monthly Archive Tables ---
+# ==============================================================================
+#
+# Closed orders (Completed, Rejected) older than ARCHIVE_AFTER_DAYS move, with
+# their items, from orders/order_items into orders_archive_YYYYMM and
+# order_items_archive_YYYYMM (by the month of order_date). Open orders stay
+# live whatever their age. The archive tables mirror the live columns,
+# keep the order ids, and are created on first use. order_archives records
+# which months hold orders of each shop and their date range, and
+# order_archive_users which months hold orders of each user, so readers only
+# open the months a request can reach. The live tables then only hold recent
+# and open orders, whatever the total history.
+#
+# Aggregates that are kept incrementally (revenue rollup, sales counters) are
+# not touched by archiving; their rebuild and check functions read the live
+# and archive tables through `order_tables()`.
+
+_ARCHIVE_INDEXES = {
+    'orders': [('shop_date', 'shop_id, order_date'), ('user_date', 'user_id, order_date')],
+    'order_items': [('order', 'order_id')],
+}
+
+
+def _month(month):
+    if not (isinstance(month, str) and len(month) == 6 and month.isdigit()):
+        raise ValueError(f"Not an archive month: {month!r}")
+    return month
+
+
+def orders_table(month):
+    return f'orders_archive_{_month(month)}'
+
+
+def items_table(month):
+    return f'order_items_archive_{_month(month)}'
+
+
+def order_tables(conn):
+    """(orders table, order_items table) for the live tables and every archive month."""
+    months = [row[0] for row in conn.execute('SELECT DISTINCT month FROM order_archives ORDER BY month')]
+    return [('orders', 'order_items'), *((orders_table(month), items_table(month)) for month in months)]
+
+
+def _ensure_table(conn, source, target):
+    """Creates `target` with `source`'s columns, or adds columns added to `source` since. Returns the column names."""
+    columns = conn.execute(f'PRAGMA table_info({source})').fetchall()
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info({target})')}
+    if not existing:
+        definitions = ', '.join(f'{row[1]} {row[2]}' + (' PRIMARY KEY' if row[5] else '') for row in columns)
+        conn.execute(f'CREATE TABLE {target} ({definitions})')
+        for suffix, indexed in _ARCHIVE_INDEXES[source]:
+            conn.execute(f'CREATE INDEX idx_{target}_{suffix} ON {target} ({indexed})')
+    else:
+        for row in columns:
+            if row[1] not in existing:
+                conn.execute(f'ALTER TABLE {target} ADD COLUMN {row[1]} {row[2]}')
+    return [row[1] for row in columns]
+
+
+def archive_batch(conn, shop_id, cutoff, limit=ARCHIVE_BATCH_SIZE):
+    """Moves up to `limit` of a shop's closed orders dated before `cutoff` into the archive, in one transaction.
+
+    Returns the number of orders moved.
+    """
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        rows = conn.execute(
+            "SELECT id, strftime('%Y%m', order_date) FROM orders WHERE shop_id = ? AND order_date < ? AND status NOT IN (?, ?) ORDER BY order_date LIMIT ?",
+            (shop_id, cutoff, *OPEN_STATUSES, limit)
+        ).fetchall()
+        by_month = defaultdict(list)
+        for order_id, month in rows:
+            by_month[month].append(order_id)
+        for month, ids in by_month.items():
+            ids = tuple(ids)
+            placeholders = ','.join('?' * len(ids))
+            order_columns = ', '.join(_ensure_table(conn, 'orders', orders_table(month)))
+            item_columns = ', '.join(_ensure_table(conn, 'order_items', items_table(month)))
+            conn.execute(f'INSERT INTO {orders_table(month)} ({order_columns}) SELECT {order_columns} FROM orders WHERE id IN ({placeholders})', ids)
+            conn.execute(f'INSERT INTO {items_table(month)} ({item_columns}) SELECT {item_columns} FROM order_items WHERE order_id IN ({placeholders})', ids)
+            conn.execute(f'''
+                INSERT INTO order_archives (month, shop_id, orders, first_order_date, last_order_date)
+                SELECT ?, shop_id, COUNT(*), MIN(order_date), MAX(order_date) FROM orders WHERE id IN ({placeholders}) GROUP BY shop_id
+                ON CONFLICT (month, shop_id) DO UPDATE SET
+                    orders = orders + excluded.orders,
+                    first_order_date = MIN(first_order_date, excluded.first_order_date),
+                    last_order_date = MAX(last_order_date, excluded.last_order_date)
+            ''', (month, *ids))
+            conn.execute(f'INSERT OR IGNORE INTO order_archive_users (user_id, month) SELECT DISTINCT user_id, ? FROM orders WHERE id IN ({placeholders})',
+                         (month, *ids))
+            conn.execute(f'DELETE FROM order_items WHERE order_id IN ({placeholders})', ids)
+            conn.execute(f'DELETE FROM orders WHERE id IN ({placeholders})', ids)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(rows)
+
+
+def cutoff_for(days):
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def archive_shop(conn, shop_id, cutoff, batch_size=ARCHIVE_BATCH_SIZE, pause=ARCHIVE_PAUSE_S):
+    """Archives all of a shop's eligible orders, batch by batch. Returns the number moved."""
+    moved = 0
+    while True:
+        count = archive_batch(conn, shop_id, cutoff, batch_size)
+        moved += count
+        if count < batch_size:
+            return moved
+        time.sleep(pause)
+
+
+# ==============================================================================
+# --- Reading Across Live and Archive ---
+# ==============================================================================
+
+@contextmanager
+def snapshot(conn):
+    """Reads the live and archive tables in one read transaction.
+
+    An archive batch moves orders atomically, so within the snapshot every
+    order is in exactly one of them.
+    """
+    conn.execute('BEGIN')
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+
+
+def shop_months(conn, shop_id, since=None, until=None):
+    """(month, last_order_date) of archive months with orders of `shop_id` in [since, until), newest first."""
+    conditions, params = ['shop_id = ?'], [shop_id]
+    if since:
+        conditions.append('last_order_date >= ?')
+        params.append(since)
+    if until:
+        conditions.append('first_order_date < ?')
+        params.append(until)
+    # A cursor, not a list: `collect` usually stops after the first month or two.
+    return conn.execute(f"SELECT month, last_order_date FROM order_archives WHERE {' AND '.join(conditions)} ORDER BY month DESC", params)
+
+
+def user_months(conn, user_id):
+    """(month, None) of archive months with orders of `user_id`, newest first."""
+    return [(row[0], None) for row in conn.execute('SELECT month FROM order_archive_users WHERE user_id = ? ORDER BY month DESC', (user_id,))]
+
+
+def collect(fetch, months, limit=None):
+    """Runs `fetch(orders_table)` on the live table and then on each archive month, newest first.
+
+    `fetch` returns dicts with `order_id` and `order_date` (ordered and, with
+    `limit`, limited to limit + 1 rows the same way for every table). The
+    results are merged newest first. With `limit`, only limit + 1 rows are
+    kept and months entirely older than the last kept row are not read.
+    Returns (rows, {order_id: month} for the archived rows).
+    """
+    rows = fetch('orders')
+    sources = {}
+    for month, last_order_date in months:
+        if limit is not None and len(rows) > limit and last_order_date < rows[limit]['order_date']:
+            break
+        archived = fetch(orders_table(month))
+        if not archived:
+            continue
+        sources.update((row['order_id'], month) for row in archived)
+        rows = sorted(rows + archived, key=lambda row: (row['order_date'], row['order_id']), reverse=True)
+        if limit is not None:
+            rows = rows[:limit + 1]
+    return rows, sources
+
+
+# ==============================================================================
+# --- Background Archiver ---
+# ==============================================================================
+
+class Archiver:
+    """Moves old closed orders into the archive every `interval` seconds, in small batches."""
+
+    def __init__(self, after_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE, pause=ARCHIVE_PAUSE_S, interval=ARCHIVE_INTERVAL_S):
+        self.after_days = after_days
+        self.batch_size = batch_size
+        self.pause = pause
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stats = {'runs': 0, 'failures': 0, 'archived': 0, 'batches': 0, 'last_run_at': None, 'last_run_ms': None}
+
+    async def archive(self, database):
+        """Archives every shop's eligible orders; each batch is its own DB call, with a pause in between."""
+        started = time.perf_counter()
+        cutoff = cutoff_for(self.after_days)
+        shop_ids = await database.run(lambda conn: [row[0] for row in conn.execute('SELECT id FROM shops ORDER BY id')])
+        moved = batches = 0
+        for shop_id in shop_ids:
+            while True:
+                count = await database.run(archive_batch, shop_id, cutoff, self.batch_size)
+                moved, batches = moved + count, batches + 1
+                if count < self.batch_size:
+                    break
+                await asyncio.sleep(self.pause)
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['archived'] += moved
+            self._stats['batches'] += batches
+            self._stats['last_run_at'] = datetime.now(timezone.utc).isoformat()
+            self._stats['last_run_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        return moved
+
+    async def run(self, database):
+        """Archives every `interval` seconds until cancelled."""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.archive(database)
+            except Exception:
+                with self._lock:
+                    self._stats['failures'] += 1
+                logger.exception("Archiving orders failed")
+
+    def stats(self, conn=None):
+        with self._lock:
+            stats = {**self._stats, 'after_days': self.after_days, 'batch_size': self.batch_size, 'interval_s': self.interval}
+        if conn is not None:
+            stats['months'] = [dict(row) for row in conn.execute(
+                'SELECT month, SUM(orders) AS orders, MIN(first_order_date) AS first_order_date, MAX(last_order_date) AS last_order_date '
+                'FROM order_archives GROUP BY month ORDER BY month')]
+        return stats
+
+
+archiver = Archiver()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old closed orders into the monthly archive tables.")
+    parser.add_argument('command', choices=['run', 'status'])
+    parser.add_argument('--database', default=DATABASE_FILE)
+    parser.add_argument('--older-than-days', type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument('--pause', type=float, default=ARCHIVE_PAUSE_S, help="Seconds to wait between batches.")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    conn.row_factory = sqlite3.Row
+    try:
+        if args.command == 'run':
+            cutoff = cutoff_for(args.older_than_days)
+            total = 0
+            for (shop_id,) in conn.execute('SELECT id FROM shops ORDER BY id').fetchall():
+                total += archive_shop(conn, shop_id, cutoff, args.batch_size, args.pause)
+            print(f"Archived {total} orders dated before {cutoff}.")
+        for row in conn.execute('SELECT month, SUM(orders) AS orders FROM order_archives GROUP BY month ORDER BY month'):
+            print(f"  {row['month']}: {row['orders']} orders")
+        print(f"Live orders: {conn.execute('SELECT COUNT(*) FROM orders').fetchone()[0]}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
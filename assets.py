@@ -0,0 +1,255 @@
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip variants are produced without it
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:  # optional: without Pillow product grids use the full images
+    Image = None
+
+# ==============================================================================
+# --- Configuration ---
+# ==============================================================================
+
+ASSETS_SOURCE_DIR = 'static'
+# Built trees live in <dir>/static-<source digest>: workers started together
+# share one tree, and any edit under static/ produces a fresh one.
+ASSETS_BUILD_DIR = os.environ.get('CANTEEN_ASSETS_DIR', '.build')
+ASSETS_BUILD_ENABLED = os.environ.get('CANTEEN_ASSETS_BUILD', '1') != '0'
+THUMBNAIL_WIDTH = int(os.environ.get('CANTEEN_THUMBNAIL_WIDTH', '480'))
+THUMBNAIL_QUALITY = 80
+
+COMPRESSIBLE_EXTENSIONS = {'.html', '.js', '.css', '.svg', '.json', '.txt'}
+THUMBNAIL_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+MIN_COMPRESS_BYTES = 256
+FINGERPRINT_DIR = 'assets'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+MANIFEST_FILE = 'manifest.json'
+
+# src="..." / href="..." pointing at a file inside the static directory.
+LOCAL_REFERENCE_RE = re.compile(r'''(\b(?:src|href)=["'])(\.?/)?([\w./-]+\.\w+)(["'])''')
+
+
+# ==============================================================================
+# --- Manifest ---
+# ==============================================================================
+
+class AssetManifest:
+    """Maps source URLs ("/images/salad.jpg") to their fingerprinted copies."""
+
+    def __init__(self, directory, files=None, thumbnails=None):
+        self.directory = directory
+        self.files = files or {}
+        self.thumbnails = thumbnails or {}
+
+    def url(self, path):
+        return self.files.get(path, path)
+
+    def thumbnail(self, path):
+        return self.thumbnails.get(path)
+
+    def rewrite_product(self, product):
+        """Catalog hook: adds `thumbnail_url` for products whose image was built."""
+        product['thumbnail_url'] = self.thumbnail(product.get('image_url')) or None
+        return product
+
+    def save(self, source_digest):
+        with open(os.path.join(self.directory, MANIFEST_FILE), 'w') as f:
+            json.dump({'source_digest': source_digest, 'files': self.files, 'thumbnails': self.thumbnails}, f, indent=1, sort_keys=True)
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, MANIFEST_FILE)) as f:
+            data = json.load(f)
+        return cls(directory, data['files'], data['thumbnails'])
+
+
+# ==============================================================================
+# --- Build ---
+# ==============================================================================
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def _source_files(source):
+    for root, dirs, files in os.walk(source):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for name in sorted(files):
+            if not name.startswith('.'):
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, source).replace(os.sep, '/'), path
+
+
+def source_digest(source=ASSETS_SOURCE_DIR):
+    """Hash of every file name and content under `source`, plus the build settings."""
+    h = hashlib.sha256(f'{THUMBNAIL_WIDTH}:{THUMBNAIL_QUALITY}:{brotli is not None}:{Image is not None}'.encode())
+    for rel, path in _source_files(source):
+        h.update(rel.encode())
+        with open(path, 'rb') as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()[:16]
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _fingerprinted_name(rel, data, suffix=''):
+    stem, ext = os.path.splitext(rel)
+    return f'{FINGERPRINT_DIR}/{stem}{suffix}.{_digest(data)}{ext}'
+
+
+def _thumbnail(path):
+    with Image.open(path) as image:
+        if image.width <= THUMBNAIL_WIDTH:
+            return None
+        height = round(image.height * THUMBNAIL_WIDTH / image.width)
+        resized = image.convert('RGB').resize((THUMBNAIL_WIDTH, height), Image.LANCZOS)
+        out = io.BytesIO()
+        resized.save(out, format='JPEG', quality=THUMBNAIL_QUALITY, optimize=True, progressive=True)
+        return out.getvalue()
+
+
+def _compress(directory):
+    for rel, path in list(_source_files(directory)):
+        if os.path.splitext(rel)[1] not in COMPRESSIBLE_EXTENSIONS:
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < MIN_COMPRESS_BYTES:
+            continue
+        _write(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _write(path + '.br', brotli.compress(data, quality=11))
+
+
+def _build_tree(source, out):
+    files, thumbnails, pages = {}, {}, []
+    for rel, path in _source_files(source):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if rel.endswith('.html'):
+            pages.append((rel, data))
+            continue
+        # Keep the plain path working (stored image_url values, old bookmarks)
+        # and add a content-addressed copy that can be cached forever.
+        _write(os.path.join(out, rel), data)
+        fingerprinted = _fingerprinted_name(rel, data)
+        _write(os.path.join(out, fingerprinted), data)
+        files['/' + rel] = '/' + fingerprinted
+        if Image is not None and os.path.splitext(rel)[1].lower() in THUMBNAIL_EXTENSIONS:
+            thumb = _thumbnail(path)
+            if thumb is not None:
+                thumb_name = _fingerprinted_name(os.path.splitext(rel)[0] + '.jpg', thumb, f'.{THUMBNAIL_WIDTH}w')
+                _write(os.path.join(out, thumb_name), thumb)
+                thumbnails['/' + rel] = '/' + thumb_name
+
+    for rel, data in pages:
+        base = os.path.dirname('/' + rel)
+
+        def fingerprint_reference(match):
+            prefix, relative, target, quote = match.groups()
+            absolute = target if relative == '/' else os.path.normpath(os.path.join(base, target))
+            return f'{prefix}{files[absolute]}{quote}' if absolute in files else match.group(0)
+
+        html = LOCAL_REFERENCE_RE.sub(fingerprint_reference, data.decode())
+        _write(os.path.join(out, rel), html.encode())
+
+    _compress(out)
+    return files, thumbnails
+
+
+def build(source=ASSETS_SOURCE_DIR, build_dir=ASSETS_BUILD_DIR):
+    """Builds (or reuses) the served tree for the current sources and returns its manifest.
+
+    The tree is written to a temporary directory and renamed into place, so
+    several workers starting at once never see a half-built tree.
+    """
+    digest = source_digest(source)
+    out = os.path.join(build_dir, f'static-{digest}')
+    if os.path.exists(os.path.join(out, MANIFEST_FILE)):
+        return AssetManifest.load(out)
+
+    os.makedirs(build_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.staging-', dir=build_dir)
+    try:
+        files, thumbnails = _build_tree(source, staging)
+        AssetManifest(staging, files, thumbnails).save(digest)
+        os.rename(staging, out)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        if not os.path.exists(os.path.join(out, MANIFEST_FILE)):
+            raise
+    for name in os.listdir(build_dir):
+        if name.startswith('static-') and name != os.path.basename(out):
+            shutil.rmtree(os.path.join(build_dir, name), ignore_errors=True)
+    return AssetManifest.load(out)
+
+
+# ==============================================================================
+# --- Serving ---
+# ==============================================================================
+
+class AssetStaticFiles(StaticFiles):
+    """StaticFiles that serves precompressed variants and long-lived caching headers.
+
+    Picks `<file>.br` or `<file>.gz` when the client accepts it; fingerprinted
+    files under /assets/ are marked immutable, everything else must revalidate.
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        request_headers = Headers(scope=scope)
+        rel = os.path.relpath(full_path, self.directory).replace(os.sep, '/')
+        headers = {'Cache-Control': IMMUTABLE_CACHE_CONTROL if rel.startswith(FINGERPRINT_DIR + '/') else 'no-cache'}
+        media_type = None
+        path = full_path
+
+        if os.path.splitext(full_path)[1] in COMPRESSIBLE_EXTENSIONS:
+            headers['Vary'] = 'Accept-Encoding'
+            accepted = {value.split(';')[0].strip() for value in request_headers.get('accept-encoding', '').split(',')}
+            for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+                if encoding in accepted and os.path.exists(full_path + suffix):
+                    media_type = mimetypes.guess_type(full_path)[0]
+                    path = full_path + suffix
+                    stat_result = os.stat(path)
+                    headers['Content-Encoding'] = encoding
+                    break
+
+        response = FileResponse(path, status_code=status_code, headers=headers, media_type=media_type, stat_result=stat_result)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fingerprint, precompress and thumbnail the static assets.")
+    parser.add_argument('--source', default=ASSETS_SOURCE_DIR)
+    parser.add_argument('--build-dir', default=ASSETS_BUILD_DIR)
+    args = parser.parse_args()
+
+    manifest = build(args.source, args.build_dir)
+    print(f"Built {manifest.directory}: {len(manifest.files)} fingerprinted files, {len(manifest.thumbnails)} thumbnails"
+          f" (brotli {'on' if brotli else 'off'}, thumbnails {'on' if Image else 'off: install Pillow'}).")
+
+
+if __name__ == '__main__':
+    main()
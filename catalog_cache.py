@@ -0,0 +1,184 @@
+import os
+import threading
+from collections import defaultdict
+from datetime import date, datetime, time, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+import changes
+import stock
+from db_pool import pool
+
+# ==============================================================================
+# --- Process-local Catalog Cache ---
+# ==============================================================================
+
+CATALOG_CACHE_ENABLED = os.environ.get('CANTEEN_CATALOG_CACHE', '1') != '0'
+
+
+class CatalogSnapshot:
+    """An immutable copy of products, shops and categories, indexed for the API filters."""
+
+    def __init__(self, version, last_modified, products, shops, categories, day=None):
+        # `day` is set when products restock daily: which of them are sold out
+        # then depends on the date as well as the version.
+        self.version = version
+        self.day = day
+        self.last_modified = last_modified
+        self.etag = f'W/"catalog-{version}"' if day is None else f'W/"catalog-{version}-{day}"'
+        self.products = products
+        self.shops = shops
+        self.categories = categories
+        self.products_by_id = {p['id']: p for p in products}
+        self.by_shop = defaultdict(list)
+        self.by_category = defaultdict(list)
+        self.by_shop_category = defaultdict(list)
+        self._encoded = {}
+        for p in products:
+            self.by_shop[p['shop_id']].append(p)
+            self.by_category[p['category_id']].append(p)
+            self.by_shop_category[(p['shop_id'], p['category_id'])].append(p)
+
+    def filter_products(self, shop_id=None, category_id=None):
+        if shop_id and category_id:
+            return self.by_shop_category.get((shop_id, category_id), [])
+        if shop_id:
+            return self.by_shop.get(shop_id, [])
+        if category_id:
+            return self.by_category.get(category_id, [])
+        return self.products
+
+    def expired(self):
+        return self.day is not None and self.day != stock.today()
+
+    def last_modified_header(self):
+        return format_datetime(self.last_modified, usegmt=True)
+
+    def cache_headers(self):
+        return {'ETag': self.etag, 'Last-Modified': self.last_modified_header(), 'Cache-Control': 'no-cache'}
+
+    def encoded(self, key, build):
+        """A response body encoded once per snapshot: `build()` runs on the first call for `key`.
+
+        The snapshot never changes, so the bytes stay valid until the catalog
+        version moves on and a new snapshot replaces this one.
+        """
+        body = self._encoded.get(key)
+        if body is None:
+            body = self._encoded[key] = build()
+        return body
+
+    def not_modified(self, headers):
+        """True when the request's conditional headers already match this snapshot."""
+        if_none_match = headers.get('if-none-match')
+        if if_none_match is not None:
+            return self.etag in (tag.strip() for tag in if_none_match.split(',')) or if_none_match.strip() == '*'
+        if_modified_since = headers.get('if-modified-since')
+        if if_modified_since:
+            try:
+                return self.last_modified.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+class CatalogCache:
+    """Serves the catalog from memory until a write moves the catalog version on.
+
+    The version is the change log version of the latest catalog write (see
+    changes.py), read in the same transaction as the snapshot, so every worker
+    labels the same data with the same ETag. Write endpoints call
+    `invalidate()` after committing and the change feed does the same for
+    other workers' writes. A reload that races with an invalidation is used
+    for that one request but not stored, so a stale snapshot can never outlive
+    the version that replaced it.
+    """
+
+    def __init__(self, pool, enabled=CATALOG_CACHE_ENABLED):
+        self.pool = pool
+        self.enabled = enabled
+        self.version = 0
+        self.last_modified = datetime.now(timezone.utc)
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+        # Called with each product dict the catalog serves, in snapshots and
+        # write responses (see product_view); must return the dict to use.
+        self.product_hooks = []
+
+    def invalidate(self, version, changed_at=None):
+        """Drops the snapshot for a catalog change at `version`; versions already held are ignored."""
+        with self._lock:
+            if version <= self.version:
+                return
+            self.version = version
+            self.last_modified = _datetime(changed_at)
+            self._snapshot = None
+            self._stats['invalidations'] += 1
+
+    def clear(self):
+        """Drops the snapshot; the next request reloads it at whatever version the database is at."""
+        with self._lock:
+            self._snapshot = None
+
+    def cached(self):
+        """The current snapshot if it is already loaded, else None (never touches the DB)."""
+        with self._lock:
+            if self._snapshot is not None and self.enabled and not self._snapshot.expired():
+                self._stats['hits'] += 1
+                return self._snapshot
+        return None
+
+    def get(self):
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and self.enabled and not snapshot.expired():
+                self._stats['hits'] += 1
+                return snapshot
+            self._stats['misses'] += 1
+
+        snapshot = self._load()
+        with self._lock:
+            if snapshot.version >= self.version:
+                self.version, self.last_modified = snapshot.version, snapshot.last_modified
+                if self.enabled:
+                    self._snapshot = snapshot
+        return snapshot
+
+    def _load(self):
+        with self.pool.connection() as conn:
+            # One read transaction, so the version matches the rows.
+            conn.execute('BEGIN')
+            try:
+                day = stock.today()
+                version, changed_at = changes.topic_version(conn, changes.CATALOG)
+                products = [dict(row) for row in conn.execute('SELECT * FROM products ORDER BY id')]
+                shops = [dict(row) for row in conn.execute('SELECT * FROM shops')]
+                categories = [dict(row) for row in conn.execute('SELECT * FROM categories')]
+            finally:
+                conn.rollback()
+        last_modified = _datetime(changed_at)
+        daily = any(product['daily_stock'] is not None for product in products)
+        if daily:
+            # Daily stock comes back at midnight without a catalog write.
+            last_modified = max(last_modified, datetime.combine(date.fromisoformat(day), time(), timezone.utc))
+        products = [self.product_view(product, day) for product in products]
+        return CatalogSnapshot(version, last_modified, products, shops, categories, day if daily else None)
+
+    def product_view(self, product, day=None):
+        """A products row as the catalog serves it: with `sold_out` and what the product hooks add (thumbnail_url)."""
+        product = dict(product)
+        product['sold_out'] = stock.sold_out(product, day)
+        for hook in self.product_hooks:
+            product = hook(product)
+        return product
+
+    def stats(self):
+        with self._lock:
+            return {'enabled': self.enabled, 'version': self.version, **self._stats}
+
+
+def _datetime(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc) if epoch is not None else datetime.now(timezone.utc)
+
+
+catalog = CatalogCache(pool)
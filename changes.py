@@ -0,0 +1,219 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Optional
+
+from db_pool import DATABASE_FILE
+
+# ==============================================================================
+# --- Configuration ---
+# ==============================================================================
+
+# How often each worker reads the change log: the longest a write on one worker
+# takes to reach the in-memory state of the others.
+CHANGES_POLL_S = float(os.environ.get('CANTEEN_CHANGES_POLL_S', '0.1'))
+# Changes are kept this long. A worker that falls further behind resyncs instead.
+CHANGES_RETENTION_S = float(os.environ.get('CANTEEN_CHANGES_RETENTION_S', '600'))
+CHANGES_BATCH_SIZE = 500
+
+# Stamped on every change this process writes. A process applies its own
+# changes when it makes them and skips them when tailing the log.
+ORIGIN = secrets.randbits(62)
+
+# Topics and their payloads.
+CATALOG = 'catalog'                    # None: products, shops or categories changed
+SESSION_REVOKED = 'session_revoked'    # {"session_id"}
+ORDERS_CREATED = 'orders_created'      # {"orders": [[order_id, shop_id], ...]}
+ORDER_STATUS = 'order_status'          # {"orders": [[order_id, shop_id, status, version], ...]}
+
+logger = logging.getLogger('canteen.changes')
+
+
+@dataclass(frozen=True)
+class Change:
+    version: int
+    origin: int
+    topic: str
+    payload: Optional[dict]
+    changed_at: float
+
+
+# ==============================================================================
+# --- Change Log ---
+# ==============================================================================
+#
+# Every worker process keeps state in memory (the catalog snapshot, cached
+# sessions, live feed subscribers), so a write handled by one worker has to
+# reach the others. Writes append a row to change_log in the same transaction
+# as the data they change; the AUTOINCREMENT version then orders changes
+# exactly as their transactions committed. Each worker tails the log every
+# CANTEEN_CHANGES_POLL_S seconds and hands the other workers' changes to the
+# handlers registered for their topic. change_topics keeps the latest version
+# per topic, so the catalog cache can label a snapshot with the version it was
+# read at, and every worker gives the same snapshot the same ETag.
+
+def record(conn, topic, payload=None):
+    """Appends a change inside the caller's write transaction and returns it as a Change."""
+    now = time.time()
+    version = conn.execute('INSERT INTO change_log (origin, topic, payload, created_at) VALUES (?, ?, ?, ?)',
+                           (ORIGIN, topic, json.dumps(payload) if payload is not None else None, now)).lastrowid
+    conn.execute('''
+        INSERT INTO change_topics (topic, version, changed_at) VALUES (?, ?, ?)
+        ON CONFLICT (topic) DO UPDATE SET version = excluded.version, changed_at = excluded.changed_at
+    ''', (topic, version, now))
+    return Change(version, ORIGIN, topic, payload, now)
+
+
+def topic_version(conn, topic):
+    """(version, changed_at) of the latest change to `topic`; (0, None) if it has none."""
+    row = conn.execute('SELECT version, changed_at FROM change_topics WHERE topic = ?', (topic,)).fetchone()
+    return (row[0], row[1]) if row else (0, None)
+
+
+def last_version(conn):
+    """The highest version ever written, including changes already pruned."""
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+    return row[0] if row else 0
+
+
+def prune(conn, before):
+    """Deletes changes written before the epoch time `before`. Returns the number deleted."""
+    # created_at follows version order, so the first row to keep bounds a rowid range delete.
+    deleted = conn.execute('''
+        DELETE FROM change_log WHERE version < COALESCE(
+            (SELECT version FROM change_log WHERE created_at >= ? ORDER BY version LIMIT 1),
+            (SELECT MAX(version) + 1 FROM change_log))
+    ''', (before,)).rowcount
+    conn.commit()
+    return deleted
+
+
+# ==============================================================================
+# --- Change Feed ---
+# ==============================================================================
+
+class ChangeFeed:
+    """Tails change_log and applies other workers' changes to this process.
+
+    Handlers are `apply(conn, change)` per topic and run on a DB worker in
+    version order. If the log was pruned past changes this process never saw,
+    the `resync(conn)` handlers run instead, and each drops everything it
+    cached.
+    """
+
+    def __init__(self, interval=CHANGES_POLL_S, retention=CHANGES_RETENTION_S, batch_size=CHANGES_BATCH_SIZE):
+        self.interval = interval
+        self.retention = retention
+        self.batch_size = batch_size
+        self.version = None
+        self._handlers = defaultdict(list)
+        self._resync_handlers = []
+        self._last_prune = 0.0
+        self._lock = threading.Lock()
+        self._stats = {'polls': 0, 'applied': 0, 'own': 0, 'resyncs': 0, 'failures': 0, 'pruned': 0, 'last_lag_ms': None}
+
+    def subscribe(self, topic, apply):
+        self._handlers[topic].append(apply)
+
+    def on_resync(self, resync):
+        self._resync_handlers.append(resync)
+
+    def start(self, conn):
+        """Starts tailing after the newest change; state loaded from now on already includes the older ones."""
+        self.version = last_version(conn)
+
+    def poll(self, conn):
+        """Applies the changes written by other processes since the last poll. Returns how many were read."""
+        if self.version is None:
+            self.start(conn)
+        rows = conn.execute('SELECT version, origin, topic, payload, created_at FROM change_log WHERE version > ? ORDER BY version LIMIT ?',
+                            (self.version, self.batch_size)).fetchall()
+        if rows and rows[0][0] > self.version + 1:
+            self._resync(conn)
+        applied = own = 0
+        for version, origin, topic, payload, created_at in rows:
+            self.version = version
+            if origin == ORIGIN:
+                own += 1
+                continue
+            change = Change(version, origin, topic, json.loads(payload) if payload is not None else None, created_at)
+            for apply in self._handlers.get(topic, ()):
+                try:
+                    apply(conn, change)
+                except Exception:
+                    with self._lock:
+                        self._stats['failures'] += 1
+                    logger.exception("Applying change %d (%s) failed", version, topic)
+            applied += 1
+        now = time.time()
+        with self._lock:
+            self._stats['polls'] += 1
+            self._stats['applied'] += applied
+            self._stats['own'] += own
+            if rows:
+                self._stats['last_lag_ms'] = round((now - rows[-1][4]) * 1000, 2)
+        if now - self._last_prune >= self.retention / 10:
+            self._last_prune = now
+            pruned = prune(conn, now - self.retention)
+            with self._lock:
+                self._stats['pruned'] += pruned
+        return len(rows)
+
+    def _resync(self, conn):
+        logger.warning("Change log was pruned past version %d; resyncing", self.version)
+        with self._lock:
+            self._stats['resyncs'] += 1
+        for resync in self._resync_handlers:
+            resync(conn)
+
+    async def run(self, database):
+        """Polls every `interval` seconds (at once again after a full batch) until cancelled."""
+        while True:
+            try:
+                read = await database.run(self.poll)
+            except Exception:
+                read = 0
+                with self._lock:
+                    self._stats['failures'] += 1
+                logger.exception("Reading the change log failed")
+            if read < self.batch_size:
+                await asyncio.sleep(self.interval)
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'origin': ORIGIN, 'version': self.version, 'interval_s': self.interval, 'retention_s': self.retention}
+
+
+feed = ChangeFeed()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or prune the cross-worker change log.")
+    parser.add_argument('command', choices=['status', 'prune'])
+    parser.add_argument('--database', default=DATABASE_FILE)
+    parser.add_argument('--retention', type=float, default=CHANGES_RETENTION_S, help="Seconds of changes to keep when pruning.")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    try:
+        if args.command == 'prune':
+            print(f"Pruned {prune(conn, time.time() - args.retention)} changes.")
+        count, oldest = conn.execute('SELECT COUNT(*), MIN(created_at) FROM change_log').fetchone()
+        print(f"Change log: {count} changes, last version {last_version(conn)}"
+              + (f", oldest {time.time() - oldest:.0f}s ago." if oldest else "."))
+        for topic, version, changed_at in conn.execute('SELECT topic, version, changed_at FROM change_topics ORDER BY topic'):
+            print(f"  {topic}: version {version}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,11 @@
 import sqlite3
 import os
-import hashlib
+
+from passwords import hash_password
 
 # --- Configuration ---
 DATABASE_FILE = 'database.db'
 
-# --- Helper Functions ---
-def hash_password(password):
-    """Hashes a password for storing."""
-    return hashlib.sha256(password.encode()).hexdigest()
-
 # --- Main Functions ---
 def create_connection():
     """Create a database connection to the SQLite database."""
@@ -1,15 +1,15 @@
 import sqlite3
 import os
-import hashlib
+
+import kitchen
+import migrations
+import recommendations
+import rollup
+from passwords import hash_password
 
 # --- Configuration ---
 DATABASE_FILE = 'database.db'
 
-# --- Helper Functions ---
-def hash_password(password):
-    """Hashes a password for storing."""
-    return hashlib.sha256(password.encode()).hexdigest()
-
 # --- Main Functions ---
 def create_connection():
     """Create a database connection to the SQLite database."""
@@ -112,6 +112,9 @@ def seed_data(conn):
             cursor.execute("INSERT INTO orders (user_id, shop_id, total_price, status, order_date) VALUES (?, ?, ?, ?, datetime('now', '-2 day'))", (1, 1, 5.50, 'Completed'))
             order1_id = cursor.lastrowid
             cursor.execute("INSERT INTO order_items (order_id, product_id, quantity, price_per_item) VALUES (?, ?, ?, ?)", (order1_id, 1, 1, 5.50))
+            rollup.record_orders(conn, [order1_id])
+            recommendations.record_orders(conn, [order1_id])
+            kitchen.record_orders(conn, [order1_id])
             print("Added one sample completed order for history.")
 
         conn.commit()
@@ -128,6 +131,7 @@ def main():
     conn = create_connection()
     if conn is not None:
         create_tables(conn)
+        migrations.migrate(conn)
         seed_data(conn)
         conn.close()
         print("Database setup complete.")
@@ -0,0 +1,233 @@
+import asyncio
+import contextvars
+import functools
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# ==============================================================================
+# --- Configuration ---
+# ==============================================================================
+
+DATABASE_FILE = os.environ.get('CANTEEN_DATABASE_FILE', 'database.db')
+POOL_MAX_SIZE = int(os.environ.get('CANTEEN_DB_POOL_SIZE', '16'))
+BUSY_TIMEOUT_MS = int(os.environ.get('CANTEEN_DB_BUSY_TIMEOUT_MS', '5000'))
+ACQUIRE_TIMEOUT_S = float(os.environ.get('CANTEEN_DB_ACQUIRE_TIMEOUT_S', '10'))
+# Threads dedicated to SQLite work. Matching the pool size means a worker never
+# waits for a connection.
+DB_WORKERS = int(os.environ.get('CANTEEN_DB_WORKERS', str(POOL_MAX_SIZE)))
+
+# Applied to every new connection. WAL lets readers keep going while a writer
+# commits; synchronous=NORMAL is durable across application crashes in WAL mode
+# and skips the fsync on every commit.
+CONNECTION_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -16000),        # ~16 MB page cache per connection
+    ('mmap_size', 64 * 1024 * 1024),
+    ('temp_store', 'MEMORY'),
+)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the acquire timeout."""
+
+
+# ==============================================================================
+# --- Connection Pool ---
+# ==============================================================================
+
+class ConnectionPool:
+    """A bounded pool of reusable SQLite connections.
+
+    Idle connections are kept in a LIFO stack so the most recently used one
+    (with the warmest page cache) is handed out first. Connections are opened
+    with ``check_same_thread=False`` because FastAPI may run a dependency and
+    the handler using it on different threadpool workers; a connection is
+    still only ever used by one request at a time.
+    """
+
+    def __init__(self, database=DATABASE_FILE, max_size=POOL_MAX_SIZE,
+                 busy_timeout_ms=BUSY_TIMEOUT_MS, acquire_timeout=ACQUIRE_TIMEOUT_S,
+                 pragmas=CONNECTION_PRAGMAS, factory=sqlite3.Connection):
+        self.database = database
+        self.max_size = max_size
+        self.busy_timeout_ms = busy_timeout_ms
+        self.acquire_timeout = acquire_timeout
+        self.pragmas = pragmas
+        # Connection class for new connections (metrics.py swaps in a timed one).
+        self.factory = factory
+        self.connect_hooks = []
+        self._idle = deque()
+        self._cond = threading.Condition()
+        self._size = 0
+        self._closed = False
+        self._stats = {
+            'created': 0, 'acquired': 0, 'reused': 0, 'waited': 0,
+            'wait_time_ms': 0.0, 'timeouts': 0, 'discarded': 0,
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.database,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            factory=self.factory,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout_ms)}')
+        for name, value in self.pragmas:
+            conn.execute(f'PRAGMA {name} = {value}')
+        for hook in self.connect_hooks:
+            hook(conn)
+        return conn
+
+    def acquire(self):
+        """Checks out a connection, opening a new one while below max_size."""
+        deadline = wait_started = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+                if self._idle or self._size < self.max_size:
+                    if wait_started is not None:
+                        self._stats['wait_time_ms'] += (time.monotonic() - wait_started) * 1000
+                    self._stats['acquired'] += 1
+                    if self._idle:
+                        self._stats['reused'] += 1
+                        return self._idle.pop()
+                    self._size += 1
+                    break
+                if deadline is None:
+                    wait_started = time.monotonic()
+                    deadline = wait_started + self.acquire_timeout
+                    self._stats['waited'] += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f"No database connection available after {self.acquire_timeout}s")
+                self._cond.wait(remaining)
+
+        # Opening the file happens outside the lock so other callers are not held up.
+        try:
+            conn = self._connect()
+        except sqlite3.Error:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats['created'] += 1
+        return conn
+
+    def release(self, conn):
+        """Returns a connection to the pool, rolling back any open transaction."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        with self._cond:
+            if self._closed:
+                self._size -= 1
+                conn.close()
+                return
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._stats['discarded'] += 1
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'database': self.database,
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                **self._stats,
+            }
+
+    def close_all(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._idle.pop().close()
+                self._size -= 1
+            self._cond.notify_all()
+
+
+# ==============================================================================
+# --- Async Data-Access Layer ---
+# ==============================================================================
+
+class AsyncDatabase:
+    """Runs blocking sqlite3 work on a dedicated executor so handlers can `await` it.
+
+    Async handlers hand their queries to this executor instead of occupying a
+    slot in FastAPI's shared threadpool for the whole round trip, and the DB
+    worker count can be tuned independently of request concurrency.
+
+    Work runs in a copy of the caller's context, so context variables set for
+    the request are visible on the DB thread. Each `call_hooks` entry is
+    called there as `hook(queued_seconds, run_seconds)` after every call.
+    """
+
+    def __init__(self, pool, workers=DB_WORKERS):
+        self.pool = pool
+        self.workers = workers
+        self.call_hooks = []
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='canteen-db')
+
+    async def run_blocking(self, fn, *args, **kwargs):
+        """Runs `fn(*args, **kwargs)` on a DB worker thread."""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(fn, *args, **kwargs)
+        if self.call_hooks:
+            call = functools.partial(self._timed, call, time.perf_counter())
+        return await loop.run_in_executor(self._executor, contextvars.copy_context().run, call)
+
+    def _timed(self, call, submitted):
+        started = time.perf_counter()
+        try:
+            return call()
+        finally:
+            run = time.perf_counter() - started
+            for hook in self.call_hooks:
+                hook(started - submitted, run)
+
+    async def run(self, fn, *args, **kwargs):
+        """Runs `fn(conn, *args, **kwargs)` with a pooled connection on a DB worker thread."""
+        return await self.run_blocking(self._with_connection, fn, *args, **kwargs)
+
+    def _with_connection(self, fn, *args, **kwargs):
+        with self.pool.connection() as conn:
+            return fn(conn, *args, **kwargs)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+pool = ConnectionPool()
+database = AsyncDatabase(pool)
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+# ==============================================================================
+# --- In-process Order Event Bus ---
+# ==============================================================================
+
+SUBSCRIBER_QUEUE_SIZE = 100
+HEARTBEAT_SECONDS = 15
+
+
+class Subscription:
+    def __init__(self, shop_id, maxsize):
+        self.shop_id = shop_id
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = False
+
+
+class OrderEventBus:
+    """Fans order events out to per-shop subscribers (one per open dashboard).
+
+    Each subscriber gets a bounded queue. A subscriber that falls behind by
+    more than `queue_size` events is dropped: its queue is cleared and it is
+    sent a single `None`, which the stream turns into a `resync` event so the
+    client reloads a snapshot instead of the server buffering without bound.
+
+    `publish` may be called from any thread (sync handlers run on FastAPI's
+    threadpool); delivery always happens on the event loop bound at startup.
+    """
+
+    def __init__(self, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = defaultdict(set)
+        self._loop = None
+        self._lock = threading.Lock()
+        self._stats = {'published': 0, 'delivered': 0, 'dropped_subscribers': 0}
+
+    def bind_loop(self, loop):
+        self._loop = loop
+
+    def subscribe(self, shop_id):
+        sub = Subscription(shop_id, self.queue_size)
+        with self._lock:
+            self._subscribers[shop_id].add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subscribers = self._subscribers.get(sub.shop_id)
+            if subscribers is not None:
+                subscribers.discard(sub)
+                if not subscribers:
+                    del self._subscribers[sub.shop_id]
+
+    def subscribed(self, shop_id):
+        with self._lock:
+            return shop_id in self._subscribers
+
+    def resync(self):
+        """Drops every subscriber, so each client reloads a snapshot (see `_drop`)."""
+        if self._loop is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._drop_all)
+
+    def _drop_all(self):
+        with self._lock:
+            subscribers = [sub for subs in self._subscribers.values() for sub in subs]
+        for sub in subscribers:
+            if not sub.dropped:
+                self._drop(sub)
+
+    def publish(self, shop_id, event):
+        if self._loop is None or self._loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._dispatch(shop_id, event)
+        else:
+            self._loop.call_soon_threadsafe(self._dispatch, shop_id, event)
+
+    def _dispatch(self, shop_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(shop_id, ()))
+            self._stats['published'] += 1
+        for sub in subscribers:
+            if sub.dropped:
+                continue
+            try:
+                sub.queue.put_nowait(event)
+                self._stats['delivered'] += 1
+            except asyncio.QueueFull:
+                self._drop(sub)
+
+    def _drop(self, sub):
+        sub.dropped = True
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(None)
+        self.unsubscribe(sub)
+        self._stats['dropped_subscribers'] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'shops': len(self._subscribers),
+                'subscribers': sum(len(s) for s in self._subscribers.values()),
+                **self._stats,
+            }
+
+
+async def sse_stream(bus, shop_id, heartbeat=HEARTBEAT_SECONDS):
+    """Subscribes to a shop and yields Server-Sent Events until the subscription is dropped or cancelled.
+
+    The subscription is taken inside the generator, so a client that goes
+    away before the response starts never leaves a queue on the bus.
+    """
+    sub = bus.subscribe(shop_id)
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(sub.queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:
+                yield "event: resync\ndata: {}\n\n"
+                return
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+    finally:
+        bus.unsubscribe(sub)
+
+
+bus = OrderEventBus()
@@ -0,0 +1,317 @@
+import argparse
+import csv
+import heapq
+import io
+import os
+import sqlite3
+import sys
+import threading
+from datetime import date, timedelta
+
+from starlette.responses import StreamingResponse
+
+import archive
+import serialization
+from db_pool import DATABASE_FILE, pool
+
+# ==============================================================================
+# --- Configuration ---
+# ==============================================================================
+
+# Rows encoded per chunk handed to the response; bounds the memory of a running export.
+EXPORT_CHUNK_ROWS = int(os.environ.get('CANTEEN_EXPORT_CHUNK_ROWS', '2000'))
+# Each running export holds a pooled connection (and a read transaction) until it is done.
+EXPORT_MAX_RUNNING = int(os.environ.get('CANTEEN_EXPORT_MAX_RUNNING', '2'))
+
+FORMATS = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+
+
+class ExportsBusy(Exception):
+    """All EXPORT_MAX_RUNNING export slots are taken."""
+
+
+# ==============================================================================
+# --- Reports ---
+# ==============================================================================
+#
+# Every report reads the shop's orders in [since, until) from the live tables
+# and the archive months that range reaches, inside one read transaction, and
+# yields rows one at a time. Nothing is sorted or grouped by SQLite (with
+# temp_store=MEMORY a sort of a year of order lines would be held in RAM):
+# each table is read in (order_date, id) order off its (shop_id, order_date)
+# index, the tables are merged with heapq.merge, and aggregates are summed as
+# the rows go by. Memory depends on the number of tables and products, never
+# on the number of orders in the range.
+
+def _tables(conn, shop_id, since, until):
+    """(orders table, order_items table) for the live tables and the archive months overlapping the range."""
+    months = [month for month, _ in archive.shop_months(conn, shop_id, since, until)]
+    return [('orders', 'order_items')] + [(archive.orders_table(m), archive.items_table(m)) for m in reversed(months)]
+
+
+def _where(shop_id, since, until, status):
+    conditions, params = ['o.shop_id = ?'], [shop_id]
+    if since:
+        conditions.append('o.order_date >= ?')
+        params.append(since)
+    if until:
+        conditions.append('o.order_date < ?')
+        params.append(until)
+    if status:
+        conditions.append('o.status = ?')
+        params.append(status)
+    return ' AND '.join(conditions), params
+
+
+def order_lines(conn, shop_id, since=None, until=None, status=None):
+    """One row per order item, oldest order first. line_total is before tax."""
+    where, params = _where(shop_id, since, until, status)
+    cursors = [conn.execute(f'''
+        SELECT o.id, o.order_date, o.status, o.user_id, oi.product_id, p.name, oi.quantity, oi.price_per_item,
+               ROUND(oi.quantity * oi.price_per_item, 2)
+        FROM {orders_table} o JOIN {items_table} oi ON oi.order_id = o.id LEFT JOIN products p ON p.id = oi.product_id
+        WHERE {where} ORDER BY o.order_date, o.id
+    ''', params) for orders_table, items_table in _tables(conn, shop_id, since, until)]
+    return heapq.merge(*cursors, key=lambda row: (row[1], row[0]))
+
+
+def product_totals(conn, shop_id, since=None, until=None, status=None):
+    """One row per product sold in the range, by product id. subtotal is before tax."""
+    where, params = _where(shop_id, since, until, status)
+    totals = {}
+    for orders_table, items_table in _tables(conn, shop_id, since, until):
+        for product_id, quantity, price in conn.execute(f'''
+            SELECT oi.product_id, oi.quantity, oi.price_per_item
+            FROM {orders_table} o JOIN {items_table} oi ON oi.order_id = o.id WHERE {where}
+        ''', params):
+            total = totals.setdefault(product_id, [0, 0, 0.0])
+            total[0] += 1
+            total[1] += quantity
+            total[2] += quantity * price
+    names = {}
+    ids = sorted(totals)
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        names.update(conn.execute(f"SELECT id, name FROM products WHERE id IN ({','.join('?' * len(chunk))})", chunk).fetchall())
+    for product_id in ids:
+        lines, quantity, subtotal = totals[product_id]
+        yield product_id, names.get(product_id), lines, quantity, round(subtotal, 2)
+
+
+def hourly_totals(conn, shop_id, since=None, until=None, status=None):
+    """One row per hour (UTC) with orders in it, oldest first. revenue is the order totals, tax included."""
+    where, params = _where(shop_id, since, until, status)
+    cursors = [conn.execute(f'''
+        SELECT o.id, o.order_date, o.total_price,
+               (SELECT SUM(oi.quantity) FROM {items_table} oi WHERE oi.order_id = o.id)
+        FROM {orders_table} o WHERE {where} ORDER BY o.order_date, o.id
+    ''', params) for orders_table, items_table in _tables(conn, shop_id, since, until)]
+    hour, orders, items, revenue = None, 0, 0, 0.0
+    for _, order_date, total, quantity in heapq.merge(*cursors, key=lambda row: (row[1], row[0])):
+        if order_date[:13] != hour:
+            if hour is not None:
+                yield f'{hour}:00', orders, items, round(revenue, 2)
+            hour, orders, items, revenue = order_date[:13], 0, 0, 0.0
+        orders += 1
+        items += quantity or 0
+        revenue += total
+    if hour is not None:
+        yield f'{hour}:00', orders, items, round(revenue, 2)
+
+
+# report name: (columns, row generator)
+REPORTS = {
+    'lines': (('order_id', 'order_date', 'status', 'user_id', 'product_id', 'product_name', 'quantity', 'price_per_item', 'line_total'), order_lines),
+    'products': (('product_id', 'product_name', 'order_lines', 'quantity', 'subtotal'), product_totals),
+    'hourly': (('hour', 'orders', 'items', 'revenue'), hourly_totals),
+}
+
+
+def date_range(since=None, until=None):
+    """order_date bounds for the days `since` through `until` (datetime.date, both inclusive)."""
+    return since and since.isoformat(), until and (until + timedelta(days=1)).isoformat()
+
+
+# ==============================================================================
+# --- Streaming Exports ---
+# ==============================================================================
+
+class Export:
+    """One running export: a report's rows encoded as CSV or NDJSON, one chunk at a time.
+
+    `read()` does the database work and is meant to run on a DB thread; it
+    returns b'' once the report is complete, after which the connection has
+    been handed back. `close()` may be called at any time (e.g. when the
+    client disconnects) and also hands the connection back.
+    """
+
+    def __init__(self, exporter, conn, report, fmt, rows):
+        self.exporter = exporter
+        self.report = report
+        self.format = fmt
+        self.rows = 0
+        self._conn = conn
+        self._columns = REPORTS[report][0]
+        self._iter = rows
+        self._lock = threading.Lock()
+        self._buffer = io.StringIO()
+        self._csv = csv.writer(self._buffer, lineterminator='\n')
+        if fmt == 'csv':
+            self._csv.writerow(self._columns)
+
+    def read(self, chunk_rows=EXPORT_CHUNK_ROWS):
+        with self._lock:
+            if self._conn is None:
+                return b''
+            chunk = self._encode(chunk_rows)
+            if not chunk:
+                self._finish(completed=True)
+            return chunk
+
+    def _encode(self, chunk_rows):
+        count = 0
+        if self.format == 'csv':
+            for row in self._iter:
+                self._csv.writerow(row)
+                count += 1
+                if count == chunk_rows:
+                    break
+            body = self._buffer.getvalue().encode('utf-8')
+            self._buffer.seek(0)
+            self._buffer.truncate()
+        else:
+            lines = []
+            for row in self._iter:
+                lines.append(serialization.dumps(dict(zip(self._columns, row))))
+                count += 1
+                if count == chunk_rows:
+                    break
+            body = b'\n'.join(lines) + b'\n' if lines else b''
+        self.rows += count
+        return body
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._finish(completed=False)
+
+    def _finish(self, completed):
+        conn, self._conn, self._iter = self._conn, None, iter(())
+        self.exporter._done(conn, self, completed)
+
+
+class Exporter:
+    """Starts exports on pooled connections, at most `max_running` at a time."""
+
+    def __init__(self, pool, max_running=EXPORT_MAX_RUNNING):
+        self.pool = pool
+        self.max_running = max_running
+        self._running = 0
+        self._lock = threading.Lock()
+        self._stats = {'started': 0, 'completed': 0, 'aborted': 0, 'refused': 0, 'rows': 0}
+
+    def start(self, report, fmt, shop_id, since=None, until=None, status=None):
+        """Opens a read transaction and returns the Export; raises ExportsBusy when all slots are taken."""
+        with self._lock:
+            if self._running >= self.max_running:
+                self._stats['refused'] += 1
+                raise ExportsBusy(f"{self._running} exports are already running; try again shortly.")
+            self._running += 1
+            self._stats['started'] += 1
+        conn = None
+        try:
+            conn = self.pool.acquire()
+            # Every table is read from the same snapshot, so an archive batch
+            # moving orders mid-export neither drops nor repeats them.
+            conn.execute('BEGIN')
+            rows = REPORTS[report][1](conn, shop_id, since, until, status)
+            return Export(self, conn, report, fmt, rows)
+        except BaseException:
+            self._done(conn, None, completed=False)
+            raise
+
+    def _done(self, conn, export, completed):
+        if conn is not None:
+            self.pool.release(conn)
+        with self._lock:
+            self._running -= 1
+            if export is not None:
+                self._stats['completed' if completed else 'aborted'] += 1
+                self._stats['rows'] += export.rows
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'running': self._running, 'max_running': self.max_running}
+
+
+exporter = Exporter(pool)
+
+
+async def stream(database, export):
+    """Yields an export's chunks, reading each on a DB thread; hands the connection back however it ends."""
+    try:
+        while True:
+            chunk = await database.run_blocking(export.read)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        export.close()
+
+
+class ExportResponse(StreamingResponse):
+    """Streams an Export, and closes it once the response is over however it ended.
+
+    `stream()`'s cleanup only runs if the body was started; a client that is
+    gone before the first chunk (or a failed send of the headers) would
+    otherwise keep the export's pooled connection, its read transaction
+    (which holds back WAL checkpoints) and its export slot.
+    """
+
+    def __init__(self, database, export, **kwargs):
+        super().__init__(stream(database, export), **kwargs)
+        self.export = export
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.export.close()
+
+
+class _SingleConnection:
+    """A stand-in pool for the CLI, always handing out the same connection."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def acquire(self):
+        return self.conn
+
+    def release(self, conn):
+        conn.rollback()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a shop's sales report as CSV or NDJSON to stdout.")
+    parser.add_argument('report', choices=sorted(REPORTS))
+    parser.add_argument('--shop', type=int, required=True)
+    parser.add_argument('--since', type=date.fromisoformat, default=None, help="First day (YYYY-MM-DD).")
+    parser.add_argument('--until', type=date.fromisoformat, default=None, help="Last day (YYYY-MM-DD), included.")
+    parser.add_argument('--status', default=None, help="Only orders in this status, e.g. Completed.")
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    parser.add_argument('--database', default=DATABASE_FILE)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    export = Exporter(_SingleConnection(conn)).start(args.report, args.format, args.shop, *date_range(args.since, args.until), args.status)
+    try:
+        while chunk := export.read():
+            sys.stdout.buffer.write(chunk)
+    finally:
+        export.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
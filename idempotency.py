@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+# ==============================================================================
+# --- Configuration ---
+# ==============================================================================
+
+IDEMPOTENCY_TTL_S = int(os.environ.get('CANTEEN_IDEMPOTENCY_TTL_S', str(24 * 3600)))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('CANTEEN_IDEMPOTENCY_CACHE_SIZE', '10000'))
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyKeyReused(Exception):
+    """Raised when a key that already has a result is sent with a different request body."""
+
+
+class AlreadyRecorded(Exception):
+    """Raised inside an order transaction when another request committed the key first."""
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    fingerprint: str
+    status_code: int
+    body: bytes
+    expires_at: int
+
+
+def fingerprint(payload):
+    """Identifies a request body, so a reused key with a different body can be refused."""
+    return hashlib.sha256(payload if isinstance(payload, bytes) else payload.encode()).hexdigest()
+
+
+# ==============================================================================
+# --- Key Store ---
+# ==============================================================================
+
+class IdempotencyStore:
+    """Remembers the response to each (user id, Idempotency-Key) for a TTL.
+
+    Three layers keep a retried request from running twice:
+
+    * Completed results are kept in an in-memory LRU, so most retries are
+      answered without touching the database.
+    * Concurrent requests with the same key in this process wait for the
+      first one instead of running alongside it.
+    * The key is written to `idempotency_keys` in the same transaction as the
+      order it created. Its primary key decides the winner when two workers
+      (or a worker and one that restarted) race, and the loser's transaction
+      is rolled back before anything is committed.
+    """
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL_S, max_size=IDEMPOTENCY_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._results = OrderedDict()
+        self._inflight = {}  # scope -> asyncio.Future, event loop only
+        self._lock = threading.Lock()
+        self._stats = {'executed': 0, 'replayed': 0, 'cache_hits': 0, 'coalesced': 0, 'conflicts': 0, 'reused_keys': 0}
+
+    def _cached(self, scope):
+        with self._lock:
+            stored = self._results.get(scope)
+            if stored is None:
+                return None
+            if stored.expires_at <= time.time():
+                del self._results[scope]
+                return None
+            self._results.move_to_end(scope)
+            self._stats['cache_hits'] += 1
+            return stored
+
+    def _remember(self, scope, stored):
+        with self._lock:
+            self._results[scope] = stored
+            self._results.move_to_end(scope)
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+
+    def new_response(self, status_code, body, request_fingerprint):
+        return StoredResponse(request_fingerprint, status_code, body, int(time.time()) + self.ttl)
+
+    async def execute(self, scope, request_fingerprint, run):
+        """Returns (StoredResponse, replayed), calling `run()` only if the key has no result yet.
+
+        `run` is an async callable returning (StoredResponse, replayed); it
+        does the database side (see `load` and `save`). If it fails, nothing
+        is remembered and requests waiting on it try again themselves.
+        """
+        while True:
+            stored = self._cached(scope)
+            if stored is not None:
+                replayed = True
+                break
+            future = self._inflight.get(scope)
+            if future is None:
+                future = self._inflight[scope] = asyncio.get_running_loop().create_future()
+                try:
+                    stored, replayed = await run()
+                except BaseException:
+                    future.set_result(None)
+                    raise
+                else:
+                    self._remember(scope, stored)
+                    future.set_result(stored)
+                finally:
+                    del self._inflight[scope]
+                break
+            with self._lock:
+                self._stats['coalesced'] += 1
+            stored = await asyncio.shield(future)
+            if stored is not None:
+                replayed = True
+                break
+
+        with self._lock:
+            if stored.fingerprint != request_fingerprint:
+                self._stats['reused_keys'] += 1
+                raise IdempotencyKeyReused(f"{IDEMPOTENCY_HEADER} was already used for a different request")
+            self._stats['replayed' if replayed else 'executed'] += 1
+        return stored, replayed
+
+    def load(self, conn, scope):
+        """The unexpired stored response for `scope` from the database, or None. Runs on a DB worker."""
+        row = conn.execute(
+            'SELECT fingerprint, status_code, response, expires_at FROM idempotency_keys WHERE user_id = ? AND key = ? AND expires_at > ?',
+            (*scope, int(time.time()))
+        ).fetchone()
+        return StoredResponse(row[0], row[1], bytes(row[2]), row[3]) if row else None
+
+    def save(self, conn, scope, stored):
+        """Records `stored` for `scope` inside the caller's write transaction.
+
+        Raises AlreadyRecorded if an unexpired result for the key was committed
+        first, so the caller's transaction (and its order) is rolled back.
+        """
+        now = int(time.time())
+        conn.execute('DELETE FROM idempotency_keys WHERE expires_at <= ?', (now,))
+        cursor = conn.execute('''
+            INSERT INTO idempotency_keys (user_id, key, fingerprint, status_code, response, expires_at) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, key) DO NOTHING
+        ''', (*scope, stored.fingerprint, stored.status_code, stored.body, stored.expires_at))
+        if cursor.rowcount == 0:
+            with self._lock:
+                self._stats['conflicts'] += 1
+            raise AlreadyRecorded()
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'cached': len(self._results), 'in_flight': len(self._inflight), 'max_size': self.max_size, 'ttl_s': self.ttl}
+
+
+store = IdempotencyStore()
@@ -0,0 +1,209 @@
+import argparse
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+from db_pool import DATABASE_FILE
+
+# ==============================================================================
+# --- Configuration ---
+# ==============================================================================
+
+# Prep time assumed for a product (and a shop) until the kitchen has been timed.
+DEFAULT_PREP_S = float(os.environ.get('CANTEEN_KITCHEN_DEFAULT_PREP_S', '300'))
+# Weight of the newest sample in the rolling prep-time averages.
+EWMA_ALPHA = float(os.environ.get('CANTEEN_KITCHEN_EWMA_ALPHA', '0.2'))
+# Longer samples (an order forgotten overnight) say nothing about the kitchen.
+MAX_SAMPLE_S = float(os.environ.get('CANTEEN_KITCHEN_MAX_SAMPLE_S', '3600'))
+
+QUEUED_STATUS = 'Pending'
+READY_STATUS = 'Ready'
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+# ==============================================================================
+# --- Kitchen Queue Model ---
+# ==============================================================================
+#
+# Each shop's kitchen is modelled as one queue of Pending orders, served in
+# order, that an order leaves when it is marked Ready. kitchen_queues keeps one
+# row per shop with the number of Pending and Ready orders, the estimated work
+# still queued (the sum of the Pending orders' prep estimates) and the rolling
+# average time the kitchen takes per order. product_prep_stats keeps the same
+# average per product. Everything is updated in the same transaction as the
+# order write, from the order itself and the shop's row, so an event costs the
+# same however long the history is.
+#
+# An order's prep time is measured from when the kitchen could start on it -
+# its creation, or the previous order becoming Ready if that was later - to
+# when it is marked Ready. On a busy kitchen that is the time between
+# consecutive Ready orders, i.e. the live throughput, including whatever the
+# kitchen does in parallel. An order's estimate is the slowest estimate among
+# its products; its ready time is now plus the queued work plus that estimate.
+# order_status_events keeps every transition with its time.
+
+
+def timestamp(epoch):
+    """Formats epoch seconds like the schema's CURRENT_TIMESTAMP (UTC)."""
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+def _epoch(value):
+    return datetime.strptime(value, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+
+
+def _average(mean, samples, sample):
+    """Rolling average that behaves as a plain mean until it has 1/EWMA_ALPHA samples."""
+    if mean is None:
+        return sample
+    return mean + max(EWMA_ALPHA, 1.0 / (samples + 1)) * (sample - mean)
+
+
+_QUEUE_UPSERT = '''
+    INSERT INTO kitchen_queues (shop_id, pending, ready, pending_work_s) VALUES (?, ?, ?, ?)
+    ON CONFLICT (shop_id) DO UPDATE SET
+        pending = pending + excluded.pending,
+        ready = ready + excluded.ready,
+        pending_work_s = pending_work_s + excluded.pending_work_s
+'''
+
+
+def record_orders(conn, order_ids):
+    """Queues newly inserted orders and sets their estimated ready time. Call inside the inserting transaction."""
+    now = time.time()
+    estimates, events, queues = [], [], {}
+    for start in range(0, len(order_ids), 500):
+        chunk = tuple(order_ids[start:start + 500])
+        rows = conn.execute(f'''
+            SELECT o.id, o.shop_id, o.status, o.order_date,
+                   MAX(COALESCE(p.prep_mean_s, k.prep_mean_s, ?)) AS prep_s
+            FROM orders o
+            JOIN order_items oi ON oi.order_id = o.id
+            LEFT JOIN product_prep_stats p ON p.product_id = oi.product_id
+            LEFT JOIN kitchen_queues k ON k.shop_id = o.shop_id
+            WHERE o.id IN ({','.join('?' * len(chunk))})
+            GROUP BY o.id ORDER BY o.id
+        ''', (DEFAULT_PREP_S, *chunk)).fetchall()
+        for order_id, shop_id, status, order_date, prep_s in rows:
+            events.append((order_id, None, status, order_date))
+            if shop_id not in queues:
+                row = conn.execute('SELECT pending_work_s FROM kitchen_queues WHERE shop_id = ?', (shop_id,)).fetchone()
+                queues[shop_id] = [0, 0, 0.0, row[0] if row else 0.0]
+            queue = queues[shop_id]
+            if status == QUEUED_STATUS:
+                queue[0] += 1
+                queue[2] += prep_s
+                estimates.append((prep_s, timestamp(now + queue[3] + queue[2]), order_id))
+            elif status == READY_STATUS:
+                queue[1] += 1
+    conn.executemany('UPDATE orders SET estimated_prep_s = ?, estimated_ready_at = ? WHERE id = ?', estimates)
+    conn.executemany('INSERT INTO order_status_events (order_id, from_status, to_status, changed_at) VALUES (?, ?, ?, ?)', events)
+    conn.executemany(_QUEUE_UPSERT, [(shop_id, pending, ready, work) for shop_id, (pending, ready, work, _) in queues.items()])
+
+
+def move_order(conn, order_id, shop_id, old_status, new_status):
+    """Records a status change and updates the shop's queue. Call inside the updating transaction."""
+    if old_status == new_status:
+        return
+    now = time.time()
+    conn.execute('INSERT INTO order_status_events (order_id, from_status, to_status, changed_at) VALUES (?, ?, ?, ?)',
+                 (order_id, old_status, new_status, timestamp(now)))
+    order = conn.execute('SELECT estimated_prep_s, order_date FROM orders WHERE id = ?', (order_id,)).fetchone()
+    queue = conn.execute('SELECT pending, ready, pending_work_s, last_ready_at, prep_mean_s, samples FROM kitchen_queues WHERE shop_id = ?',
+                         (shop_id,)).fetchone()
+    pending, ready, work, last_ready_at, prep_mean, samples = queue if queue else (0, 0, 0.0, None, None, 0)
+    # Orders queued before estimates existed never added to the queued work.
+    prep_s = order[0] or 0.0
+
+    if old_status == QUEUED_STATUS:
+        pending, work = pending - 1, work - prep_s
+    if new_status == QUEUED_STATUS:
+        pending, work = pending + 1, work + prep_s
+    if old_status == READY_STATUS:
+        ready -= 1
+    if new_status == READY_STATUS:
+        ready += 1
+
+    if old_status == QUEUED_STATUS and new_status == READY_STATUS:
+        sample = now - max(_epoch(order[1]), last_ready_at or 0)
+        last_ready_at = now
+        if 0 < sample <= MAX_SAMPLE_S:
+            prep_mean, samples = _average(prep_mean, samples, sample), samples + 1
+            conn.execute('''
+                INSERT INTO product_prep_stats (product_id, prep_mean_s, samples)
+                SELECT DISTINCT product_id, ?, 1 FROM order_items WHERE order_id = ?
+                ON CONFLICT (product_id) DO UPDATE SET
+                    prep_mean_s = prep_mean_s + MAX(?, 1.0 / (samples + 1)) * (excluded.prep_mean_s - prep_mean_s),
+                    samples = samples + 1
+            ''', (sample, order_id, EWMA_ALPHA))
+
+    pending, ready = max(pending, 0), max(ready, 0)
+    conn.execute('''
+        INSERT INTO kitchen_queues (shop_id, pending, ready, pending_work_s, last_ready_at, prep_mean_s, samples) VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (shop_id) DO UPDATE SET
+            pending = excluded.pending, ready = excluded.ready, pending_work_s = excluded.pending_work_s,
+            last_ready_at = excluded.last_ready_at, prep_mean_s = excluded.prep_mean_s, samples = excluded.samples
+    ''', (shop_id, pending, ready, max(work, 0.0) if pending else 0.0, last_ready_at, prep_mean, samples))
+
+
+def queue_status(conn, shop_id):
+    """Queue depth and wait estimates for one shop, from its kitchen_queues row."""
+    row = conn.execute('SELECT pending, ready, pending_work_s, last_ready_at, prep_mean_s, samples FROM kitchen_queues WHERE shop_id = ?',
+                       (shop_id,)).fetchone()
+    pending, ready, work, last_ready_at, prep_mean, samples = row if row else (0, 0, 0.0, None, None, 0)
+    now = time.time()
+    prep_s = prep_mean if prep_mean is not None else DEFAULT_PREP_S
+    return {
+        "shop_id": shop_id,
+        "queue_depth": pending,
+        "ready_for_pickup": ready,
+        "queued_work_s": round(work),
+        "prep_time_s": round(prep_s),
+        "prep_time_samples": samples,
+        "estimated_ready_at": timestamp(now + work + prep_s),
+        "last_ready_at": timestamp(last_ready_at) if last_ready_at else None,
+    }
+
+
+def rebuild(conn, shop_id=None):
+    """Recomputes the queue counters from the orders table (all shops, or one); learned prep times are kept."""
+    where, params = ('AND s.id = ?', (shop_id,)) if shop_id is not None else ('', ())
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute(f'''
+            INSERT INTO kitchen_queues (shop_id, pending, ready, pending_work_s)
+            SELECT s.id,
+                   COUNT(CASE WHEN o.status = '{QUEUED_STATUS}' THEN 1 END),
+                   COUNT(CASE WHEN o.status = '{READY_STATUS}' THEN 1 END),
+                   TOTAL(CASE WHEN o.status = '{QUEUED_STATUS}' THEN o.estimated_prep_s END)
+            FROM shops s LEFT JOIN orders o ON o.shop_id = s.id AND o.status IN ('{QUEUED_STATUS}', '{READY_STATUS}')
+            WHERE 1 {where}
+            GROUP BY s.id
+            ON CONFLICT (shop_id) DO UPDATE SET
+                pending = excluded.pending, ready = excluded.ready, pending_work_s = excluded.pending_work_s
+        ''', params)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the kitchen queue counters from orders.")
+    parser.add_argument('command', choices=['rebuild'])
+    parser.add_argument('--database', default=DATABASE_FILE)
+    parser.add_argument('--shop', type=int, default=None, help="Only this shop.")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    try:
+        rebuild(conn, args.shop)
+        print("kitchen_queues rebuilt from orders.")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
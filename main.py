@@ -1,11 +1,34 @@
+import asyncio
 import sqlite3
-import hashlib
-from fastapi import FastAPI, HTTPException, Body, Query
+import base64
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Body, Query, Depends, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, EmailStr
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, EmailStr, Field
 from typing import List, Optional
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+
+import archive
+import assets
+import changes
+import events
+import exports
+import idempotency
+import kitchen
+import metrics
+import migrations
+import order_status
+import orders
+import passwords
+import product_import
+import recommendations
+import search
+import serialization
+import sessions
+import stock
+from catalog_cache import catalog, CatalogSnapshot
+from db_pool import database, pool, AsyncDatabase, PoolTimeout
 
 # ==============================================================================
 # --- Pydantic Models for Data Validation ---
@@ -20,6 +43,10 @@ class User(BaseModel):
     shop_id: Optional[int] = None
     class Config: from_attributes = True
 
+class LoginResponse(User):
+    token: str
+    expires_at: int
+
 # NEW: Model for student signup
 class UserCreate(BaseModel):
     email: EmailStr
@@ -48,10 +75,13 @@ class Product(BaseModel):
     price: float
     description: Optional[str] = None
     image_url: Optional[str] = None
+    thumbnail_url: Optional[str] = None
     category_id: int
     shop_id: int
+    sold_out: bool = False
     class Config: from_attributes = True
 
+# stock: units left (None: not tracked); daily_stock: units to start each day with.
 class ProductCreate(BaseModel):
     name: str
     price: float
@@ -59,6 +89,8 @@ class ProductCreate(BaseModel):
     image_url: Optional[str] = None
     category_id: int
     shop_id: int
+    stock: Optional[int] = Field(None, ge=0)
+    daily_stock: Optional[int] = Field(None, ge=0)
 
 class ProductUpdate(BaseModel):
     name: Optional[str] = None
@@ -66,6 +98,8 @@ class ProductUpdate(BaseModel):
     description: Optional[str] = None
     image_url: Optional[str] = None
     category_id: Optional[int] = None
+    stock: Optional[int] = Field(None, ge=0)
+    daily_stock: Optional[int] = Field(None, ge=0)
 
 class OrderItemCreate(BaseModel):
     id: int # product_id
@@ -74,11 +108,22 @@ class OrderItemCreate(BaseModel):
 class OrderCreate(BaseModel):
     user_id: int
     shop_id: int
-    total_price: float
+    # Ignored: the total is computed server-side from current product prices.
+    total_price: Optional[float] = None
     items: List[OrderItemCreate]
 
+class BulkOrderCreate(BaseModel):
+    orders: List[OrderCreate]
+
 class OrderStatusUpdate(BaseModel):
     status: str
+    version: Optional[int] = Field(None, description="The version the client last saw; the update is refused if the order has moved since")
+
+class OrderTransition(OrderStatusUpdate):
+    order_id: int
+
+class OrderTransitionBatch(BaseModel):
+    orders: List[OrderTransition] = Field(..., min_length=1, max_length=order_status.STATUS_BATCH_MAX)
 
 class DashboardStats(BaseModel):
     total_orders_today: int
@@ -90,14 +135,56 @@ class OrderSummary(BaseModel):
     ready: List[dict]
     completed: List[dict]
 
+class LiveOrders(BaseModel):
+    pending: List[dict]
+    ready: List[dict]
+
+class OrderHistoryPage(BaseModel):
+    orders: List[dict]
+    next_cursor: Optional[str] = None
+
 class ShopUpdate(BaseModel):
     name: str
 
+# Row -> response-model shape for handlers that return trusted JSON directly.
+shop_shape = serialization.shape(Shop)
+category_shape = serialization.shape(Category)
+product_shape = serialization.shape(Product)
+
 # ==============================================================================
 # --- FastAPI App Initialization & Middleware ---
 # ==============================================================================
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    with pool.connection() as conn:
+        migrations.migrate(conn)
+        changes.feed.start(conn)
+        recommendations.recommender.refresh(conn)
+    events.bus.bind_loop(asyncio.get_running_loop())
+    change_feed = asyncio.create_task(changes.feed.run(database))
+    order_writer = asyncio.create_task(orders.queue.run())
+    refresher = asyncio.create_task(recommendations.recommender.run(database))
+    archiver = asyncio.create_task(archive.archiver.run(database)) if archive.ARCHIVE_ENABLED else None
+    yield
+    change_feed.cancel()
+    order_writer.cancel()
+    refresher.cancel()
+    if archiver:
+        archiver.cancel()
+    passwords.hashing.shutdown()
+    database.shutdown()
+    pool.close_all()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+@app.exception_handler(passwords.HasherBusy)
+async def hasher_busy_handler(request: Request, exc: passwords.HasherBusy):
+    return JSONResponse(status_code=503, content={"detail": "Too many logins in progress, please retry."}, headers={"Retry-After": "1"})
 
 app.add_middleware(
     CORSMiddleware,
@@ -107,17 +194,161 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Added last so it wraps everything else, CORS included.
+if metrics.METRICS_ENABLED:
+    metrics.install(pool, database)
+    app.add_middleware(metrics.MetricsMiddleware)
+
 # ==============================================================================
 # --- Database Setup & Helpers ---
 # ==============================================================================
 
-def get_db_connection():
-    conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+async def get_db():
+    """FastAPI dependency giving handlers the async data-access layer.
+
+    Handlers pass a `query(conn)` function to `db.run()`, which executes it with
+    a pooled connection on the dedicated DB executor and awaits the result, so
+    the event loop and FastAPI's threadpool are never blocked on SQLite.
+    """
+    return database
+
+# Item hydration is done in chunks so a long order list never exceeds SQLite's
+# bound-variable limit.
+ITEM_HYDRATION_CHUNK = 500
+
+def attach_order_items(conn, orders, item_columns="oi.order_id, oi.quantity, p.name as product_name, p.image_url", items_table="order_items"):
+    """Adds an `items` list to every order dict (keyed by `order_id`) in place."""
+    orders_map = {order['order_id']: order for order in orders}
+    for order in orders_map.values(): order['items'] = []
+    order_ids = list(orders_map.keys())
+    for start in range(0, len(order_ids), ITEM_HYDRATION_CHUNK):
+        chunk = order_ids[start:start + ITEM_HYDRATION_CHUNK]
+        items_raw = conn.execute(f"SELECT {item_columns} FROM {items_table} oi JOIN products p ON oi.product_id = p.id WHERE oi.order_id IN ({','.join('?'*len(chunk))})", tuple(chunk)).fetchall()
+        for item in items_raw:
+            orders_map[item['order_id']]['items'].append(dict(item))
+    return orders
+
+def attach_collected_items(conn, orders, sources, item_columns="oi.order_id, oi.quantity, p.name as product_name, p.image_url"):
+    """attach_order_items for orders gathered by archive.collect, reading each archived order's items from its month."""
+    by_month = {}
+    for order in orders:
+        by_month.setdefault(sources.get(order['order_id']), []).append(order)
+    for month, group in by_month.items():
+        attach_order_items(conn, group, item_columns, "order_items" if month is None else archive.items_table(month))
+    return orders
+
+def fetch_live_order(conn, order_id):
+    """A single order in the shape the live dashboard renders, for push events."""
+    row = conn.execute("SELECT o.id as order_id, o.total_price, o.status, o.version, o.order_date, u.first_name, u.last_name FROM orders o JOIN users u ON o.user_id = u.id WHERE o.id = ?", (order_id,)).fetchone()
+    if not row:
+        return None
+    return attach_order_items(conn, [dict(row)])[0]
+
+def encode_cursor(order_date, order_id):
+    return base64.urlsafe_b64encode(f"{order_date}|{order_id}".encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        order_date, order_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+        return order_date, int(order_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# Writes handled by other workers reach this one through the change log (see
+# changes.py); this worker's own writes update its state directly.
+
+def apply_catalog_change(conn, change):
+    catalog.invalidate(change.version, change.changed_at)
+    # An owner may have restocked; only this worker's own checkouts are remembered anyway.
+    stock.reservations.forget()
+
+def apply_orders_created(conn, change):
+    for order_id, shop_id in change.payload['orders']:
+        if events.bus.subscribed(shop_id):
+            order = fetch_live_order(conn, order_id)
+            if order is not None:
+                events.bus.publish(shop_id, {"type": "order_created", "order": order})
+
+def publish_order_status(moved):
+    for order_id, shop_id, status, version in moved:
+        events.bus.publish(shop_id, {"type": "order_status", "order_id": order_id, "status": status, "version": version})
+
+def apply_order_status(conn, change):
+    publish_order_status(change.payload['orders'])
+
+changes.feed.subscribe(changes.CATALOG, apply_catalog_change)
+changes.feed.subscribe(changes.SESSION_REVOKED, lambda conn, change: sessions.store.forget(change.payload['session_id']))
+changes.feed.subscribe(changes.ORDERS_CREATED, apply_orders_created)
+changes.feed.subscribe(changes.ORDER_STATUS, apply_order_status)
+changes.feed.on_resync(lambda conn: catalog.clear())
+changes.feed.on_resync(lambda conn: sessions.store.clear())
+changes.feed.on_resync(lambda conn: events.bus.resync())
+
+async def cached_catalog(request: Request, response: Response):
+    """FastAPI dependency returning the cached catalog snapshot.
+
+    Sets ETag/Last-Modified on the response and answers 304 when the client's
+    conditional headers already match the current catalog version.
+    """
+    snapshot = catalog.cached() or await database.run_blocking(catalog.get)
+    headers = snapshot.cache_headers()
+    if snapshot.not_modified(request.headers):
+        raise HTTPException(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return snapshot
+
+def product_json(snapshot, product):
+    return snapshot.encoded(('product', product['id']), lambda: serialization.dumps(product_shape(product)))
+
+def catalog_response(snapshot, key, build):
+    """Returns a catalog view encoded once per snapshot, with the snapshot's cache headers.
+
+    `build()` returns the already-encoded body. Returning a Response skips
+    response-model validation; the route's response_model still documents it.
+    """
+    return serialization.TrustedJSONResponse(snapshot.encoded(key, build), headers=snapshot.cache_headers())
+
+def products_response(snapshot, key, products):
+    # `products` may be a generator; it is only consumed the first time `key` is encoded.
+    return catalog_response(snapshot, key, lambda: b'[' + b','.join(product_json(snapshot, p) for p in products) + b']')
+
+async def recommendation_snapshots():
+    """The catalog snapshot and the current recommendation lists (computed once if not yet loaded)."""
+    snapshot = catalog.cached() or await database.run_blocking(catalog.get)
+    recs = recommendations.recommender.current() or await database.run(recommendations.recommender.refresh)
+    return snapshot, recs
 
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+def recommendations_response(snapshot, products):
+    # Lists change on the refresh schedule, not with the catalog version, so
+    # they are cached for a fraction of the interval instead of using the ETag.
+    max_age = int(recommendations.REFRESH_INTERVAL_S // 5)
+    body = b'[' + b','.join(product_json(snapshot, p) for p in products) + b']'
+    return serialization.TrustedJSONResponse(body, headers={"Cache-Control": f"public, max-age={max_age}"})
+
+async def current_session(request: Request) -> sessions.Session:
+    """FastAPI dependency resolving the caller's session.
+
+    Accepts `Authorization: Bearer <token>` or the session cookie set by
+    /login. Cached sessions are resolved in memory; only a valid token whose
+    session is not cached costs a DB round trip.
+    """
+    scheme, _, token = request.headers.get('authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        token = request.cookies.get(sessions.SESSION_COOKIE)
+    session = sessions.store.lookup(token) if token else None
+    if isinstance(session, tuple):
+        session = await database.run(sessions.store.load, session)
+    if session is None:
+        raise HTTPException(status_code=401, detail="Not logged in or session expired", headers={"WWW-Authenticate": "Bearer"})
+    return session
+
+def require_user(session, user_id):
+    if session.user_id != user_id:
+        raise HTTPException(status_code=403, detail="Not allowed to act for another user")
+
+def require_owner(session, shop_id):
+    if session.role != 'owner' or session.shop_id is None or session.shop_id != shop_id:
+        raise HTTPException(status_code=403, detail="Not allowed to manage this shop")
 
 # ==============================================================================
 # --- API Endpoints ---
@@ -125,328 +356,701 @@ def hash_password(password):
 
 # --- User Authentication Endpoints ---
 
-@app.post("/login", response_model=User)
-def login(email: str = Body(...), password: str = Body(...)):
-    """Authenticates both students and shop owners."""
-    conn = get_db_connection()
-    user = conn.execute(
-        'SELECT * FROM users WHERE email = ? AND password = ?', 
-        (email, hash_password(password))
-    ).fetchone()
-    conn.close()
-    if not user:
+@app.post("/login", response_model=LoginResponse)
+async def login(request: Request, response: Response, email: str = Body(...), password: str = Body(...), db: AsyncDatabase = Depends(get_db)):
+    """Authenticates both students and shop owners.
+
+    Legacy or outdated password hashes are re-hashed with the current KDF
+    settings on a successful login.
+    """
+    # Behind a reverse proxy, run uvicorn with --forwarded-allow-ips so request.client is the student's address.
+    ip = request.client.host if request.client else ''
+    retry_after = passwords.login_limiter.check(email, ip)
+    if retry_after:
+        raise HTTPException(status_code=429, detail="Too many login attempts, please try again later.", headers={"Retry-After": str(retry_after)})
+
+    def query(conn):
+        return conn.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
+    user = await db.run(query)
+    stored = user['password'] if user else passwords.dummy_hash()
+    matches, needs_rehash = await passwords.hashing.verify(password, stored)
+    if not user or not matches:
+        passwords.login_limiter.failed(email, ip)
         raise HTTPException(status_code=401, detail="Invalid email or password")
-    return dict(user)
+    passwords.login_limiter.reset(email)
+
+    if needs_rehash:
+        upgraded = await passwords.hashing.hash(password)
+        def upgrade(conn):
+            # Only replace the hash we verified, in case the password changed meanwhile.
+            conn.execute('UPDATE users SET password = ? WHERE id = ? AND password = ?', (upgraded, user['id'], stored))
+            conn.commit()
+        await db.run(upgrade)
+
+    token, session = sessions.store.issue(user)
+    response.set_cookie(sessions.SESSION_COOKIE, token, max_age=sessions.store.ttl, httponly=True, samesite='lax')
+    return {**dict(user), "token": token, "expires_at": session.expires_at}
+
+@app.post("/logout")
+async def logout(response: Response, session: sessions.Session = Depends(current_session), db: AsyncDatabase = Depends(get_db)):
+    """Revokes the current session token."""
+    await db.run(sessions.store.revoke, session)
+    response.delete_cookie(sessions.SESSION_COOKIE)
+    return {"message": "Logged out"}
 
 # NEW: Endpoint for student registration
 @app.post("/signup", status_code=201)
-def signup(user_data: UserCreate):
+async def signup(user_data: UserCreate, db: AsyncDatabase = Depends(get_db)):
     """Creates a new student user."""
-    conn = get_db_connection()
-    
-    # Check if user already exists
-    existing_user = conn.execute('SELECT id FROM users WHERE email = ?', (user_data.email,)).fetchone()
-    if existing_user:
-        conn.close()
-        raise HTTPException(status_code=400, detail="An account with this email already exists.")
-        
-    hashed_password = hash_password(user_data.password)
-    
-    try:
-        conn.execute(
-            'INSERT INTO users (email, password, first_name, last_name, role) VALUES (?, ?, ?, ?, ?)',
-            (user_data.email, hashed_password, user_data.first_name, user_data.last_name, 'student')
-        )
-        conn.commit()
-    except sqlite3.Error as e:
-        conn.rollback()
-        raise HTTPException(status_code=500, detail=f"Database error: {e}")
-    finally:
-        conn.close()
-        
-    return {"message": "Account created successfully! Please log in."}
+    hashed_password = await passwords.hashing.hash(user_data.password)
+
+    def query(conn):
+        # Check if user already exists
+        existing_user = conn.execute('SELECT id FROM users WHERE email = ?', (user_data.email,)).fetchone()
+        if existing_user:
+            raise HTTPException(status_code=400, detail="An account with this email already exists.")
+
+        try:
+            conn.execute(
+                'INSERT INTO users (email, password, first_name, last_name, role) VALUES (?, ?, ?, ?, ?)',
+                (user_data.email, hashed_password, user_data.first_name, user_data.last_name, 'student')
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            raise HTTPException(status_code=500, detail=f"Database error: {e}")
+
+        return {"message": "Account created successfully! Please log in."}
+    return await db.run(query)
 
 
 @app.put("/users/{user_id}", response_model=User)
-def update_user(user_id: int, user_update: UserUpdate):
+async def update_user(user_id: int, user_update: UserUpdate, session: sessions.Session = Depends(current_session), db: AsyncDatabase = Depends(get_db)):
     """Flexibly updates user details. Works for both student and owner profiles."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    require_user(session, user_id)
+    def query(conn):
+        cursor = conn.cursor()
     
-    if not cursor.execute('SELECT 1 FROM users WHERE id = ?', (user_id,)).fetchone():
-        conn.close()
-        raise HTTPException(status_code=404, detail="User not found")
+        if not cursor.execute('SELECT 1 FROM users WHERE id = ?', (user_id,)).fetchone():
+            raise HTTPException(status_code=404, detail="User not found")
         
-    update_data = user_update.model_dump(exclude_unset=True)
-    if not update_data:
-        conn.close()
-        # If no data, just return the current user state
-        current_user = cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
-        return dict(current_user)
-
-    set_clause = ", ".join([f"{key} = ?" for key in update_data.keys()])
-    params = list(update_data.values()) + [user_id]
+        update_data = user_update.model_dump(exclude_unset=True)
+        if not update_data:
+            # If no data, just return the current user state
+            current_user = cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+            return dict(current_user)
+
+        set_clause = ", ".join([f"{key} = ?" for key in update_data.keys()])
+        params = list(update_data.values()) + [user_id]
     
-    cursor.execute(f'UPDATE users SET {set_clause} WHERE id = ?', tuple(params))
-    conn.commit()
+        cursor.execute(f'UPDATE users SET {set_clause} WHERE id = ?', tuple(params))
+        conn.commit()
     
-    updated_user = cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
-    conn.close()
-    return dict(updated_user)
+        updated_user = cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+        return dict(updated_user)
+    return await db.run(query)
 
 # --- Other Endpoints (Unchanged) ---
 
 @app.get("/shops", response_model=List[Shop])
-def get_shops():
-    conn = get_db_connection()
-    shops = conn.execute('SELECT * FROM shops').fetchall()
-    conn.close()
-    return [dict(row) for row in shops]
+async def get_shops(snapshot: CatalogSnapshot = Depends(cached_catalog)):
+    return catalog_response(snapshot, 'shops', lambda: serialization.dumps([shop_shape(s) for s in snapshot.shops]))
 
 @app.put("/shops/{shop_id}", response_model=Shop)
-def update_shop(shop_id: int, shop_update: ShopUpdate):
-    conn = get_db_connection()
-    existing_shop = conn.execute('SELECT 1 FROM shops WHERE id = ?', (shop_id,)).fetchone()
-    if not existing_shop:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Shop not found")
-    try:
-        conn.execute('UPDATE shops SET name = ? WHERE id = ?', (shop_update.name, shop_id))
-        conn.commit()
-    except sqlite3.IntegrityError:
-        conn.close()
-        raise HTTPException(status_code=400, detail="A shop with this name already exists.")
-    updated_shop = conn.execute('SELECT * FROM shops WHERE id = ?', (shop_id,)).fetchone()
-    conn.close()
-    return dict(updated_shop)
+async def update_shop(shop_id: int, shop_update: ShopUpdate, session: sessions.Session = Depends(current_session), db: AsyncDatabase = Depends(get_db)):
+    require_owner(session, shop_id)
+    def query(conn):
+        existing_shop = conn.execute('SELECT 1 FROM shops WHERE id = ?', (shop_id,)).fetchone()
+        if not existing_shop:
+            raise HTTPException(status_code=404, detail="Shop not found")
+        try:
+            conn.execute('UPDATE shops SET name = ? WHERE id = ?', (shop_update.name, shop_id))
+            change = changes.record(conn, changes.CATALOG)
+            conn.commit()
+        except sqlite3.IntegrityError:
+            conn.rollback()
+            raise HTTPException(status_code=400, detail="A shop with this name already exists.")
+        catalog.invalidate(change.version, change.changed_at)
+        updated_shop = conn.execute('SELECT * FROM shops WHERE id = ?', (shop_id,)).fetchone()
+        return dict(updated_shop)
+    return await db.run(query)
 
 @app.get("/categories", response_model=List[Category])
-def get_categories():
-    conn = get_db_connection()
-    categories = conn.execute('SELECT * FROM categories').fetchall()
-    conn.close()
-    return [dict(row) for row in categories]
+async def get_categories(snapshot: CatalogSnapshot = Depends(cached_catalog)):
+    return catalog_response(snapshot, 'categories', lambda: serialization.dumps([category_shape(c) for c in snapshot.categories]))
 
 @app.get("/products", response_model=List[Product])
-def get_all_products(shop_id: Optional[int] = Query(None), category_id: Optional[int] = Query(None)):
-    conn = get_db_connection()
-    query = 'SELECT * FROM products'
-    params = []
-    conditions = []
-    if shop_id:
-        conditions.append('shop_id = ?')
-        params.append(shop_id)
-    if category_id:
-        conditions.append('category_id = ?')
-        params.append(category_id)
-    if conditions:
-        query += ' WHERE ' + ' AND '.join(conditions)
-    products = conn.execute(query, params).fetchall()
-    conn.close()
-    return [dict(row) for row in products]
+async def get_all_products(
+    shop_id: Optional[int] = Query(None),
+    category_id: Optional[int] = Query(None),
+    include_sold_out: bool = Query(False),
+    snapshot: CatalogSnapshot = Depends(cached_catalog),
+):
+    """Lists the catalog; products that are sold out are left out unless `include_sold_out` is set."""
+    products = snapshot.filter_products(shop_id, category_id)
+    if not include_sold_out:
+        products = (p for p in products if not p['sold_out'])
+    return products_response(snapshot, ('products', shop_id, category_id, include_sold_out), products)
 
 @app.post("/orders", status_code=201)
-def create_order(order: OrderCreate):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+async def create_order(
+    order: OrderCreate,
+    idempotency_key: Optional[str] = Header(None, alias=idempotency.IDEMPOTENCY_HEADER),
+    session: sessions.Session = Depends(current_session),
+    db: AsyncDatabase = Depends(get_db),
+):
+    """Places one order.
+
+    With an Idempotency-Key header, retries of the same request (same user,
+    key and body) within the key's TTL get the original response back, marked
+    `Idempotent-Replayed: true`, and place no further order. Reusing a key for
+    a different body is rejected with 422.
+    """
+    require_user(session, order.user_id)
+    if idempotency_key is None:
+        return await place_order(db, order)
+    if not 0 < len(idempotency_key) <= idempotency.MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"{idempotency.IDEMPOTENCY_HEADER} must be 1-{idempotency.MAX_KEY_LENGTH} characters")
+
+    scope = (session.user_id, idempotency_key)
+    request_fingerprint = idempotency.fingerprint(order.model_dump_json())
+
+    async def place():
+        stored = await db.run(idempotency.store.load, scope)
+        if stored is not None:
+            return stored, True
+        def record(conn, result):
+            nonlocal stored
+            stored = idempotency.store.new_response(201, serialization.dumps(result), request_fingerprint)
+            idempotency.store.save(conn, scope, stored)
+        try:
+            await place_order(db, order, before_commit=record)
+        except idempotency.AlreadyRecorded:
+            # Another worker committed this key first; our order was rolled back.
+            return await db.run(idempotency.store.load, scope), True
+        return stored, False
+
     try:
-        cursor.execute(
-            'INSERT INTO orders (user_id, shop_id, total_price, status) VALUES (?, ?, ?, ?)',
-            (order.user_id, order.shop_id, order.total_price, 'Pending')
-        )
-        order_id = cursor.lastrowid
-        items_data = []
-        for item in order.items:
-            product_price = cursor.execute('SELECT price FROM products WHERE id = ?', (item.id,)).fetchone()['price']
-            items_data.append((order_id, item.id, item.quantity, product_price))
-        
-        cursor.executemany(
-            'INSERT INTO order_items (order_id, product_id, quantity, price_per_item) VALUES (?, ?, ?, ?)',
-            items_data
-        )
-        conn.commit()
-    except (sqlite3.Error, TypeError) as e:
-        conn.rollback()
-        raise HTTPException(status_code=500, detail=f"Database error creating order: {e}")
-    finally:
-        conn.close()
-    return {"message": "Order created successfully", "order_id": order_id}
+        stored, replayed = await idempotency.store.execute(scope, request_fingerprint, place)
+    except idempotency.IdempotencyKeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    headers = {idempotency.REPLAYED_HEADER: 'true'} if replayed else None
+    return serialization.TrustedJSONResponse(stored.body, status_code=stored.status_code, headers=headers)
+
+async def place_order(db, order, before_commit=None):
+    """Places one order and returns its response body.
+
+    `before_commit(conn, result)` runs inside the insert transaction with the
+    response body the order will get.
+    """
+    result = {}
+    def hook(conn, order_ids):
+        result.update(order_result(conn, order_ids[0]))
+        if before_commit is not None:
+            before_commit(conn, result)
+    await place_orders(db, [order], before_commit=hook)
+    return result
+
+async def place_orders(db, order_list, before_commit=None):
+    """Places orders, all or nothing, through the group-committed order queue and announces them on the live feed.
+
+    Returns [(order_id, total_price), ...]. `before_commit(conn, order_ids)`
+    runs inside the insert transaction.
+    """
+    try:
+        placed = await orders.queue.submit(order_list, before_commit)
+    except stock.SoldOutError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except orders.OrderValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except sqlite3.Error as e:
+        raise HTTPException(status_code=500, detail=f"Database error creating {'orders' if len(order_list) > 1 else 'order'}: {e}")
+    watched = [(order_id, order.shop_id) for (order_id, _), order in zip(placed, order_list) if events.bus.subscribed(order.shop_id)]
+    if watched:
+        def announce(conn):
+            for order_id, shop_id in watched:
+                events.bus.publish(shop_id, {"type": "order_created", "order": fetch_live_order(conn, order_id)})
+        await db.run(announce)
+    return placed
+
+def order_result(conn, order_id):
+    total, estimated_ready_at = conn.execute('SELECT total_price, estimated_ready_at FROM orders WHERE id = ?', (order_id,)).fetchone()
+    return {"message": "Order created successfully", "order_id": order_id, "total_price": total, "estimated_ready_at": estimated_ready_at}
+
+@app.post("/orders/bulk", status_code=201)
+async def create_orders_bulk(bulk: BulkOrderCreate, session: sessions.Session = Depends(current_session), db: AsyncDatabase = Depends(get_db)):
+    """Places many orders (kiosks, pre-order imports) in a single transaction; all or nothing.
+
+    Students may only place their own orders; a shop owner may place orders
+    for any user at their own shop.
+    """
+    if not bulk.orders:
+        raise HTTPException(status_code=400, detail="No orders provided")
+    for order in bulk.orders:
+        if not (session.role == 'owner' and order.shop_id == session.shop_id):
+            require_user(session, order.user_id)
+    placed = await place_orders(db, bulk.orders)
+    return {
+        "message": f"{len(placed)} orders created successfully",
+        "orders": [{"order_id": order_id, "total_price": total} for order_id, total in placed],
+    }
 
 @app.get("/orders/user/{user_id}", response_model=List[dict])
-def get_user_orders(user_id: int):
-    conn = get_db_connection()
-    orders_raw = conn.execute('''
-        SELECT o.id as order_id, o.total_price, o.status, o.order_date, s.name as shop_name
-        FROM orders o JOIN shops s ON o.shop_id = s.id
-        WHERE o.user_id = ? ORDER BY o.order_date DESC
-    ''', (user_id,)).fetchall()
-    
-    if not orders_raw:
-        conn.close()
-        return []
+async def get_user_orders(user_id: int, session: sessions.Session = Depends(current_session), db: AsyncDatabase = Depends(get_db)):
+    require_user(session, user_id)
+    def query(conn):
+        def fetch(orders_table):
+            return [dict(row) for row in conn.execute(f'''
+                SELECT o.id as order_id, o.total_price, o.status, o.order_date, o.estimated_ready_at, s.name as shop_name
+                FROM {orders_table} o JOIN shops s ON o.shop_id = s.id
+                WHERE o.user_id = ? ORDER BY o.order_date DESC, o.id DESC
+            ''', (user_id,))]
+        with archive.snapshot(conn):
+            orders, sources = archive.collect(fetch, archive.user_months(conn, user_id))
+            return attach_collected_items(conn, orders, sources, "oi.order_id, oi.quantity, oi.price_per_item, p.name as product_name, p.image_url")
+    return serialization.TrustedJSONResponse(await db.run(query))
 
-    orders_map = {row['order_id']: dict(row) for row in orders_raw}
-    for order in orders_map.values(): order['items'] = []
-    
-    order_ids = list(orders_map.keys())
-    items_raw = conn.execute(f'''
-        SELECT oi.order_id, oi.quantity, oi.price_per_item, p.name as product_name, p.image_url
-        FROM order_items oi JOIN products p ON oi.product_id = p.id
-        WHERE oi.order_id IN ({",".join("?"*len(order_ids))})
-    ''', tuple(order_ids)).fetchall()
-    
-    for item in items_raw:
-        orders_map[item['order_id']]['items'].append(dict(item))
-        
-    conn.close()
-    return list(orders_map.values())
+@app.get("/products/search", response_model=List[Product])
+async def search_products(
+    q: str = Query(..., min_length=1, max_length=100, description="Words to search for; the last one may be partial"),
+    shop_id: Optional[int] = Query(None),
+    category_id: Optional[int] = Query(None),
+    limit: int = Query(search.SEARCH_DEFAULT_LIMIT, ge=1, le=search.SEARCH_MAX_LIMIT),
+    snapshot: CatalogSnapshot = Depends(cached_catalog),
+    db: AsyncDatabase = Depends(get_db),
+):
+    """Full-text product search over name and description, best matches first.
+
+    Matching ids come from the FTS5 index; the products themselves are taken
+    from the catalog snapshot, whose ETag also covers these results.
+    """
+    ids = await db.run(search.search_product_ids, q, shop_id, category_id, limit)
+    products = (snapshot.products_by_id.get(i) for i in ids)
+    body = b','.join(product_json(snapshot, p) for p in products if p is not None and not p['sold_out'])
+    return serialization.TrustedJSONResponse(b'[' + body + b']', headers=snapshot.cache_headers())
+
+@app.get("/products/popular", response_model=List[Product])
+async def get_popular_products(
+    limit: int = Query(recommendations.POPULAR_DEFAULT_LIMIT, ge=1, le=recommendations.TOP_N),
+    shop_id: Optional[int] = Query(None),
+    category_id: Optional[int] = Query(None),
+):
+    """Best-selling products over the last few days, from lists refreshed in the background."""
+    snapshot, recs = await recommendation_snapshots()
+    products = recommendations.recommender.popular(recs, snapshot, limit, shop_id, category_id)
+    return recommendations_response(snapshot, products)
+
+@app.get("/products/{product_id}/related", response_model=List[Product])
+async def get_related_products(product_id: int, limit: int = Query(recommendations.RELATED_DEFAULT_LIMIT, ge=1, le=recommendations.TOP_N)):
+    """Products often ordered together with this one, topped up with popular products like it."""
+    snapshot, recs = await recommendation_snapshots()
+    product = snapshot.products_by_id.get(product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return recommendations_response(snapshot, recommendations.recommender.related(recs, snapshot, product, limit))
 
 @app.get("/products/shop/{shop_id}", response_model=List[Product])
-def get_products_by_shop(shop_id: int):
-    conn = get_db_connection()
-    products = conn.execute('SELECT * FROM products WHERE shop_id = ?', (shop_id,)).fetchall()
-    conn.close()
-    return [dict(row) for row in products]
+async def get_products_by_shop(shop_id: int, snapshot: CatalogSnapshot = Depends(cached_catalog)):
+    return products_response(snapshot, ('products', shop_id, None), snapshot.by_shop.get(shop_id, []))
+
+@app.get("/products/shop/{shop_id}/stock")
+async def get_shop_stock(shop_id: int, session: sessions.Session = Depends(current_session), db: AsyncDatabase = Depends(get_db)):
+    """Units left today of each of the shop's stock-tracked products."""
+    require_owner(session, shop_id)
+    return await db.run(stock.levels, shop_id)
 
 @app.get("/products/{product_id}", response_model=Product)
-def get_product(product_id: int):
-    conn = get_db_connection()
-    product = conn.execute('SELECT * FROM products WHERE id = ?', (product_id,)).fetchone()
-    conn.close()
+async def get_product(product_id: int, snapshot: CatalogSnapshot = Depends(cached_catalog)):
+    product = snapshot.products_by_id.get(product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return dict(product)
+    return serialization.TrustedJSONResponse(product_json(snapshot, product), headers=snapshot.cache_headers())
 
 @app.post("/products", response_model=Product, status_code=201)
-def create_product(product: ProductCreate):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        'INSERT INTO products (name, price, description, image_url, category_id, shop_id) VALUES (?, ?, ?, ?, ?, ?)',
-        (product.name, product.price, product.description, product.image_url, product.category_id, product.shop_id)
-    )
-    new_id = cursor.lastrowid
-    conn.commit()
-    new_product = conn.execute('SELECT * FROM products WHERE id = ?', (new_id,)).fetchone()
-    conn.close()
-    return dict(new_product)
+async def create_product(product: ProductCreate, session: sessions.Session = Depends(current_session), db: AsyncDatabase = Depends(get_db)):
+    require_owner(session, product.shop_id)
+    def query(conn):
+        cursor = conn.cursor()
+        cursor.execute(
+            'INSERT INTO products (name, price, description, image_url, category_id, shop_id, stock, daily_stock, stock_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (product.name, product.price, product.description, product.image_url, product.category_id, product.shop_id,
+             product.stock, product.daily_stock, stock.today() if product.stock is not None else None)
+        )
+        new_id = cursor.lastrowid
+        change = changes.record(conn, changes.CATALOG)
+        conn.commit()
+        catalog.invalidate(change.version, change.changed_at)
+        new_product = conn.execute('SELECT * FROM products WHERE id = ?', (new_id,)).fetchone()
+        return catalog.product_view(new_product)
+    return await db.run(query)
+
+@app.post("/products/import")
+async def import_products(
+    request: Request,
+    match: str = Query('name', description="Update products with the same shop and name (name) or the same id (id)"),
+    skip_invalid: bool = Query(False, description="Import the valid rows even if some rows are invalid"),
+    db: AsyncDatabase = Depends(get_db),
+    session: sessions.Session = Depends(current_session),
+):
+    """Inserts or updates many products at once from a JSON array (e.g. products.json) or CSV (Content-Type: text/csv).
+
+    Every row is validated first; unless `skip_invalid` is set, one invalid
+    row rejects the whole import with 422 and the per-row errors. Valid rows
+    are written in one transaction and the catalog version moves on once.
+    Rows go to the owner's shop; a row naming another shop, or matching
+    another shop's product by id, is invalid.
+    """
+    require_owner(session, session.shop_id)
+    body = await request.body()
+    def query(conn):
+        rows = product_import.parse(body, request.headers.get('content-type'))
+        result, change = product_import.upsert_products(conn, rows, match, skip_invalid, shop_id=session.shop_id)
+        if change is not None:
+            catalog.invalidate(change.version, change.changed_at)
+            stock.reservations.forget()
+        return result
+    try:
+        result = await db.run(query)
+    except product_import.ProductImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result['errors'] and not skip_invalid:
+        return JSONResponse(status_code=422, content={"detail": "No products were imported; fix the rows listed in errors.", **result})
+    return result
+
+@app.get("/products/import/template", response_class=PlainTextResponse)
+async def get_product_import_template():
+    """An empty CSV with the columns /products/import accepts."""
+    return PlainTextResponse(product_import.template(), media_type="text/csv", headers={"Content-Disposition": 'attachment; filename="products.csv"'})
 
 @app.put("/products/{product_id}", response_model=Product)
-def update_product(product_id: int, product: ProductUpdate):
-    conn = get_db_connection()
-    update_data = product.model_dump(exclude_unset=True)
-    if not update_data:
-        raise HTTPException(status_code=400, detail="No update data provided")
-    set_clause = ", ".join([f"{key} = ?" for key in update_data.keys()])
-    params = list(update_data.values()) + [product_id]
+async def update_product(product_id: int, product: ProductUpdate, session: sessions.Session = Depends(current_session), db: AsyncDatabase = Depends(get_db)):
+    def query(conn):
+        update_data = product.model_dump(exclude_unset=True)
+        if not update_data:
+            raise HTTPException(status_code=400, detail="No update data provided")
+        existing = conn.execute('SELECT shop_id FROM products WHERE id = ?', (product_id,)).fetchone()
+        if not existing:
+            raise HTTPException(status_code=404, detail="Product not found")
+        require_owner(session, existing['shop_id'])
+        if 'stock' in update_data:
+            # A count given today overrides today's daily_stock.
+            update_data['stock_date'] = stock.today()
+        set_clause = ", ".join([f"{key} = ?" for key in update_data.keys()])
+        params = list(update_data.values()) + [product_id]
     
-    conn.execute(f'UPDATE products SET {set_clause} WHERE id = ?', tuple(params))
-    conn.commit()
+        # Only a write that changed a row goes into the change log and reaches the other workers.
+        if conn.execute(f'UPDATE products SET {set_clause} WHERE id = ?', tuple(params)).rowcount == 0:
+            conn.rollback()
+            raise HTTPException(status_code=404, detail="Product not found")
+        change = changes.record(conn, changes.CATALOG)
+        conn.commit()
+        catalog.invalidate(change.version, change.changed_at)
+        stock.reservations.forget()
     
-    updated_product = conn.execute('SELECT * FROM products WHERE id = ?', (product_id,)).fetchone()
-    conn.close()
-    if not updated_product:
-        raise HTTPException(status_code=404, detail="Product not found after update")
-    return dict(updated_product)
+        updated_product = conn.execute('SELECT * FROM products WHERE id = ?', (product_id,)).fetchone()
+        return catalog.product_view(updated_product)
+    return await db.run(query)
 
 @app.get("/dashboard/shop/{shop_id}", response_model=DashboardStats)
-def get_dashboard_stats(shop_id: int):
-    conn = get_db_connection()
-    stats = conn.execute("SELECT COUNT(id) as total_orders, SUM(total_price) as total_revenue FROM orders WHERE shop_id = ? AND DATE(order_date) = DATE('now')", (shop_id,)).fetchone()
-    recent_orders_raw = conn.execute("SELECT o.id as order_id, o.total_price, o.status, u.first_name, u.last_name FROM orders o JOIN users u ON o.user_id = u.id WHERE o.shop_id = ? ORDER BY o.order_date DESC LIMIT 3", (shop_id,)).fetchall()
+async def get_dashboard_stats(shop_id: int, session: sessions.Session = Depends(current_session), db: AsyncDatabase = Depends(get_db)):
+    require_owner(session, shop_id)
+    def query(conn):
+        stats = conn.execute("SELECT SUM(order_count) as total_orders, SUM(revenue) as total_revenue FROM shop_daily_stats WHERE shop_id = ? AND day = DATE('now')", (shop_id,)).fetchone()
+        recent_orders_raw = conn.execute("SELECT o.id as order_id, o.total_price, o.status, u.first_name, u.last_name FROM orders o JOIN users u ON o.user_id = u.id WHERE o.shop_id = ? ORDER BY o.order_date DESC LIMIT 3", (shop_id,)).fetchall()
     
-    recent_orders = [dict(row) for row in recent_orders_raw]
-    if recent_orders:
-        order_ids = [o['order_id'] for o in recent_orders]
-        for order in recent_orders: order['items'] = []
-        
-        items_raw = conn.execute(f"SELECT oi.order_id, oi.quantity, p.name as product_name, p.image_url FROM order_items oi JOIN products p ON oi.product_id = p.id WHERE oi.order_id IN ({','.join('?'*len(order_ids))})", tuple(order_ids)).fetchall()
-        
-        items_map = {oid: [] for oid in order_ids}
-        for item in items_raw: items_map[item['order_id']].append(dict(item))
-        for order in recent_orders: order['items'] = items_map.get(order['order_id'], [])
-    conn.close()
-    return {"total_orders_today": stats['total_orders'] or 0, "total_revenue_today": stats['total_revenue'] or 0.0, "recent_orders": recent_orders}
+        recent_orders = attach_order_items(conn, [dict(row) for row in recent_orders_raw])
+        return {"total_orders_today": stats['total_orders'] or 0, "total_revenue_today": stats['total_revenue'] or 0.0, "recent_orders": recent_orders}
+    return await db.run(query)
 
 @app.get("/dashboard/shop/{shop_id}/weekly-summary")
-def get_weekly_summary(shop_id: int):
-    conn = get_db_connection()
-    today = datetime.now().date()
-    days_summary = {(today - timedelta(days=i)): 0.0 for i in range(7)}
-    start_date = today - timedelta(days=6)
+async def get_weekly_summary(shop_id: int, session: sessions.Session = Depends(current_session), db: AsyncDatabase = Depends(get_db)):
+    require_owner(session, shop_id)
+    def query(conn):
+        today = datetime.now().date()
+        days_summary = {(today - timedelta(days=i)): 0.0 for i in range(7)}
+        start_date = today - timedelta(days=6)
     
-    query = """
-        SELECT DATE(order_date) as order_day, SUM(total_price) as daily_revenue
-        FROM orders
-        WHERE shop_id = ? AND DATE(order_date) >= ?
-        GROUP BY DATE(order_date)
-    """
-    results = conn.execute(query, (shop_id, start_date)).fetchall()
-    conn.close()
+        sql = """
+            SELECT day as order_day, SUM(revenue) as daily_revenue
+            FROM shop_daily_stats
+            WHERE shop_id = ? AND day >= ?
+            GROUP BY day
+        """
+        results = conn.execute(sql, (shop_id, start_date)).fetchall()
 
-    for row in results:
-        order_day = datetime.strptime(row['order_day'], '%Y-%m-%d').date()
-        if order_day in days_summary:
-            days_summary[order_day] = row['daily_revenue']
+        for row in results:
+            order_day = datetime.strptime(row['order_day'], '%Y-%m-%d').date()
+            if order_day in days_summary:
+                days_summary[order_day] = row['daily_revenue']
             
-    sorted_days = sorted(days_summary.items())
-    today_weekday = today.weekday()
-    week_days = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
-    final_summary = []
-    start_of_week = today - timedelta(days=today_weekday)
-
-    for i in range(7):
-        current_day_date = start_of_week + timedelta(days=i)
-        final_summary.append({
-            "day": week_days[i],
-            "earnings": days_summary.get(current_day_date, 0.0),
-            "is_today": current_day_date == today
-        })
-    return final_summary
-
-@app.get("/orders/shop/{shop_id}/summary", response_model=OrderSummary)
-def get_order_summary(shop_id: int):
-    conn = get_db_connection()
-    orders_raw = conn.execute("SELECT o.id as order_id, o.total_price, o.status, o.order_date, u.first_name, u.last_name FROM orders o JOIN users u ON o.user_id = u.id WHERE o.shop_id = ? AND o.status IN ('Pending', 'Ready') ORDER BY o.order_date DESC", (shop_id,)).fetchall()
-    history_raw = conn.execute("SELECT o.id as order_id, o.total_price, o.status, o.order_date, u.first_name, u.last_name FROM orders o JOIN users u ON o.user_id = u.id WHERE o.shop_id = ? AND o.status NOT IN ('Pending', 'Ready') ORDER BY o.order_date DESC", (shop_id,)).fetchall()
-    
-    summary = {"pending": [], "ready": [], "completed": [dict(row) for row in history_raw]}
-    for row in orders_raw:
-        status = row['status'].lower()
-        if status in summary: summary[status].append(dict(row))
-    
-    all_orders = summary['pending'] + summary['ready'] + summary['completed']
-    if not all_orders:
-        conn.close()
-        return summary
-    
-    orders_map = {order['order_id']: order for order in all_orders}
-    for order in orders_map.values(): order['items'] = []
-    
-    order_ids = list(orders_map.keys())
-    items_raw = conn.execute(f"SELECT oi.order_id, oi.quantity, p.name as product_name, p.image_url FROM order_items oi JOIN products p ON oi.product_id = p.id WHERE oi.order_id IN ({','.join('?'*len(order_ids))})", tuple(order_ids)).fetchall()
-    
-    for item in items_raw:
-        if item['order_id'] in orders_map:
-            orders_map[item['order_id']]['items'].append(dict(item))
-            
-    conn.close()
-    return summary
+        sorted_days = sorted(days_summary.items())
+        today_weekday = today.weekday()
+        week_days = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+        final_summary = []
+        start_of_week = today - timedelta(days=today_weekday)
+
+        for i in range(7):
+            current_day_date = start_of_week + timedelta(days=i)
+            final_summary.append({
+                "day": week_days[i],
+                "earnings": days_summary.get(current_day_date, 0.0),
+                "is_today": current_day_date == today
+            })
+        return final_summary
+    return await db.run(query)
+
+@app.get("/orders/shop/{shop_id}/summary", response_model=OrderSummary, deprecated=True)
+async def get_order_summary(shop_id: int, session: sessions.Session = Depends(current_session), db: AsyncDatabase = Depends(get_db)):
+    """Legacy all-in-one view. Use /live and /history instead; this grows with order history, archived orders included."""
+    require_owner(session, shop_id)
+    def query(conn):
+        def fetch(orders_table):
+            return [dict(row) for row in conn.execute(f"SELECT o.id as order_id, o.total_price, o.status, o.order_date, u.first_name, u.last_name FROM {orders_table} o JOIN users u ON o.user_id = u.id WHERE o.shop_id = ? AND o.status NOT IN ('Pending', 'Ready') ORDER BY o.order_date DESC, o.id DESC", (shop_id,))]
+        with archive.snapshot(conn):
+            orders_raw = conn.execute("SELECT o.id as order_id, o.total_price, o.status, o.order_date, u.first_name, u.last_name FROM orders o JOIN users u ON o.user_id = u.id WHERE o.shop_id = ? AND o.status IN ('Pending', 'Ready') ORDER BY +o.order_date DESC", (shop_id,)).fetchall()
+            history, sources = archive.collect(fetch, archive.shop_months(conn, shop_id))
+
+            summary = {"pending": [], "ready": [], "completed": history}
+            for row in orders_raw:
+                status = row['status'].lower()
+                if status in summary: summary[status].append(dict(row))
+
+            attach_collected_items(conn, summary['pending'] + summary['ready'] + summary['completed'], sources)
+            return summary
+    return await db.run(query)
+
+@app.get("/orders/shop/{shop_id}/export/{report}")
+async def export_shop_orders(
+    shop_id: int,
+    report: str,
+    format: str = Query('csv', description="csv or ndjson"),
+    since: Optional[date] = Query(None, description="Only orders on or after this day"),
+    until: Optional[date] = Query(None, description="Only orders on or before this day"),
+    status: Optional[str] = Query(None, description="Only orders in this status, e.g. Completed"),
+    session: sessions.Session = Depends(current_session),
+):
+    """Streams a sales report over any date range, archived orders included, in constant memory.
+
+    Reports: `lines` (one row per order item), `products` (units and subtotal
+    per product) and `hourly` (orders, items and revenue per hour, UTC).
+    """
+    require_owner(session, shop_id)
+    if report not in exports.REPORTS:
+        raise HTTPException(status_code=404, detail=f"Unknown report; expected one of {', '.join(exports.REPORTS)}")
+    if format not in exports.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format; expected one of {', '.join(exports.FORMATS)}")
+    try:
+        export = await database.run_blocking(exports.exporter.start, report, format, shop_id, *exports.date_range(since, until), status)
+    except exports.ExportsBusy as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+    filename = '-'.join(str(part) for part in ('shop', shop_id, report, since, until) if part is not None)
+    return exports.ExportResponse(
+        database, export,
+        media_type=exports.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{format}"', "Cache-Control": "no-store"},
+    )
+
+@app.get("/orders/shop/{shop_id}/live", response_model=LiveOrders)
+async def get_live_orders(shop_id: int, session: sessions.Session = Depends(current_session), db: AsyncDatabase = Depends(get_db)):
+    """Pending and Ready orders only, so the payload does not grow with history."""
+    require_owner(session, shop_id)
+    def query(conn):
+        # `+o.order_date` keeps the planner from walking the shop's whole date index to skip a
+        # sort of a handful of rows; the (shop_id, status, order_date) index finds them directly.
+        orders_raw = conn.execute("SELECT o.id as order_id, o.total_price, o.status, o.version, o.order_date, u.first_name, u.last_name FROM orders o JOIN users u ON o.user_id = u.id WHERE o.shop_id = ? AND o.status IN ('Pending', 'Ready') ORDER BY +o.order_date DESC", (shop_id,)).fetchall()
     
+        live = {"pending": [], "ready": []}
+        for row in orders_raw:
+            live[row['status'].lower()].append(dict(row))
+        attach_order_items(conn, live['pending'] + live['ready'])
+        return live
+    return serialization.TrustedJSONResponse(await db.run(query))
+
+@app.get("/orders/shop/{shop_id}/history", response_model=OrderHistoryPage)
+async def get_order_history(
+    shop_id: int,
+    since: Optional[date] = Query(None, description="Only orders on or after this day"),
+    until: Optional[date] = Query(None, description="Only orders on or before this day"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(20, ge=1, le=100),
+    session: sessions.Session = Depends(current_session),
+    db: AsyncDatabase = Depends(get_db),
+):
+    """Completed/closed orders, newest first, paginated by a keyset cursor on (order_date, id)."""
+    require_owner(session, shop_id)
+    def query(conn):
+        conditions = ["o.shop_id = ?", "o.status NOT IN ('Pending', 'Ready')"]
+        params = [shop_id]
+        if since:
+            conditions.append("o.order_date >= ?")
+            params.append(since.isoformat())
+        if until:
+            conditions.append("o.order_date < ?")
+            params.append((until + timedelta(days=1)).isoformat())
+        if cursor:
+            conditions.append("(o.order_date, o.id) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+        params.append(limit + 1)
+
+        def fetch(orders_table):
+            return [dict(row) for row in conn.execute(f"SELECT o.id as order_id, o.total_price, o.status, o.order_date, u.first_name, u.last_name FROM {orders_table} o JOIN users u ON o.user_id = u.id WHERE {' AND '.join(conditions)} ORDER BY o.order_date DESC, o.id DESC LIMIT ?", tuple(params))]
+
+        # Archive months are only read once the page reaches past the live orders.
+        with archive.snapshot(conn):
+            months = archive.shop_months(conn, shop_id, since and since.isoformat(), (until + timedelta(days=1)).isoformat() if until else None)
+            rows, sources = archive.collect(fetch, months, limit)
+            orders = rows[:limit]
+            next_cursor = None
+            if len(rows) > limit:
+                last = orders[-1]
+                next_cursor = encode_cursor(last['order_date'], last['order_id'])
+            attach_collected_items(conn, orders, sources)
+        return {"orders": orders, "next_cursor": next_cursor}
+    return serialization.TrustedJSONResponse(await db.run(query))
+
+@app.get("/db/pool-stats")
+async def get_pool_stats():
+    """Reports connection pool usage (size, idle/in-use, waits and timeouts)."""
+    return {**pool.stats(), 'executor_workers': database.workers}
+
+@app.get("/catalog/cache-stats")
+async def get_catalog_cache_stats():
+    """Reports catalog cache version and hit/miss/invalidation counters."""
+    return catalog.stats()
+
+@app.get("/db/change-stats")
+async def get_change_stats():
+    """Reports this worker's position in the change log and the other workers' changes it has applied."""
+    return changes.feed.stats()
+
+@app.get("/catalog/recommendation-stats")
+async def get_recommendation_stats():
+    """Reports when the popular/related lists were last refreshed and how long it took."""
+    return recommendations.recommender.stats()
+
+@app.get("/orders/archive-stats")
+async def get_archive_stats(db: AsyncDatabase = Depends(get_db)):
+    """Reports archiver runs and the orders held in each archive month."""
+    return await db.run(archive.archiver.stats)
+
+@app.get("/orders/queue-stats")
+async def get_order_queue_stats():
+    """Reports how many order submissions the single writer has committed and in how many batches."""
+    return orders.queue.stats()
+
+@app.get("/orders/export-stats")
+async def get_export_stats():
+    """Reports running, completed and aborted report exports and the rows they streamed."""
+    return exports.exporter.stats()
+
+@app.get("/orders/stock-stats")
+async def get_stock_stats():
+    """Reports checkouts admitted and refused by the stock reservations and the quantities still held."""
+    return stock.reservations.stats()
+
+@app.get("/orders/idempotency-stats")
+async def get_idempotency_stats():
+    """Reports Idempotency-Key replays, coalesced concurrent retries and cross-worker conflicts."""
+    return idempotency.store.stats()
+
+@app.get("/auth/stats")
+async def get_auth_stats():
+    """Reports password hashing pool usage, login limiter state and session cache counters."""
+    return {'hashing': passwords.hashing.stats(), 'login_limiter': passwords.login_limiter.stats(), 'sessions': sessions.store.stats()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Request, SQL statement and pool metrics in the Prometheus text format."""
+    pool_stats, hashing_stats = pool.stats(), passwords.hashing.stats()
+    gauges = [
+        ('canteen_db_pool_connections', 'Pooled SQLite connections by state.',
+         [({'state': 'in_use'}, pool_stats['in_use']), ({'state': 'idle'}, pool_stats['idle'])]),
+        ('canteen_password_hashes_pending', 'Password hashes queued or running.', [({}, hashing_stats['pending'])]),
+        ('canteen_sessions_cached', 'Sessions in the in-memory cache.', [({}, sessions.store.stats()['cached'])]),
+        ('canteen_live_feed_subscribers', 'Open live order feed connections.', [({}, events.bus.stats()['subscribers'])]),
+        ('canteen_catalog_version', 'Current catalog cache version.', [({}, catalog.stats()['version'])]),
+    ]
+    return PlainTextResponse(metrics.registry.render(gauges), media_type="text/plain; version=0.0.4")
+
+@app.get("/db/slow-queries")
+async def get_slow_queries():
+    """Lists the most recent statements slower than CANTEEN_SLOW_QUERY_MS, newest first."""
+    return {'threshold_ms': metrics.registry.slow_query_ms, 'queries': metrics.registry.slow_queries()}
+
 @app.put("/orders/{order_id}/status")
-def update_order_status(order_id: int, status_update: OrderStatusUpdate):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('UPDATE orders SET status = ? WHERE id = ?', (status_update.status, order_id))
-    conn.commit()
-    if cursor.rowcount == 0:
-        conn.close()
+async def update_order_status(order_id: int, status_update: OrderStatusUpdate, db: AsyncDatabase = Depends(get_db), session: sessions.Session = Depends(current_session)):
+    """Moves one order along Pending -> Ready -> Completed (or to Rejected).
+
+    With `version`, the update is refused with 409 if the order has changed
+    since the client read it. Asking for the status the order already has
+    succeeds without writing anything. Another shop's order is not found.
+    """
+    require_owner(session, session.shop_id)
+    def query(conn):
+        (outcome,), moved = order_status.transition_orders(conn, [(order_id, status_update.status, status_update.version)], session.shop_id)
+        publish_order_status(moved)
+        return outcome
+    outcome = await db.run(query)
+    if outcome['outcome'] == order_status.NOT_FOUND:
         raise HTTPException(status_code=404, detail="Order not found")
-    conn.close()
-    return {"message": "Order status updated", "new_status": status_update.status}
+    if outcome['outcome'] in (order_status.CONFLICT, order_status.INVALID_TRANSITION):
+        return JSONResponse(status_code=409, content={"detail": outcome['detail'], **outcome})
+    return {"message": "Order status updated", "new_status": outcome['status'], "version": outcome['version']}
+
+@app.post("/orders/shop/{shop_id}/status")
+async def transition_shop_orders(shop_id: int, batch: OrderTransitionBatch, db: AsyncDatabase = Depends(get_db), session: sessions.Session = Depends(current_session)):
+    """Applies many status changes to a shop's orders in one write transaction.
+
+    Each order is checked on its own: the response lists one outcome per
+    requested change (`updated`, `unchanged`, `not_found`,
+    `invalid_transition` or `conflict`, the latter two with a `detail`)
+    together with the order's status and version afterwards, and the valid
+    changes are applied even if others are refused.
+    """
+    require_owner(session, shop_id)
+    def query(conn):
+        outcomes, moved = order_status.transition_orders(conn, [(t.order_id, t.status, t.version) for t in batch.orders], shop_id)
+        publish_order_status(moved)
+        return outcomes
+    outcomes = await db.run(query)
+    counts = {}
+    for outcome in outcomes:
+        counts[outcome['outcome']] = counts.get(outcome['outcome'], 0) + 1
+    return {"counts": counts, "orders": outcomes}
+
+@app.get("/orders/shop/{shop_id}/queue")
+async def get_shop_queue(shop_id: int, db: AsyncDatabase = Depends(get_db)):
+    """Kitchen queue depth and the estimated ready time for an order placed now.
+
+    Read from the shop's running queue counters, which every order insert and
+    status change keeps up to date.
+    """
+    return await db.run(kitchen.queue_status, shop_id)
+
+@app.get("/orders/shop/{shop_id}/stream")
+async def stream_shop_orders(shop_id: int, session: sessions.Session = Depends(current_session)):
+    """Server-Sent Events feed of order changes for one shop.
+
+    Emits `order_created` (full live-order payload), `order_status` and, if the
+    client falls too far behind, `resync` before closing. Clients load a
+    snapshot from /live on (re)connect and apply the deltas on top.
+    """
+    require_owner(session, shop_id)
+    return StreamingResponse(
+        events.sse_stream(events.bus, shop_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # ==============================================================================
 # --- Static Files Mount ---
 # ==============================================================================
 
-app.mount("/", StaticFiles(directory="static", html=True), name="static")
+# Pages and images are served from a build of static/ with fingerprinted,
+# precompressed copies and product thumbnails (see assets.py).
+if assets.ASSETS_BUILD_ENABLED:
+    asset_manifest = assets.build()
+    catalog.product_hooks.append(asset_manifest.rewrite_product)
+    app.mount("/", assets.AssetStaticFiles(directory=asset_manifest.directory, html=True), name="static")
+else:
+    app.mount("/", assets.AssetStaticFiles(directory=assets.ASSETS_SOURCE_DIR, html=True), name="static")
@@ -0,0 +1,437 @@
+import bisect
+import contextvars
+import functools
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+# ==============================================================================
+# --- Configuration ---
+# ==============================================================================
+
+METRICS_ENABLED = os.environ.get('CANTEEN_METRICS', '1') != '0'
+# Statements at or above this many milliseconds are counted, logged and kept
+# in the recent slow-query list.
+SLOW_QUERY_MS = float(os.environ.get('CANTEEN_SLOW_QUERY_MS', '100'))
+SLOW_QUERY_LOG_SIZE = int(os.environ.get('CANTEEN_SLOW_QUERY_LOG_SIZE', '100'))
+# Requests sending `X-Canteen-Profile: 1` get a Server-Timing breakdown back.
+PROFILING_ENABLED = os.environ.get('CANTEEN_PROFILING', '1') != '0'
+PROFILE_HEADER = b'x-canteen-profile'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+# Rows fetched per step when a cursor is iterated, so timing is per chunk
+# rather than per row.
+ITER_CHUNK = 256
+PROFILE_TOP_STATEMENTS = 3
+
+logger = logging.getLogger('canteen.metrics')
+
+current_profile = contextvars.ContextVar('canteen_profile', default=None)
+
+
+# ==============================================================================
+# --- SQL Normalization ---
+# ==============================================================================
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACE_RE = re.compile(r'\s+')
+
+
+@functools.lru_cache(maxsize=2048)
+def normalize_sql(sql):
+    """Collapses a statement to its shape: literals become `?` and `IN (?, ?, ...)` lists `IN (?...)`.
+
+    Statements that differ only in literal values or list length map to the
+    same string, which keeps the per-query series bounded.
+    """
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _IN_LIST_RE.sub('(?...)', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+def _statement_kind(normalized):
+    word = normalized.split(' ', 1)[0].lower()
+    return word if word in ('select', 'insert', 'update', 'delete', 'with') else 'other'
+
+
+# ==============================================================================
+# --- Registry ---
+# ==============================================================================
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus layout."""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            yield f'{name}_bucket', {**labels, 'le': '+Inf' if bound == float('inf') else repr(bound)}, cumulative
+        yield f'{name}_sum', labels, self.sum
+        yield f'{name}_count', labels, self.count
+
+
+class MetricsRegistry:
+    """Request and SQL statement metrics, rendered in the Prometheus text format.
+
+    Requests are observed on the event loop; statements are observed on DB
+    worker threads. Both go through one lock, held only for a few dict updates.
+    """
+
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS, slow_log_size=SLOW_QUERY_LOG_SIZE):
+        self.slow_query_ms = slow_query_ms
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._requests = {}         # (method, route, status) -> count
+        self._request_latency = {}  # (method, route) -> Histogram
+        self._statement_latency = {}  # kind -> Histogram
+        self._queries = {}          # normalized sql -> [calls, seconds, rows, slow]
+        self._db_wait = Histogram(LATENCY_BUCKETS)
+        self._slow_log = deque(maxlen=slow_log_size)
+
+    def observe_request(self, method, route, status, seconds):
+        with self._lock:
+            key = (method, route, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            histogram = self._request_latency.get((method, route))
+            if histogram is None:
+                histogram = self._request_latency[(method, route)] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+
+    def observe_statement(self, sql, seconds, rows):
+        normalized = normalize_sql(sql)
+        slow = seconds * 1000 >= self.slow_query_ms
+        with self._lock:
+            kind = _statement_kind(normalized)
+            histogram = self._statement_latency.get(kind)
+            if histogram is None:
+                histogram = self._statement_latency[kind] = Histogram(STATEMENT_BUCKETS)
+            histogram.observe(seconds)
+            stats = self._queries.get(normalized)
+            if stats is None:
+                stats = self._queries[normalized] = [0, 0.0, 0, 0]
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] += rows
+            if slow:
+                stats[3] += 1
+                self._slow_log.append({'sql': normalized, 'ms': round(seconds * 1000, 2), 'rows': rows, 'at': time.time()})
+        if slow:
+            logger.warning("Slow query (%.1f ms, %d rows): %s", seconds * 1000, rows, normalized)
+        return normalized
+
+    def observe_db_wait(self, seconds):
+        with self._lock:
+            self._db_wait.observe(seconds)
+
+    def slow_queries(self):
+        with self._lock:
+            return list(reversed(self._slow_log))
+
+    def render(self, gauges=()):
+        """The registry plus `gauges` ((name, help, [(labels, value)]) tuples) as Prometheus text."""
+        with self._lock:
+            families = [
+                ('canteen_http_requests_in_flight', 'gauge', 'Requests currently being handled.', [('', {}, self.in_flight)]),
+                ('canteen_http_requests_total', 'counter', 'Requests handled, by route and status.',
+                 [('', {'method': m, 'route': r, 'status': str(s)}, n) for (m, r, s), n in sorted(self._requests.items())]),
+                ('canteen_http_request_duration_seconds', 'histogram', 'Request latency until the response is sent.',
+                 [s for (m, r), h in sorted(self._request_latency.items()) for s in h.samples('canteen_http_request_duration_seconds', {'method': m, 'route': r})]),
+                ('canteen_db_statement_duration_seconds', 'histogram', 'SQL statement time, including fetching its rows.',
+                 [s for k, h in sorted(self._statement_latency.items()) for s in h.samples('canteen_db_statement_duration_seconds', {'kind': k})]),
+                ('canteen_db_executor_wait_seconds', 'histogram', 'Time a DB call waited for an executor thread.',
+                 list(self._db_wait.samples('canteen_db_executor_wait_seconds', {}))),
+                ('canteen_db_query_calls_total', 'counter', 'Executions per normalized statement.',
+                 [('', {'query': q}, v[0]) for q, v in sorted(self._queries.items())]),
+                ('canteen_db_query_seconds_total', 'counter', 'Time spent per normalized statement.',
+                 [('', {'query': q}, v[1]) for q, v in sorted(self._queries.items())]),
+                ('canteen_db_query_rows_total', 'counter', 'Rows returned or changed per normalized statement.',
+                 [('', {'query': q}, v[2]) for q, v in sorted(self._queries.items())]),
+                ('canteen_db_slow_queries_total', 'counter', f'Statements slower than {self.slow_query_ms:g} ms.',
+                 [('', {'query': q}, v[3]) for q, v in sorted(self._queries.items()) if v[3]]),
+            ]
+        families += [(name, 'gauge', help_text, [('', labels, value) for labels, value in samples]) for name, help_text, samples in gauges]
+        lines = []
+        for name, kind, help_text, samples in families:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for sample_name, labels, value in samples:
+                lines.append(f'{sample_name or name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape_label(value)}"' for key, value in labels.items()) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+registry = MetricsRegistry()
+
+
+# ==============================================================================
+# --- Per-Request Profile ---
+# ==============================================================================
+
+class RequestProfile:
+    """Where one request's time went, returned as a Server-Timing header.
+
+    Filled in from DB worker threads through the `current_profile` context
+    variable, which AsyncDatabase copies into every call.
+    """
+
+    __slots__ = ('statements', 'db_calls')
+
+    def __init__(self):
+        self.statements = []  # (normalized sql, seconds, rows)
+        self.db_calls = []    # (queued seconds, run seconds)
+
+    def server_timing(self, total_seconds):
+        db = sum(seconds for _, seconds, _ in self.statements)
+        rows = sum(rows for _, _, rows in self.statements)
+        queued = sum(queued for queued, _ in self.db_calls)
+        run = sum(run for _, run in self.db_calls)
+        entries = [
+            _timing('db', db, f'{len(self.statements)} statements, {rows} rows'),
+            _timing('db-queue', queued, f'{len(self.db_calls)} calls waiting for a DB thread'),
+            _timing('db-other', max(0.0, run - db), 'pool checkout and Python on DB threads'),
+            _timing('app', max(0.0, total_seconds - queued - run), 'routing, validation, handler and serialization'),
+            _timing('total', total_seconds),
+        ]
+        for sql, seconds, rows in sorted(self.statements, key=lambda s: s[1], reverse=True)[:PROFILE_TOP_STATEMENTS]:
+            entries.append(_timing('sql', seconds, f'{rows} rows: {sql[:120]}'))
+        return ', '.join(entries)
+
+
+def _timing(name, seconds, description=None):
+    entry = f'{name};dur={seconds * 1000:.3f}'
+    if description:
+        entry += ';desc="' + description.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return entry
+
+
+def observe_db_call(queued, run):
+    """AsyncDatabase call hook: executor wait into the registry and the request profile."""
+    registry.observe_db_wait(queued)
+    profile = current_profile.get()
+    if profile is not None:
+        profile.db_calls.append((queued, run))
+
+
+# ==============================================================================
+# --- Instrumented Connections ---
+# ==============================================================================
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Times every statement from execute() until its rows have been fetched.
+
+    A statement is finished when its rows run out, when the cursor runs a new
+    statement, or when the cursor is closed or dropped, which covers the
+    `conn.execute(...).fetchone()` pattern used throughout the handlers.
+    """
+
+    _statement = None  # [sql, seconds, rows, profile]
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        finally:
+            self._statement = [sql, time.perf_counter() - started, 0, current_profile.get()]
+        if self.description is None:
+            self._statement[2] = max(self.rowcount, 0)
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        finally:
+            self._statement = [sql, time.perf_counter() - started, max(self.rowcount, 0), current_profile.get()]
+            self._finish()
+        return self
+
+    def executescript(self, sql_script):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            super().executescript(sql_script)
+        finally:
+            self._statement = [sql_script, time.perf_counter() - started, 0, current_profile.get()]
+            self._finish()
+        return self
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        statement = self._statement
+        if statement is not None:
+            statement[1] += time.perf_counter() - started
+            if row is None:
+                self._finish()
+            else:
+                statement[2] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        statement = self._statement
+        if statement is not None:
+            statement[1] += time.perf_counter() - started
+            statement[2] += len(rows)
+            if not rows:
+                self._finish()
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        statement = self._statement
+        if statement is not None:
+            statement[1] += time.perf_counter() - started
+            statement[2] += len(rows)
+            self._finish()
+        return rows
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(ITER_CHUNK)
+            if not rows:
+                return
+            yield from rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+    def _finish(self):
+        statement = self._statement
+        if statement is None:
+            return
+        self._statement = None
+        sql, seconds, rows, profile = statement
+        normalized = registry.observe_statement(sql, seconds, rows)
+        if profile is not None:
+            profile.statements.append((normalized, seconds, rows))
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection whose cursors (including `conn.execute()` shortcuts) are timed."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+def install(pool, database):
+    """Instruments connections opened by `pool` and calls made through `database`."""
+    pool.factory = InstrumentedConnection
+    database.call_hooks.append(observe_db_call)
+
+
+# ==============================================================================
+# --- ASGI Middleware ---
+# ==============================================================================
+
+class MetricsMiddleware:
+    """Counts and times every HTTP request by method, route template and status.
+
+    Latency is measured until the response has been sent, except for event
+    streams, which are measured until their headers go out. With profiling
+    enabled, a request carrying `X-Canteen-Profile: 1` gets a Server-Timing
+    header describing where its time went.
+    """
+
+    def __init__(self, app, registry=registry, profiling=PROFILING_ENABLED):
+        self.app = app
+        self.registry = registry
+        self.profiling = profiling
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        profile = token = None
+        if self.profiling and any(name == PROFILE_HEADER and value not in (b'', b'0') for name, value in scope['headers']):
+            profile = RequestProfile()
+            token = current_profile.set(profile)
+        status = 500
+        observed = False
+
+        async def send_wrapper(message):
+            nonlocal status, observed
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                headers = message.get('headers', [])
+                if profile is not None:
+                    timing = profile.server_timing(time.perf_counter() - started)
+                    message = {**message, 'headers': [*headers, (b'server-timing', timing.encode('latin-1', 'replace'))]}
+                if any(name == b'content-type' and value.startswith(b'text/event-stream') for name, value in headers):
+                    observed = True
+                    self.registry.observe_request(scope['method'], _route_label(scope), status, time.perf_counter() - started)
+            await send(message)
+
+        self.registry.in_flight += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.registry.in_flight -= 1
+            if not observed:
+                self.registry.observe_request(scope['method'], _route_label(scope), status, time.perf_counter() - started)
+            if token is not None:
+                current_profile.reset(token)
+
+
+def _route_label(scope):
+    route = scope.get('route')
+    if route is not None:
+        return route.path
+    # Mounted apps (the static files) match without setting a route.
+    return '[static]' if scope.get('endpoint') is not None else '[unmatched]'
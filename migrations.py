@@ -0,0 +1,241 @@
+import argparse
+import sqlite3
+
+from db_pool import DATABASE_FILE
+
+# ==============================================================================
+# --- Schema Migrations ---
+# ==============================================================================
+#
+# The tables created by db3.py `create_tables` are schema version 0. Every
+# change after that is appended here as (version, description, statements) and
+# applied once, in order, with the current version kept in PRAGMA user_version.
+# Never edit a migration that has shipped; add a new one instead.
+
+MIGRATIONS = [
+    (1, "Index orders for the shop live/history views and per-user history", [
+        'CREATE INDEX IF NOT EXISTS idx_orders_shop_status_date ON orders (shop_id, status, order_date)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_shop_date ON orders (shop_id, order_date)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_user_date ON orders (user_id, order_date)',
+    ]),
+    (2, "Index order_items by order and products by shop/category", [
+        'CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)',
+        'CREATE INDEX IF NOT EXISTS idx_products_shop_category ON products (shop_id, category_id)',
+        'CREATE INDEX IF NOT EXISTS idx_products_category ON products (category_id)',
+    ]),
+    (3, "Add the shop_daily_stats revenue rollup and backfill it from orders", [
+        '''CREATE TABLE IF NOT EXISTS shop_daily_stats (
+            shop_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            status TEXT NOT NULL,
+            order_count INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (shop_id, day, status)
+        ) WITHOUT ROWID''',
+        '''INSERT OR REPLACE INTO shop_daily_stats (shop_id, day, status, order_count, revenue)
+           SELECT shop_id, DATE(order_date), status, COUNT(*), SUM(total_price)
+           FROM orders GROUP BY shop_id, DATE(order_date), status''',
+    ]),
+    (4, "Record revoked session tokens until they expire", [
+        '''CREATE TABLE IF NOT EXISTS revoked_sessions (
+            session_id TEXT PRIMARY KEY,
+            expires_at INTEGER NOT NULL
+        ) WITHOUT ROWID''',
+    ]),
+    (5, "Add the products_fts full-text index with sync triggers", [
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name, description,
+            content='products', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )''',
+        '''CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, description ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO products_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+        END''',
+        "INSERT INTO products_fts (products_fts) VALUES ('rebuild')",
+    ]),
+    (6, "Add product sales and co-purchase counters for recommendations and backfill them", [
+        '''CREATE TABLE IF NOT EXISTS product_daily_sales (
+            day TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, product_id)
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS product_pairs (
+            product_id INTEGER NOT NULL,
+            other_id INTEGER NOT NULL,
+            orders INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (product_id, other_id)
+        ) WITHOUT ROWID''',
+        '''INSERT OR REPLACE INTO product_daily_sales (day, product_id, quantity)
+           SELECT DATE(o.order_date), oi.product_id, SUM(oi.quantity)
+           FROM orders o JOIN order_items oi ON oi.order_id = o.id
+           GROUP BY DATE(o.order_date), oi.product_id''',
+        '''INSERT OR REPLACE INTO product_pairs (product_id, other_id, orders)
+           SELECT a.product_id, b.product_id, COUNT(DISTINCT a.order_id)
+           FROM order_items a JOIN order_items b ON b.order_id = a.order_id AND b.product_id != a.product_id
+           GROUP BY a.product_id, b.product_id''',
+    ]),
+    (7, "Add the Idempotency-Key store for order submission", [
+        '''CREATE TABLE IF NOT EXISTS idempotency_keys (
+            user_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            status_code INTEGER NOT NULL,
+            response BLOB NOT NULL,
+            expires_at INTEGER NOT NULL,
+            PRIMARY KEY (user_id, key)
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys (expires_at)',
+    ]),
+    (8, "Record order status transitions and add the kitchen queue model", [
+        'ALTER TABLE orders ADD COLUMN estimated_prep_s REAL',
+        'ALTER TABLE orders ADD COLUMN estimated_ready_at TIMESTAMP',
+        '''CREATE TABLE IF NOT EXISTS order_status_events (
+            id INTEGER PRIMARY KEY,
+            order_id INTEGER NOT NULL,
+            from_status TEXT,
+            to_status TEXT NOT NULL,
+            changed_at TIMESTAMP NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_order_status_events_order ON order_status_events (order_id)',
+        '''CREATE TABLE IF NOT EXISTS kitchen_queues (
+            shop_id INTEGER PRIMARY KEY,
+            pending INTEGER NOT NULL DEFAULT 0,
+            ready INTEGER NOT NULL DEFAULT 0,
+            pending_work_s REAL NOT NULL DEFAULT 0,
+            last_ready_at REAL,
+            prep_mean_s REAL,
+            samples INTEGER NOT NULL DEFAULT 0
+        )''',
+        '''CREATE TABLE IF NOT EXISTS product_prep_stats (
+            product_id INTEGER PRIMARY KEY,
+            prep_mean_s REAL NOT NULL,
+            samples INTEGER NOT NULL DEFAULT 0
+        )''',
+        '''INSERT OR REPLACE INTO kitchen_queues (shop_id, pending, ready)
+           SELECT s.id, COUNT(CASE WHEN o.status = 'Pending' THEN 1 END), COUNT(CASE WHEN o.status = 'Ready' THEN 1 END)
+           FROM shops s LEFT JOIN orders o ON o.shop_id = s.id AND o.status IN ('Pending', 'Ready')
+           GROUP BY s.id''',
+    ]),
+    (9, "Add the index of monthly order archive tables", [
+        '''CREATE TABLE IF NOT EXISTS order_archives (
+            month TEXT NOT NULL,
+            shop_id INTEGER NOT NULL,
+            orders INTEGER NOT NULL DEFAULT 0,
+            first_order_date TIMESTAMP NOT NULL,
+            last_order_date TIMESTAMP NOT NULL,
+            PRIMARY KEY (month, shop_id)
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_order_archives_shop ON order_archives (shop_id, month)',
+        '''CREATE TABLE IF NOT EXISTS order_archive_users (
+            user_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            PRIMARY KEY (user_id, month)
+        ) WITHOUT ROWID''',
+    ]),
+    (10, "Add the change log that workers tail to keep their in-memory state in sync", [
+        '''CREATE TABLE IF NOT EXISTS change_log (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            origin INTEGER NOT NULL,
+            topic TEXT NOT NULL,
+            payload TEXT,
+            created_at REAL NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS change_topics (
+            topic TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            changed_at REAL NOT NULL
+        ) WITHOUT ROWID''',
+        # Gives every worker the same Last-Modified for a catalog that has not changed yet.
+        "INSERT OR IGNORE INTO change_topics (topic, version, changed_at) VALUES ('catalog', 0, (julianday('now') - 2440587.5) * 86400.0)",
+    ]),
+    (11, "Add per-product stock, optionally reset every day", [
+        'ALTER TABLE products ADD COLUMN stock INTEGER',
+        'ALTER TABLE products ADD COLUMN daily_stock INTEGER',
+        'ALTER TABLE products ADD COLUMN stock_date TEXT',
+    ]),
+    (12, "Add order versions for optimistic status updates and the Ready/closed times", [
+        'ALTER TABLE orders ADD COLUMN version INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE orders ADD COLUMN ready_at TIMESTAMP',
+        'ALTER TABLE orders ADD COLUMN closed_at TIMESTAMP',
+        # Orders changed since order_status_events was added already have their times.
+        '''UPDATE orders SET
+            ready_at = (SELECT MIN(changed_at) FROM order_status_events e WHERE e.order_id = orders.id AND e.to_status = 'Ready'),
+            closed_at = (SELECT MAX(changed_at) FROM order_status_events e WHERE e.order_id = orders.id AND e.to_status IN ('Completed', 'Rejected'))
+        WHERE id IN (SELECT order_id FROM order_status_events)''',
+    ]),
+]
+
+
+def current_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, target=None):
+    """Applies every pending migration up to `target` (default: latest).
+
+    Each migration runs in its own transaction together with the user_version
+    bump, so an interrupted upgrade can simply be re-run. Returns the list of
+    versions that were applied.
+    """
+    applied = []
+    version = current_version(conn)
+    for number, description, statements in MIGRATIONS:
+        if number <= version or (target is not None and number > target):
+            continue
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            if current_version(conn) >= number:
+                # Another process (e.g. a second worker starting up) applied it first.
+                conn.execute('ROLLBACK')
+                continue
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {number}')
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            conn.execute('ROLLBACK')
+            raise
+        applied.append(number)
+    return applied
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations.")
+    parser.add_argument('--database', default=DATABASE_FILE)
+    parser.add_argument('--status', action='store_true', help="Only show the current and latest version.")
+    parser.add_argument('--target', type=int, default=None, help="Stop after this version.")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database, isolation_level=None)
+    try:
+        version = current_version(conn)
+        print(f"Database {args.database}: schema version {version} (latest {latest_version()}).")
+        if args.status:
+            return
+        applied = migrate(conn, target=args.target)
+        for number, description, _ in MIGRATIONS:
+            if number in applied:
+                print(f"  applied {number}: {description}")
+        if not applied:
+            print("Already up to date.")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
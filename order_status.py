@@ -0,0 +1,183 @@
+import argparse
+import os
+import sqlite3
+import time
+from collections import defaultdict
+
+import changes
+import kitchen
+import rollup
+from db_pool import DATABASE_FILE
+
+# ==============================================================================
+# --- Configuration ---
+# ==============================================================================
+
+# Most transitions one request may apply; the whole batch is one write transaction.
+STATUS_BATCH_MAX = int(os.environ.get('CANTEEN_STATUS_BATCH_MAX', '500'))
+
+# status: the statuses an order in it may move to. Rejected doubles as
+# "cancelled": archive and history already treat it as a closed order.
+TRANSITIONS = {
+    'Pending': ('Ready', 'Rejected'),
+    'Ready': ('Completed', 'Rejected'),
+    'Completed': (),
+    'Rejected': (),
+}
+READY_STATUS = 'Ready'
+CLOSED_STATUSES = ('Completed', 'Rejected')
+
+# Per-order outcomes.
+UPDATED = 'updated'
+UNCHANGED = 'unchanged'                 # already in the requested status; nothing written
+NOT_FOUND = 'not_found'
+INVALID_TRANSITION = 'invalid_transition'
+CONFLICT = 'conflict'                   # the order's version is not the one the client saw
+
+
+# ==============================================================================
+# --- Status Transitions ---
+# ==============================================================================
+#
+# Every order carries a version that each status change increments. A client
+# that sends the version it last saw only moves the order if nobody else has
+# moved it since; otherwise it gets a conflict with the current status and
+# version, and two tablets marking the same order cannot overwrite each
+# other. A batch is applied in one write transaction: the current rows are
+# read under the write lock, each transition is checked against TRANSITIONS
+# and the expected version, and then one UPDATE per target status moves every
+# order going there. The UPDATE repeats the allowed source statuses, so the
+# state machine holds even for a write that skipped the checks. ready_at and
+# closed_at keep when an order was marked Ready and Completed/Rejected (UTC,
+# formatted like order_date), next to the full history in order_status_events.
+
+def transition_orders(conn, transitions, shop_id=None):
+    """Applies [(order_id, status, expected version or None), ...] in one write transaction.
+
+    With `shop_id`, orders of other shops are reported as not found. Returns
+    (outcomes, moved): one {'order_id', 'outcome', 'status', 'version'[, 'detail']}
+    per transition, in request order, with the order's status and version
+    after the batch; and [(order_id, shop_id, status, version)] for the orders
+    that moved, to publish once committed.
+    """
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        current = _current(conn, sorted({order_id for order_id, _, _ in transitions}))
+        outcomes, targets = [], defaultdict(list)
+        claimed = set()
+        for order_id, status, expected in transitions:
+            order = current.get(order_id)
+            if order is None or (shop_id is not None and order['shop_id'] != shop_id):
+                outcomes.append({'order_id': order_id, 'outcome': NOT_FOUND, 'status': None, 'version': None})
+                continue
+            outcome = {'order_id': order_id, 'outcome': UPDATED, 'status': order['status'], 'version': order['version']}
+            outcomes.append(outcome)
+            if expected is not None and expected != order['version']:
+                outcome.update(outcome=CONFLICT, detail=f"Order is at version {order['version']}, not {expected}.")
+            elif order_id in claimed:
+                outcome.update(outcome=CONFLICT, detail="Order already moved earlier in this batch.")
+            elif status == order['status']:
+                outcome['outcome'] = UNCHANGED
+            elif status not in TRANSITIONS.get(order['status'], ()):
+                outcome.update(outcome=INVALID_TRANSITION, detail=_invalid(order['status'], status))
+            else:
+                claimed.add(order_id)
+                targets[status].append(outcome)
+
+        now = kitchen.timestamp(time.time())
+        moved, rollup_moves = [], defaultdict(lambda: [0, 0.0])
+        for status, batch in targets.items():
+            sources = [source for source, allowed in TRANSITIONS.items() if status in allowed]
+            ids = [outcome['order_id'] for outcome in batch]
+            versions = dict(conn.execute(f'''
+                UPDATE orders SET status = ?, version = version + 1, ready_at = COALESCE(?, ready_at), closed_at = COALESCE(?, closed_at)
+                WHERE id IN ({','.join('?' * len(ids))}) AND status IN ({','.join('?' * len(sources))})
+                RETURNING id, version
+            ''', [status, now if status == READY_STATUS else None, now if status in CLOSED_STATUSES else None, *ids, *sources]).fetchall())
+            for outcome in batch:
+                order = current[outcome['order_id']]
+                outcome.update(status=status, version=versions[outcome['order_id']])
+                counts = rollup_moves[(order['shop_id'], order['day'], order['status'], status)]
+                counts[0] += 1
+                counts[1] += order['total_price']
+                kitchen.move_order(conn, outcome['order_id'], order['shop_id'], order['status'], status)
+                moved.append((outcome['order_id'], order['shop_id'], status, outcome['version']))
+        after = {order_id: (status, version) for order_id, _, status, version in moved}
+        for outcome in outcomes:
+            if outcome['outcome'] != UPDATED and outcome['order_id'] in after:
+                outcome['status'], outcome['version'] = after[outcome['order_id']]
+        for (shop, day, old, new), (count, total) in rollup_moves.items():
+            rollup.move_order(conn, shop, day, old, new, total, count)
+        if moved:
+            changes.record(conn, changes.ORDER_STATUS, {'orders': [list(order) for order in moved]})
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return outcomes, moved
+
+
+def _current(conn, order_ids):
+    """{order_id: row} with each order's status, version and what the rollup needs."""
+    current = {}
+    for start in range(0, len(order_ids), STATUS_BATCH_MAX):
+        chunk = order_ids[start:start + STATUS_BATCH_MAX]
+        for row in conn.execute(f'''
+            SELECT id, shop_id, status, version, total_price, DATE(order_date) AS day
+            FROM orders WHERE id IN ({','.join('?' * len(chunk))})
+        ''', chunk):
+            current[row[0]] = {'shop_id': row[1], 'status': row[2], 'version': row[3], 'total_price': row[4], 'day': row[5]}
+    return current
+
+
+def _invalid(old, new):
+    if new not in TRANSITIONS:
+        return f"Unknown status {new!r}; expected one of {', '.join(TRANSITIONS)}."
+    allowed = TRANSITIONS.get(old, ())
+    return f"A {old} order can only move to {' or '.join(allowed)}." if allowed else f"A {old} order cannot change status."
+
+
+# ==============================================================================
+# --- Prep-Time Report ---
+# ==============================================================================
+
+def prep_times(conn, shop_id, since):
+    """Seconds from order to Ready and from Ready to Completed for a shop's live orders since `since`."""
+    rows = conn.execute('''
+        SELECT (julianday(ready_at) - julianday(order_date)) * 86400,
+               CASE WHEN status = 'Completed' THEN (julianday(closed_at) - julianday(ready_at)) * 86400 END
+        FROM orders WHERE shop_id = ? AND order_date >= ? AND ready_at IS NOT NULL
+    ''', (shop_id, since)).fetchall()
+    prep = sorted(row[0] for row in rows)
+    pickup = sorted(row[1] for row in rows if row[1] is not None)
+    return {'prep_s': _summary(prep), 'pickup_s': _summary(pickup)}
+
+
+def _summary(values):
+    if not values:
+        return {'orders': 0}
+    return {'orders': len(values), 'mean': sum(values) / len(values),
+            **{f'p{int(q * 100)}': values[min(int(q * len(values)), len(values) - 1)] for q in (0.5, 0.9)}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print a shop's prep times (order to Ready) and pickup times (Ready to Completed).")
+    parser.add_argument('--shop', type=int, required=True)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--database', default=DATABASE_FILE)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    try:
+        report = prep_times(conn, args.shop, kitchen.timestamp(time.time() - args.days * 86400))
+    finally:
+        conn.close()
+    for label, summary in (('prep', report['prep_s']), ('pickup', report['pickup_s'])):
+        if summary['orders']:
+            print(f"{label:<7} {summary['orders']:>6} orders  mean {summary['mean']:7.0f}s  p50 {summary['p50']:7.0f}s  p90 {summary['p90']:7.0f}s")
+        else:
+            print(f"{label:<7} no orders")
+
+
+if __name__ == '__main__':
+    main()
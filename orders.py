@@ -0,0 +1,284 @@
+import asyncio
+import os
+import threading
+
+import changes
+import kitchen
+import recommendations
+import rollup
+import stock
+from catalog_cache import catalog
+from db_pool import database
+
+# ==============================================================================
+# --- Order Creation Pipeline ---
+# ==============================================================================
+#
+# Orders are priced before the write transaction starts: one SELECT resolves
+# every product in the request (or batch of requests), totals are computed
+# server-side, and the transaction itself only contains the INSERTs.
+
+# Orders wait for the single writer and are committed in micro-batches of at
+# most this many submissions, collected for at most this long.
+ORDER_QUEUE_ENABLED = os.environ.get('CANTEEN_ORDER_QUEUE', '1') != '0'
+ORDER_BATCH_SIZE = int(os.environ.get('CANTEEN_ORDER_BATCH_SIZE', '64'))
+ORDER_BATCH_WAIT_MS = float(os.environ.get('CANTEEN_ORDER_BATCH_WAIT_MS', '2'))
+
+# Matches the tax the cart page adds on top of the subtotal.
+TAX_RATE = 0.10
+# Stay well below SQLite's bound-variable limit when resolving product ids.
+PRODUCT_LOOKUP_CHUNK = 500
+
+
+class OrderValidationError(ValueError):
+    """An order that cannot be placed as submitted (unknown product, wrong shop, bad quantity)."""
+
+
+def resolve_products(conn, product_ids):
+    """Returns {product_id: row(price, shop_id)} for all ids in as few queries as possible."""
+    ids = list(set(product_ids))
+    products = {}
+    for start in range(0, len(ids), PRODUCT_LOOKUP_CHUNK):
+        chunk = ids[start:start + PRODUCT_LOOKUP_CHUNK]
+        rows = conn.execute(f"SELECT id, price, shop_id FROM products WHERE id IN ({','.join('?'*len(chunk))})", tuple(chunk)).fetchall()
+        products.update((row['id'], row) for row in rows)
+    return products
+
+
+def price_order(order, products):
+    """Validates one OrderCreate against resolved products.
+
+    Returns (total_price, [(product_id, quantity, price_per_item), ...]).
+    """
+    if not order.items:
+        raise OrderValidationError("An order must contain at least one item.")
+    lines = []
+    subtotal = 0.0
+    for item in order.items:
+        product = products.get(item.id)
+        if product is None:
+            raise OrderValidationError(f"Product {item.id} does not exist.")
+        if product['shop_id'] != order.shop_id:
+            raise OrderValidationError(f"Product {item.id} is not sold by shop {order.shop_id}.")
+        if item.quantity < 1:
+            raise OrderValidationError(f"Quantity for product {item.id} must be at least 1.")
+        lines.append((item.id, item.quantity, product['price']))
+        subtotal += product['price'] * item.quantity
+    return round(subtotal * (1 + TAX_RATE), 2), lines
+
+
+def price_orders(conn, orders, products=None):
+    """Prices a batch of orders with a single product lookup (none if `products` is given).
+
+    Returns a list of (order, total_price, lines); raises OrderValidationError
+    naming the first invalid order by its index in the batch.
+    """
+    if products is None:
+        products = resolve_products(conn, [item.id for order in orders for item in order.items])
+    priced = []
+    for index, order in enumerate(orders):
+        try:
+            total, lines = price_order(order, products)
+        except OrderValidationError as e:
+            raise OrderValidationError(f"Order {index}: {e}" if len(orders) > 1 else str(e))
+        priced.append((order, total, lines))
+    return priced
+
+
+def insert_orders(conn, priced, before_commit=None):
+    """Inserts priced orders in one short write transaction and returns their ids.
+
+    `before_commit(conn, order_ids)`, if given, runs last inside the
+    transaction; anything it raises rolls the orders back and propagates.
+    """
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        order_ids, left, sold_out = _insert(conn, priced, before_commit)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    # These orders hold nothing in the reservations; the stock they left is all there is to record.
+    stock.reservations.release({}, left)
+    _committed([sold_out])
+    return order_ids
+
+
+def _insert(conn, priced, before_commit):
+    """Writes one submission; returns (order_ids, stock left per tracked product, sold-out catalog Change or None)."""
+    left, sold_out = stock.decrement(conn, [line for _, _, lines in priced for line in lines])
+    order_ids = []
+    item_rows = []
+    for order, total, lines in priced:
+        cursor = conn.execute(
+            'INSERT INTO orders (user_id, shop_id, total_price, status) VALUES (?, ?, ?, ?)',
+            (order.user_id, order.shop_id, total, 'Pending')
+        )
+        order_id = cursor.lastrowid
+        order_ids.append(order_id)
+        item_rows.extend((order_id, product_id, quantity, price) for product_id, quantity, price in lines)
+    conn.executemany(
+        'INSERT INTO order_items (order_id, product_id, quantity, price_per_item) VALUES (?, ?, ?, ?)',
+        item_rows
+    )
+    rollup.record_orders(conn, order_ids)
+    recommendations.record_orders(conn, order_ids)
+    kitchen.record_orders(conn, order_ids)
+    changes.record(conn, changes.ORDERS_CREATED, {'orders': [[order_id, order.shop_id] for order_id, (order, _, _) in zip(order_ids, priced)]})
+    if before_commit is not None:
+        before_commit(conn, order_ids)
+    return order_ids, left, sold_out
+
+
+def _committed(sold_outs):
+    """Lets the catalog cache know about products that committed submissions sold out."""
+    for sold_out in sold_outs:
+        if sold_out is not None:
+            catalog.invalidate(sold_out.version, sold_out.changed_at)
+
+
+def write_submissions(conn, submissions):
+    """Prices and inserts independent submissions in one write transaction.
+
+    `submissions` is a list of (orders, before_commit), each placed all or
+    nothing as by insert_orders, but under its own savepoint: an invalid or
+    failing submission is rolled back alone. Returns, per submission, either
+    [(order_id, total_price), ...] or the exception it raised. Errors outside
+    any one submission (the lock, the commit) are raised for all of them.
+    Successful results come with the stock they left, as
+    ([(order_id, total_price), ...], {product_id: stock left}).
+    """
+    products = resolve_products(conn, [item.id for orders, _ in submissions for order in orders for item in order.items])
+    results = [None] * len(submissions)
+    priced, written = [], []
+    for index, (orders, before_commit) in enumerate(submissions):
+        try:
+            priced.append((index, price_orders(conn, orders, products), before_commit))
+        except OrderValidationError as e:
+            results[index] = e
+    if not priced:
+        return results
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        for index, lines, before_commit in priced:
+            conn.execute('SAVEPOINT submission')
+            try:
+                order_ids, left, sold_out = _insert(conn, lines, before_commit)
+            except Exception as e:
+                conn.execute('ROLLBACK TO submission')
+                results[index] = e
+            else:
+                results[index] = ([(order_id, total) for order_id, (_, total, _) in zip(order_ids, lines)], left)
+                written.append(sold_out)
+            conn.execute('RELEASE submission')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    _committed(written)
+    return results
+
+
+# ==============================================================================
+# --- Group Commit ---
+# ==============================================================================
+#
+# SQLite has one writer at a time. Rather than every checkout taking the write
+# lock and committing on its own, callers hand their orders to OrderQueue and
+# a single writer task takes whatever has queued up - up to ORDER_BATCH_SIZE
+# submissions, waiting at most ORDER_BATCH_WAIT_MS for more - and writes it
+# with write_submissions(): one lock, one commit. Each caller still gets its
+# own order ids or its own error.
+
+class OrderQueue:
+    """Funnels order submissions through one writer task that commits them in micro-batches."""
+
+    def __init__(self, database, batch_size=ORDER_BATCH_SIZE, wait_ms=ORDER_BATCH_WAIT_MS, enabled=ORDER_QUEUE_ENABLED):
+        self.database = database
+        self.batch_size = batch_size
+        self.wait = wait_ms / 1000
+        self.enabled = enabled
+        self._queue = None
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'batches': 0, 'largest_batch': 0, 'failed_batches': 0}
+
+    async def submit(self, orders, before_commit=None):
+        """Places `orders` (all or nothing) and returns [(order_id, total_price), ...].
+
+        Raises stock.SoldOutError without queueing anything when the stock
+        reservations already know there is not enough left.
+        """
+        holds = stock.reservations.reserve(orders)
+        left = None
+        try:
+            if self._queue is None:
+                (result,) = await self.database.run(write_submissions, [(orders, before_commit)])
+            else:
+                future = asyncio.get_running_loop().create_future()
+                self._queue.put_nowait((orders, before_commit, future))
+                result = await future
+            if isinstance(result, stock.SoldOutError):
+                left = {result.product_id: result.remaining}
+            if isinstance(result, Exception):
+                raise result
+            placed, left = result
+            return placed
+        finally:
+            # One locked call, so the units sold are never counted both as held and as gone.
+            stock.reservations.release(holds, left)
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.wait
+        while len(batch) < self.batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        """The writer task: commits queued submissions until cancelled. Without it, submit() writes directly."""
+        if not self.enabled:
+            return
+        self._queue = asyncio.Queue()
+        batch = []
+        try:
+            while True:
+                batch = await self._next_batch()
+                try:
+                    results = await self.database.run(write_submissions, [(orders, hook) for orders, hook, _ in batch])
+                except Exception as e:
+                    results = [e] * len(batch)
+                    with self._lock:
+                        self._stats['failed_batches'] += 1
+                for (_, _, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+                with self._lock:
+                    self._stats['submitted'] += len(batch)
+                    self._stats['batches'] += 1
+                    self._stats['largest_batch'] = max(self._stats['largest_batch'], len(batch))
+        finally:
+            queue, self._queue = self._queue, None
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("Order queue stopped"))
+
+    def stats(self):
+        with self._lock:
+            stats = {**self._stats, 'enabled': self.enabled, 'batch_size': self.batch_size, 'wait_ms': self.wait * 1000}
+        stats['average_batch'] = round(stats['submitted'] / stats['batches'], 2) if stats['batches'] else None
+        stats['queued'] = self._queue.qsize() if self._queue is not None else 0
+        return stats
+
+
+queue = OrderQueue(database)
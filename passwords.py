@@ -0,0 +1,281 @@
+import asyncio
+import base64
+import functools
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# ==============================================================================
+# --- Configuration ---
+# ==============================================================================
+
+# Algorithm used for new hashes: 'scrypt' or 'pbkdf2_sha256'.
+PASSWORD_HASHER = os.environ.get('CANTEEN_PASSWORD_HASHER', 'scrypt')
+SCRYPT_N = int(os.environ.get('CANTEEN_SCRYPT_N', str(2 ** 14)))
+SCRYPT_R = int(os.environ.get('CANTEEN_SCRYPT_R', '8'))
+SCRYPT_P = int(os.environ.get('CANTEEN_SCRYPT_P', '1'))
+PBKDF2_ITERATIONS = int(os.environ.get('CANTEEN_PBKDF2_ITERATIONS', '600000'))
+SALT_BYTES = 16
+
+# Threads reserved for key derivation. hashlib releases the GIL while deriving,
+# so these run in parallel without holding up the event loop or the DB workers.
+HASH_WORKERS = int(os.environ.get('CANTEEN_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+# Hash jobs allowed to wait for a worker before new logins are turned away.
+HASH_QUEUE_LIMIT = int(os.environ.get('CANTEEN_HASH_QUEUE_LIMIT', '64'))
+
+# Failed login attempts allowed per window before further attempts are
+# refused without hashing anything.
+LOGIN_ATTEMPTS_PER_EMAIL = int(os.environ.get('CANTEEN_LOGIN_ATTEMPTS_PER_EMAIL', '10'))
+LOGIN_ATTEMPTS_PER_IP = int(os.environ.get('CANTEEN_LOGIN_ATTEMPTS_PER_IP', '50'))
+LOGIN_WINDOW_S = float(os.environ.get('CANTEEN_LOGIN_WINDOW_S', '300'))
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing queue is full."""
+
+
+# ==============================================================================
+# --- Hashers ---
+# ==============================================================================
+#
+# Stored hashes are self-describing strings, so the cost can be raised (or the
+# algorithm changed) at any time: existing hashes keep verifying and are
+# re-hashed with the current settings the next time their owner logs in.
+#
+#   scrypt$<n>$<r>$<p>$<salt>$<hash>
+#   pbkdf2_sha256$<iterations>$<salt>$<hash>
+#   <64 hex chars>                          legacy unsalted SHA-256
+
+def _b64encode(data):
+    return base64.b64encode(data).decode().rstrip('=')
+
+
+def _b64decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+class ScryptHasher:
+    algorithm = 'scrypt'
+
+    def __init__(self, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+        self.n, self.r, self.p = n, r, p
+
+    def _derive(self, password, salt, n, r, p):
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + (1 << 20), dklen=32)
+
+    def encode(self, password, salt):
+        digest = self._derive(password, salt, self.n, self.r, self.p)
+        return f'{self.algorithm}${self.n}${self.r}${self.p}${_b64encode(salt)}${_b64encode(digest)}'
+
+    def verify(self, password, encoded):
+        _, n, r, p, salt, digest = encoded.split('$')
+        return hmac.compare_digest(self._derive(password, _b64decode(salt), int(n), int(r), int(p)), _b64decode(digest))
+
+    def needs_rehash(self, encoded):
+        return encoded.split('$')[1:4] != [str(self.n), str(self.r), str(self.p)]
+
+
+class PBKDF2Hasher:
+    algorithm = 'pbkdf2_sha256'
+
+    def __init__(self, iterations=PBKDF2_ITERATIONS):
+        self.iterations = iterations
+
+    def encode(self, password, salt):
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, self.iterations)
+        return f'{self.algorithm}${self.iterations}${_b64encode(salt)}${_b64encode(digest)}'
+
+    def verify(self, password, encoded):
+        _, iterations, salt, digest = encoded.split('$')
+        derived = hashlib.pbkdf2_hmac('sha256', password.encode(), _b64decode(salt), int(iterations))
+        return hmac.compare_digest(derived, _b64decode(digest))
+
+    def needs_rehash(self, encoded):
+        return encoded.split('$')[1] != str(self.iterations)
+
+
+class LegacySHA256Hasher:
+    """Verify-only support for the unsalted hashes written before the KDF switch."""
+    algorithm = 'sha256'
+
+    def verify(self, password, encoded):
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), encoded)
+
+    def needs_rehash(self, encoded):
+        return True
+
+
+HASHERS = {'scrypt': ScryptHasher, 'pbkdf2_sha256': PBKDF2Hasher}
+
+
+def get_hasher(name=PASSWORD_HASHER):
+    try:
+        return HASHERS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown password hasher {name!r}; expected one of {', '.join(HASHERS)}")
+
+
+class PasswordHasher:
+    """Hashes new passwords with the configured algorithm and verifies any stored format."""
+
+    def __init__(self, hasher=None):
+        self.hasher = hasher or get_hasher()
+        self._verifiers = {self.hasher.algorithm: self.hasher, LegacySHA256Hasher.algorithm: LegacySHA256Hasher()}
+
+    def _verifier_for(self, encoded):
+        algorithm = encoded.split('$', 1)[0] if '$' in encoded else LegacySHA256Hasher.algorithm
+        if algorithm not in self._verifiers:
+            self._verifiers[algorithm] = HASHERS[algorithm]()
+        return self._verifiers[algorithm]
+
+    def hash(self, password):
+        return self.hasher.encode(password, os.urandom(SALT_BYTES))
+
+    def verify(self, password, encoded):
+        """Returns (matches, needs_rehash). Unknown or malformed hashes never match."""
+        try:
+            verifier = self._verifier_for(encoded)
+            if not verifier.verify(password, encoded):
+                return False, False
+        except (KeyError, ValueError):
+            return False, False
+        return True, verifier is not self.hasher or self.hasher.needs_rehash(encoded)
+
+
+hasher = PasswordHasher()
+
+
+def hash_password(password):
+    """Hashes a password for storing, with the configured KDF and a fresh salt."""
+    return hasher.hash(password)
+
+
+@functools.lru_cache(maxsize=1)
+def dummy_hash():
+    """A hash to verify against for unknown emails, so they take as long as wrong passwords."""
+    return hasher.hash(_b64encode(os.urandom(SALT_BYTES)))
+
+
+# ==============================================================================
+# --- Hashing Pool ---
+# ==============================================================================
+
+class HashingPool:
+    """Runs password hashing on its own bounded executor.
+
+    Key derivation is deliberately slow, so it gets a few dedicated threads
+    rather than sharing the DB executor or FastAPI's threadpool. Once
+    `queue_limit` jobs are waiting, new ones raise HasherBusy instead of piling
+    up behind a credential-stuffing burst.
+    """
+
+    def __init__(self, hasher, workers=HASH_WORKERS, queue_limit=HASH_QUEUE_LIMIT):
+        self.hasher = hasher
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='canteen-hash')
+        self._stats = {'hashed': 0, 'verified': 0, 'rejected_busy': 0}
+
+    async def _submit(self, counter, fn, *args):
+        with self._lock:
+            if self._pending >= self.workers + self.queue_limit:
+                self._stats['rejected_busy'] += 1
+                raise HasherBusy()
+            self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(fn, *args))
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._stats[counter] += 1
+
+    async def hash(self, password):
+        return await self._submit('hashed', self.hasher.hash, password)
+
+    async def verify(self, password, encoded):
+        return await self._submit('verified', self.hasher.verify, password, encoded)
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'workers': self.workers, 'pending': self._pending, 'algorithm': self.hasher.hasher.algorithm}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+hashing = HashingPool(hasher)
+
+
+# ==============================================================================
+# --- Login Attempt Limiter ---
+# ==============================================================================
+
+class LoginLimiter:
+    """Sliding-window counter of failed logins per email and per client IP.
+
+    Only failed attempts count, so students logging in correctly from behind
+    one address (a campus NAT or a proxy) never lock each other out. The
+    limits are checked before the password is hashed, so once an account or
+    an address has failed too often, further attempts are refused cheaply. A
+    successful login clears the count for that email.
+    """
+
+    def __init__(self, per_email=LOGIN_ATTEMPTS_PER_EMAIL, per_ip=LOGIN_ATTEMPTS_PER_IP, window=LOGIN_WINDOW_S):
+        self.limits = {'email': per_email, 'ip': per_ip}
+        self.window = window
+        self._attempts = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def _recent(self, key, now):
+        attempts = self._attempts.get(key)
+        if attempts is None:
+            return None
+        while attempts and attempts[0] <= now - self.window:
+            attempts.popleft()
+        return attempts
+
+    def _sweep(self, now):
+        # Drop keys with no recent attempts so the table does not grow without bound.
+        if now - self._last_sweep < self.window:
+            return
+        self._last_sweep = now
+        for key in [key for key in self._attempts if not self._recent(key, now)]:
+            del self._attempts[key]
+
+    def check(self, email, ip):
+        """Returns 0 if an attempt is allowed, else seconds until the next attempt may be made."""
+        now = time.monotonic()
+        keys = [(('email', email.lower()), self.limits['email']), (('ip', ip), self.limits['ip'])]
+        with self._lock:
+            self._sweep(now)
+            for key, limit in keys:
+                attempts = self._recent(key, now)
+                if attempts is not None and len(attempts) >= limit:
+                    return max(1, int(attempts[0] + self.window - now + 1))
+        return 0
+
+    def failed(self, email, ip):
+        """Records a failed attempt against the email and the address."""
+        now = time.monotonic()
+        with self._lock:
+            for key in (('email', email.lower()), ('ip', ip)):
+                self._attempts.setdefault(key, deque()).append(now)
+
+    def reset(self, email):
+        with self._lock:
+            self._attempts.pop(('email', email.lower()), None)
+
+    def stats(self):
+        with self._lock:
+            return {'tracked_keys': len(self._attempts), **{f'max_per_{k}': v for k, v in self.limits.items()}, 'window_s': self.window}
+
+
+login_limiter = LoginLimiter()
@@ -0,0 +1,263 @@
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import sqlite3
+
+import changes
+import stock
+from db_pool import DATABASE_FILE
+
+# ==============================================================================
+# --- Configuration ---
+# ==============================================================================
+
+# Rows written per executemany call; the whole import is still one transaction.
+IMPORT_CHUNK_SIZE = int(os.environ.get('CANTEEN_IMPORT_CHUNK_SIZE', '500'))
+IMPORT_MAX_ROWS = int(os.environ.get('CANTEEN_IMPORT_MAX_ROWS', '20000'))
+
+# Columns an import row may set, in the order of the CSV header written by `template()`.
+COLUMNS = ('id', 'name', 'price', 'description', 'image_url', 'category_id', 'shop_id', 'stock', 'daily_stock')
+MATCH_MODES = ('name', 'id')
+SQLITE_INT_MAX = 2 ** 63 - 1
+
+
+class ProductImportError(ValueError):
+    """The upload as a whole cannot be read (bad JSON/CSV, not a list, too many rows)."""
+
+
+# ==============================================================================
+# --- Parsing and Validation ---
+# ==============================================================================
+#
+# Rows come from a JSON array of product objects (the products.json format,
+# or what GET /products returns) or from CSV with a header row naming the
+# columns. Every row is checked before anything is written; a row's errors
+# are reported with its index (0-based, not counting the CSV header).
+
+def parse(body, content_type):
+    """Returns the uploaded rows as a list of dicts."""
+    if 'csv' in (content_type or ''):
+        try:
+            text = body.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise ProductImportError("CSV must be UTF-8.")
+        # Empty cells mean "not given", like a missing JSON key.
+        rows = [{key: value for key, value in row.items() if key and value not in ('', None)} for row in csv.DictReader(io.StringIO(text))]
+    else:
+        try:
+            rows = json.loads(body)
+        except ValueError as e:
+            raise ProductImportError(f"Invalid JSON: {e}")
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ProductImportError("Expected a JSON array of product objects.")
+    if not rows:
+        raise ProductImportError("No products provided.")
+    if len(rows) > IMPORT_MAX_ROWS:
+        raise ProductImportError(f"At most {IMPORT_MAX_ROWS} products per import; got {len(rows)}.")
+    return rows
+
+
+def _number(value, kind, name, errors, minimum=0):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            value = kind(value.strip())
+        except ValueError:
+            errors.append(f"{name} must be a {'whole ' if kind is int else ''}number.")
+            return None
+    if (isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value)
+            or (kind is int and value != int(value))):
+        errors.append(f"{name} must be a {'whole ' if kind is int else ''}number.")
+        return None
+    if value < minimum:
+        errors.append(f"{name} must be at least {minimum}.")
+        return None
+    if kind is int and value > SQLITE_INT_MAX:
+        errors.append(f"{name} must be at most {SQLITE_INT_MAX}.")
+        return None
+    return kind(value)
+
+
+def validate(row, shops, categories, match, shop_id=None):
+    """Returns (product dict with the given columns, [errors]).
+
+    With `shop_id`, the row belongs to that shop: a row without shop_id gets
+    it, and a row naming another shop is an error.
+    """
+    errors = []
+    unknown = sorted(set(row) - set(COLUMNS) - {'thumbnail_url', 'sold_out'})
+    if unknown:
+        errors.append(f"Unknown column(s): {', '.join(unknown)}.")
+    product = {}
+    name = row.get('name')
+    if name is not None:
+        if not isinstance(name, str) or not name.strip():
+            errors.append("name must be a non-empty string.")
+        else:
+            product['name'] = name.strip()
+    for key in ('description', 'image_url'):
+        if key in row:
+            if row[key] is not None and not isinstance(row[key], str):
+                errors.append(f"{key} must be a string.")
+            else:
+                product[key] = row[key]
+    for key, kind in (('price', float), ('stock', int), ('daily_stock', int), ('category_id', int), ('shop_id', int), ('id', int)):
+        if key in row:
+            value = _number(row[key], kind, key, errors, minimum=1 if key.endswith('id') else 0)
+            if value is not None or (row[key] is None and key in ('stock', 'daily_stock')):
+                product[key] = value
+    if shop_id is not None:
+        if product.setdefault('shop_id', shop_id) != shop_id:
+            errors.append(f"shop_id must be {shop_id}, the shop you manage.")
+    elif product.get('shop_id') is not None and product['shop_id'] not in shops:
+        errors.append(f"Shop {product['shop_id']} does not exist.")
+    if product.get('category_id') is not None and product['category_id'] not in categories:
+        errors.append(f"Category {product['category_id']} does not exist.")
+    if match == 'name':
+        product.pop('id', None)
+        if 'name' not in product or 'shop_id' not in product:
+            errors.append("name and shop_id are required to match products by name.")
+    elif 'id' not in product:
+        errors.append("id is required to match products by id.")
+    return product, errors
+
+
+# ==============================================================================
+# --- Upsert ---
+# ==============================================================================
+
+def upsert_products(conn, rows, match='name', skip_invalid=False, shop_id=None):
+    """Validates `rows`, then inserts or updates them in one write transaction.
+
+    With match='name', a row updates the shop's product of the same name and
+    is inserted if there is none; with match='id', it updates the product
+    with its id, or is inserted under that id. Columns a row leaves out keep
+    their current values (or the defaults, for a new product, which needs
+    name, price, category_id and shop_id). If any row is invalid nothing is
+    written, unless `skip_invalid`, in which case the valid rows are. The
+    catalog version moves on once for the whole import. With `shop_id`, every
+    row belongs to that shop, and match='id' may not update another shop's
+    product.
+
+    Returns ({'inserted', 'updated', 'errors', 'products'}, catalog Change or None).
+    """
+    if match not in MATCH_MODES:
+        raise ProductImportError(f"match must be one of {', '.join(MATCH_MODES)}.")
+    shops = {row[0] for row in conn.execute('SELECT id FROM shops')}
+    categories = {row[0] for row in conn.execute('SELECT id FROM categories')}
+    products, errors = [], []
+    for index, row in enumerate(rows):
+        product, row_errors = validate(row, shops, categories, match, shop_id)
+        if row_errors:
+            errors.append({'row': index, 'errors': row_errors})
+        else:
+            products.append((index, product))
+    result = {'inserted': 0, 'updated': 0, 'errors': errors, 'products': []}
+    if (errors and not skip_invalid) or not products:
+        return result, None
+
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        # Resolved inside the write lock, so no other write can add a product in between.
+        existing = _existing(conn, products, match)
+        next_id = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'products'").fetchone()[0]
+        next_id = max(next_id, conn.execute('SELECT COALESCE(MAX(id), 0) FROM products').fetchone()[0]) + 1
+        inserts, updates, day = [], {}, stock.today()
+        for index, product in products:
+            key = (product['shop_id'], product['name']) if match == 'name' else product['id']
+            product_id, product_shop = existing.get(key, (None, None))
+            if shop_id is not None and product_id is not None and product_shop != shop_id:
+                errors.append({'row': index, 'errors': [f"Product {product_id} belongs to another shop."]})
+                continue
+            if 'stock' in product:
+                product['stock_date'] = day
+            if product_id is None:
+                missing = [column for column in ('name', 'price', 'category_id', 'shop_id') if product.get(column) is None]
+                if missing:
+                    errors.append({'row': index, 'errors': [f"New product needs {', '.join(missing)}."]})
+                    continue
+                product_id = product.pop('id', None) or next_id
+                next_id = max(next_id, product_id + 1)
+                existing[key] = (product_id, product['shop_id'])
+                inserts.append({**product, 'id': product_id})
+                result['products'].append({'row': index, 'id': product_id, 'action': 'inserted'})
+            else:
+                product.pop('id', None)
+                updates.setdefault(tuple(sorted(product)), []).append({**product, 'id': product_id})
+                result['products'].append({'row': index, 'id': product_id, 'action': 'updated'})
+        errors.sort(key=lambda error: error['row'])
+        if (errors and not skip_invalid) or not (inserts or updates):
+            conn.rollback()
+            return {**result, 'products': [] if errors and not skip_invalid else result['products']}, None
+
+        insert_columns = ('id', 'name', 'price', 'description', 'image_url', 'category_id', 'shop_id', 'stock', 'daily_stock', 'stock_date')
+        _executemany(conn, f"INSERT INTO products ({', '.join(insert_columns)}) VALUES ({', '.join(':' + c for c in insert_columns)})",
+                     [{column: product.get(column) for column in insert_columns} for product in inserts])
+        for columns, params in updates.items():
+            _executemany(conn, f"UPDATE products SET {', '.join(f'{c} = :{c}' for c in columns)} WHERE id = :id", params)
+        change = changes.record(conn, changes.CATALOG)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    result['inserted'] = len(inserts)
+    result['updated'] = sum(len(params) for params in updates.values())
+    return result, change
+
+
+def _existing(conn, products, match):
+    """{match key: (product id, shop id)} of the products the rows would update."""
+    found = {}
+    if match == 'name':
+        for shop_id in sorted({product['shop_id'] for _, product in products}):
+            # Lowest id first, so with duplicate names the oldest product is the one updated.
+            for product_id, name in conn.execute('SELECT id, name FROM products WHERE shop_id = ? ORDER BY id DESC', (shop_id,)):
+                found[(shop_id, name)] = (product_id, shop_id)
+    else:
+        ids = sorted({product['id'] for _, product in products})
+        for start in range(0, len(ids), IMPORT_CHUNK_SIZE):
+            chunk = ids[start:start + IMPORT_CHUNK_SIZE]
+            found.update((row[0], (row[0], row[1])) for row in conn.execute(f"SELECT id, shop_id FROM products WHERE id IN ({','.join('?' * len(chunk))})", chunk))
+    return found
+
+
+def _executemany(conn, sql, params):
+    for start in range(0, len(params), IMPORT_CHUNK_SIZE):
+        conn.executemany(sql, params[start:start + IMPORT_CHUNK_SIZE])
+
+
+def template():
+    """An empty CSV with the import columns, for owners to fill in."""
+    return ','.join(COLUMNS) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import or update products from a JSON array (e.g. products.json) or a CSV file.")
+    parser.add_argument('file')
+    parser.add_argument('--database', default=DATABASE_FILE)
+    parser.add_argument('--match', choices=MATCH_MODES, default='name', help="Update existing products with the same shop and name, or the same id.")
+    parser.add_argument('--skip-invalid', action='store_true', help="Import the valid rows even if some are invalid.")
+    args = parser.parse_args()
+
+    with open(args.file, 'rb') as f:
+        body = f.read()
+    conn = sqlite3.connect(args.database)
+    try:
+        rows = parse(body, 'text/csv' if args.file.lower().endswith('.csv') else 'application/json')
+        result, _ = upsert_products(conn, rows, args.match, args.skip_invalid)
+    except ProductImportError as e:
+        parser.exit(1, f"{e}\n")
+    finally:
+        conn.close()
+    for error in result['errors']:
+        print(f"  row {error['row']}: {' '.join(error['errors'])}")
+    print(f"Inserted {result['inserted']} and updated {result['updated']} products"
+          + (f"; {len(result['errors'])} rows rejected." if result['errors'] else "."))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import archive
+from db_pool import DATABASE_FILE
+
+# ==============================================================================
+# --- Configuration ---
+# ==============================================================================
+
+POPULAR_WINDOW_DAYS = int(os.environ.get('CANTEEN_POPULAR_WINDOW_DAYS', '14'))
+REFRESH_INTERVAL_S = float(os.environ.get('CANTEEN_RECOMMENDATIONS_REFRESH_S', '300'))
+# Ids kept per precomputed list; also the largest `limit` the endpoints accept.
+TOP_N = int(os.environ.get('CANTEEN_RECOMMENDATIONS_TOP_N', '24'))
+POPULAR_DEFAULT_LIMIT = 8
+RELATED_DEFAULT_LIMIT = 6
+
+logger = logging.getLogger('canteen.recommendations')
+
+
+# ==============================================================================
+# --- Incremental Counters ---
+# ==============================================================================
+#
+# product_daily_sales holds the quantity of each product ordered per day, and
+# product_pairs holds, for each product, how many orders also contained each
+# other product (both directions are stored, so a product's partners are one
+# primary-key range). Both are updated in the same transaction as the order
+# insert, like the revenue rollup. Items count when the order is placed,
+# whatever happens to the order afterwards.
+
+_SALES_UPSERT = '''
+    INSERT INTO product_daily_sales (day, product_id, quantity)
+    SELECT DATE(o.order_date), oi.product_id, SUM(oi.quantity)
+    FROM orders o JOIN order_items oi ON oi.order_id = o.id
+    WHERE o.id IN ({placeholders})
+    GROUP BY DATE(o.order_date), oi.product_id
+    ON CONFLICT (day, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+'''
+
+_PAIRS_UPSERT = '''
+    INSERT INTO product_pairs (product_id, other_id, orders)
+    SELECT a.product_id, b.product_id, COUNT(DISTINCT a.order_id)
+    FROM order_items a JOIN order_items b ON b.order_id = a.order_id AND b.product_id != a.product_id
+    WHERE a.order_id IN ({placeholders})
+    GROUP BY a.product_id, b.product_id
+    ON CONFLICT (product_id, other_id) DO UPDATE SET orders = orders + excluded.orders
+'''
+
+
+def record_orders(conn, order_ids):
+    """Adds newly inserted orders to the sales and co-purchase counters. Call inside the inserting transaction."""
+    for start in range(0, len(order_ids), 500):
+        chunk = tuple(order_ids[start:start + 500])
+        placeholders = ','.join('?' * len(chunk))
+        conn.execute(_SALES_UPSERT.format(placeholders=placeholders), chunk)
+        conn.execute(_PAIRS_UPSERT.format(placeholders=placeholders), chunk)
+
+
+def rebuild(conn):
+    """Recomputes both counters from the live and archived order tables."""
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('DELETE FROM product_daily_sales')
+        conn.execute('DELETE FROM product_pairs')
+        for orders_table, items_table in archive.order_tables(conn):
+            conn.execute(f'''
+                INSERT INTO product_daily_sales (day, product_id, quantity)
+                SELECT DATE(o.order_date), oi.product_id, SUM(oi.quantity)
+                FROM {orders_table} o JOIN {items_table} oi ON oi.order_id = o.id
+                WHERE 1
+                GROUP BY DATE(o.order_date), oi.product_id
+                ON CONFLICT (day, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+            ''')
+            conn.execute(f'''
+                INSERT INTO product_pairs (product_id, other_id, orders)
+                SELECT a.product_id, b.product_id, COUNT(DISTINCT a.order_id)
+                FROM {items_table} a JOIN {items_table} b ON b.order_id = a.order_id AND b.product_id != a.product_id
+                WHERE 1
+                GROUP BY a.product_id, b.product_id
+                ON CONFLICT (product_id, other_id) DO UPDATE SET orders = orders + excluded.orders
+            ''')
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+
+# ==============================================================================
+# --- Precomputed Top-N Lists ---
+# ==============================================================================
+
+class RecommendationSnapshot:
+    """Ranked product ids, computed together by one refresh.
+
+    `popular` maps None, ('shop', id), ('category', id) and
+    ('shop_category', shop_id, category_id) to ids ranked by quantity sold in
+    the window; products that did not sell follow in id order. `related`
+    maps a product id to the ids most often ordered with it.
+    """
+
+    def __init__(self, refreshed_at, popular, related):
+        self.refreshed_at = refreshed_at
+        self.popular = popular
+        self.related = related
+
+
+class Recommender:
+    """Keeps the current RecommendationSnapshot and refreshes it on a schedule.
+
+    Requests only slice precomputed lists and look the products up in the
+    catalog snapshot, so their cost does not grow with the catalog or with
+    order history. Products added since the last refresh show up after the
+    next one; deleted products are skipped because they are no longer in
+    the catalog.
+    """
+
+    def __init__(self, window_days=POPULAR_WINDOW_DAYS, top_n=TOP_N, interval=REFRESH_INTERVAL_S):
+        self.window_days = window_days
+        self.top_n = top_n
+        self.interval = interval
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._stats = {'refreshes': 0, 'failures': 0, 'last_refresh_ms': None}
+
+    def current(self):
+        return self._snapshot
+
+    def refresh(self, conn):
+        started = time.perf_counter()
+        since = (datetime.now(timezone.utc) - timedelta(days=self.window_days)).strftime('%Y-%m-%d')
+        ranked = conn.execute('''
+            SELECT p.id, p.shop_id, p.category_id
+            FROM products p LEFT JOIN (
+                SELECT product_id, SUM(quantity) AS sold FROM product_daily_sales WHERE day >= ? GROUP BY product_id
+            ) s ON s.product_id = p.id
+            ORDER BY COALESCE(s.sold, 0) DESC, p.id
+        ''', (since,)).fetchall()
+        popular = defaultdict(list)
+        for product_id, shop_id, category_id in ranked:
+            for key in (None, ('shop', shop_id), ('category', category_id), ('shop_category', shop_id, category_id)):
+                if len(popular[key]) < self.top_n:
+                    popular[key].append(product_id)
+
+        related = defaultdict(list)
+        for product_id, other_id in conn.execute('''
+            SELECT product_id, other_id FROM (
+                SELECT product_id, other_id, ROW_NUMBER() OVER (PARTITION BY product_id ORDER BY orders DESC, other_id) AS n
+                FROM product_pairs
+            ) WHERE n <= ?
+        ''', (self.top_n,)):
+            related[product_id].append(other_id)
+
+        snapshot = RecommendationSnapshot(datetime.now(timezone.utc), dict(popular), dict(related))
+        with self._lock:
+            self._snapshot = snapshot
+            self._stats['refreshes'] += 1
+            self._stats['last_refresh_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        return snapshot
+
+    async def run(self, database):
+        """Refreshes every `interval` seconds until cancelled (the first refresh happens at startup)."""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await database.run(self.refresh)
+            except Exception:
+                with self._lock:
+                    self._stats['failures'] += 1
+                logger.exception("Refreshing recommendations failed")
+
+    @staticmethod
+    def popular(snapshot, catalog, limit, shop_id=None, category_id=None):
+        """The `limit` most popular catalog products, optionally within one shop and/or category."""
+        if shop_id and category_id:
+            key = ('shop_category', shop_id, category_id)
+        elif shop_id:
+            key = ('shop', shop_id)
+        elif category_id:
+            key = ('category', category_id)
+        else:
+            key = None
+        return _products(catalog, snapshot.popular.get(key, ()), limit)
+
+    @staticmethod
+    def related(snapshot, catalog, product, limit):
+        """Products most often ordered with `product`, topped up with popular items like it.
+
+        The top-up takes the same category at the same shop first, then the
+        same category anywhere, then the rest of the shop.
+        """
+        shop_id, category_id = product['shop_id'], product['category_id']
+        candidates = [
+            *snapshot.related.get(product['id'], ()),
+            *snapshot.popular.get(('shop_category', shop_id, category_id), ()),
+            *snapshot.popular.get(('category', category_id), ()),
+            *snapshot.popular.get(('shop', shop_id), ()),
+        ]
+        return _products(catalog, (i for i in candidates if i != product['id']), limit)
+
+    def stats(self):
+        with self._lock:
+            snapshot = self._snapshot
+            return {
+                **self._stats,
+                'refreshed_at': snapshot.refreshed_at.isoformat() if snapshot else None,
+                'window_days': self.window_days,
+                'top_n': self.top_n,
+                'interval_s': self.interval,
+            }
+
+
+def _products(catalog, ids, limit):
+    products, seen = [], set()
+    for product_id in ids:
+        product = catalog.products_by_id.get(product_id)
+        if product is None or product_id in seen or product.get('sold_out'):
+            continue
+        seen.add(product_id)
+        products.append(product)
+        if len(products) == limit:
+            break
+    return products
+
+
+recommender = Recommender()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the product sales and co-purchase counters.")
+    parser.add_argument('command', choices=['rebuild'])
+    parser.add_argument('--database', default=DATABASE_FILE)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    try:
+        rebuild(conn)
+        print("product_daily_sales and product_pairs rebuilt from orders.")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import argparse
+import sqlite3
+
+import archive
+from db_pool import DATABASE_FILE
+
+# ==============================================================================
+# --- Daily Revenue Rollup ---
+# ==============================================================================
+#
+# shop_daily_stats keeps one row per (shop, day, status) with the number of
+# orders and their revenue. It is updated in the same transaction as the
+# order write that changes it, so dashboards read a handful of rows instead
+# of aggregating the orders table. `day` is DATE(order_date), i.e. UTC like
+# the rest of the schema.
+
+REVENUE_TOLERANCE = 0.005
+
+_UPSERT = '''
+    INSERT INTO shop_daily_stats (shop_id, day, status, order_count, revenue) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (shop_id, day, status) DO UPDATE SET
+        order_count = order_count + excluded.order_count,
+        revenue = revenue + excluded.revenue
+'''
+
+
+def record_orders(conn, order_ids):
+    """Adds newly inserted orders to the rollup. Call inside the inserting transaction."""
+    for start in range(0, len(order_ids), 500):
+        chunk = order_ids[start:start + 500]
+        rows = conn.execute(f'''
+            SELECT shop_id, DATE(order_date) as day, status, COUNT(*) as order_count, SUM(total_price) as revenue
+            FROM orders WHERE id IN ({','.join('?'*len(chunk))})
+            GROUP BY shop_id, DATE(order_date), status
+        ''', tuple(chunk)).fetchall()
+        conn.executemany(_UPSERT, [tuple(row) for row in rows])
+
+
+def move_order(conn, shop_id, day, old_status, new_status, total_price, count=1):
+    """Moves `count` orders worth `total_price` between status buckets. Call inside the updating transaction."""
+    if old_status == new_status:
+        return
+    conn.execute(_UPSERT, (shop_id, day, old_status, -count, -total_price))
+    conn.execute(_UPSERT, (shop_id, day, new_status, count, total_price))
+    conn.execute('DELETE FROM shop_daily_stats WHERE shop_id = ? AND day = ? AND status = ? AND order_count = 0',
+                 (shop_id, day, old_status))
+
+
+def rebuild(conn, shop_id=None):
+    """Recomputes the rollup from the live and archived orders (all shops, or one)."""
+    where, params = ('AND shop_id = ?', (shop_id,)) if shop_id is not None else ('', ())
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute(f'DELETE FROM shop_daily_stats WHERE 1 {where}', params)
+        for orders_table, _ in archive.order_tables(conn):
+            conn.execute(f'''
+                INSERT INTO shop_daily_stats (shop_id, day, status, order_count, revenue)
+                SELECT shop_id, DATE(order_date), status, COUNT(*), SUM(total_price)
+                FROM {orders_table} WHERE 1 {where}
+                GROUP BY shop_id, DATE(order_date), status
+                ON CONFLICT (shop_id, day, status) DO UPDATE SET
+                    order_count = order_count + excluded.order_count,
+                    revenue = revenue + excluded.revenue
+            ''', params)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+
+def check(conn):
+    """Compares the rollup with the live and archived orders. Returns a list of mismatch descriptions."""
+    expected = {}
+    for orders_table, _ in archive.order_tables(conn):
+        for row in conn.execute(f'''
+            SELECT shop_id, DATE(order_date), status, COUNT(*), SUM(total_price)
+            FROM {orders_table} GROUP BY shop_id, DATE(order_date), status
+        '''):
+            count, revenue = expected.get((row[0], row[1], row[2]), (0, 0.0))
+            expected[(row[0], row[1], row[2])] = (count + row[3], revenue + (row[4] or 0.0))
+    actual = {
+        (row[0], row[1], row[2]): (row[3], row[4])
+        for row in conn.execute('SELECT shop_id, day, status, order_count, revenue FROM shop_daily_stats WHERE order_count != 0')
+    }
+    mismatches = []
+    for key in sorted(expected.keys() | actual.keys(), key=str):
+        want = expected.get(key, (0, 0.0))
+        got = actual.get(key, (0, 0.0))
+        if want[0] != got[0] or abs((want[1] or 0.0) - (got[1] or 0.0)) > REVENUE_TOLERANCE:
+            shop_id, day, status = key
+            mismatches.append(f"shop {shop_id} {day} {status}: orders table has {want[0]} orders / {want[1] or 0.0:.2f}, "
+                              f"rollup has {got[0]} / {got[1] or 0.0:.2f}")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild or verify the shop_daily_stats rollup.")
+    parser.add_argument('command', choices=['rebuild', 'check'])
+    parser.add_argument('--database', default=DATABASE_FILE)
+    parser.add_argument('--shop', type=int, default=None, help="Only rebuild this shop.")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    try:
+        if args.command == 'rebuild':
+            rebuild(conn, args.shop)
+            print("shop_daily_stats rebuilt from orders.")
+        else:
+            mismatches = check(conn)
+            for line in mismatches:
+                print(line)
+            print(f"{len(mismatches)} mismatches found." if mismatches else "Rollup is consistent with orders.")
+            raise SystemExit(1 if mismatches else 0)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Live-path request times as total order history grows, with and without archiving.
+
+For each --scales multiplier a database is generated with the same number of
+orders per day over --days x multiplier days, so the recent (unarchivable)
+orders stay the same while the total history grows. Each database is timed
+twice: with every order still in the live tables, then after
+`archive.py run` has moved closed orders older than
+CANTEEN_ARCHIVE_AFTER_DAYS into the monthly archive tables. The live-path
+requests are the owner's live queue, the first history page, the dashboard
+and placing an order. A history page from an archived month shows the cost
+of reading the archive.
+
+    python scripts/bench_archive.py --scales 1,10,100 --days 120 --orders-per-day 45
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from loadgen import ROOT, HTTPConnection, free_port, login, owner_login, percentile, start_server, stop_server
+
+# The app would otherwise archive on its own schedule during the "live tables" runs.
+SERVER_ENV = {'CANTEEN_ARCHIVE': '0'}
+
+
+def requests_for(user_id):
+    old = (date.today() - timedelta(days=200)).isoformat()
+    older = (date.today() - timedelta(days=199)).isoformat()
+    order = {'user_id': user_id, 'shop_id': 1, 'total_price': 0, 'items': [{'id': 1, 'quantity': 1}]}
+    # (label, method, path, body, who makes the request)
+    return [
+        ('GET /orders/shop/1/live', 'GET', '/orders/shop/1/live', None, 'owner'),
+        ('GET /orders/shop/1/history', 'GET', '/orders/shop/1/history?limit=20', None, 'owner'),
+        ('GET /dashboard/shop/1', 'GET', '/dashboard/shop/1', None, 'owner'),
+        ('POST /orders', 'POST', '/orders', order, 'student'),
+        ('history, 200 days ago', 'GET', f'/orders/shop/1/history?since={old}&until={older}&limit=20', None, 'owner'),
+    ]
+
+
+async def time_requests(port, auths, requests, count):
+    conn = HTTPConnection(port)
+    results = {}
+    try:
+        for label, method, path, body, role in requests:
+            auth = auths[role]
+            for _ in range(5):
+                await conn.request(method, path, body=body, headers=auth)
+            latencies = []
+            for _ in range(count):
+                started = time.perf_counter()
+                status, _, _ = await conn.request(method, path, body=body, headers=auth)
+                latencies.append((time.perf_counter() - started) * 1000)
+                if status >= 400:
+                    raise RuntimeError(f"{label} returned {status}")
+            latencies.sort()
+            results[label] = (percentile(latencies, 0.5), percentile(latencies, 0.95))
+    finally:
+        conn.close()
+    return results
+
+
+def measure(database, count):
+    conn = sqlite3.connect(database)
+    user_id = conn.execute("SELECT id FROM users WHERE email = 'student@example.com'").fetchone()[0]
+    live_orders = conn.execute('SELECT COUNT(*) FROM orders').fetchone()[0]
+    conn.close()
+    port = free_port()
+    server = start_server(database, port, env=SERVER_ENV)
+    try:
+        auths = {'student': login(port), 'owner': owner_login(port)}
+        return live_orders, asyncio.run(time_requests(port, auths, requests_for(user_id), count))
+    finally:
+        stop_server(server)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', default='1,10,100')
+    parser.add_argument('--days', type=int, default=120, help="Days of history at scale 1.")
+    parser.add_argument('--orders-per-day', type=int, default=45)
+    parser.add_argument('--requests', type=int, default=200, help="Timed requests per endpoint.")
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in (int(value) for value in args.scales.split(',')):
+            database = os.path.join(tmp, f'archive-{scale}.db')
+            subprocess.run([sys.executable, os.path.join(ROOT, 'scripts', 'generate_data.py'), '--database', database, '--shops', '5',
+                            '--users', '500', '--days', str(args.days * scale), '--orders-per-day', str(args.orders_per_day)],
+                           check=True, stdout=subprocess.DEVNULL, env=dict(os.environ, CANTEEN_DATABASE_FILE=database))
+            total = sqlite3.connect(database).execute('SELECT COUNT(*) FROM orders').fetchone()[0]
+            # Timed on a copy: the orders placed while timing would otherwise show up in the second run.
+            unarchived = os.path.join(tmp, f'archive-{scale}-live.db')
+            shutil.copy(database, unarchived)
+            rows.append((scale, total, 'live tables', *measure(unarchived, args.requests)))
+            os.remove(unarchived)
+            subprocess.run([sys.executable, os.path.join(ROOT, 'archive.py'), 'run', '--database', database, '--pause', '0'],
+                           check=True, stdout=subprocess.DEVNULL, env=dict(os.environ, CANTEEN_DATABASE_FILE=database))
+            rows.append((scale, total, 'archived', *measure(database, args.requests)))
+            os.remove(database)
+
+    labels = list(rows[0][4])
+    print(f"{'scale':>6}{'orders':>9}  {'layout':<12}{'live rows':>10}  " + ''.join(f"{label[:24]:>26}" for label in labels))
+    print(' ' * 39 + ''.join(f"{'p50 / p95 ms':>26}" for _ in labels))
+    for scale, total, layout, live_orders, results in rows:
+        cells = ''.join(f"{f'{results[label][0]:.2f} / {results[label][1]:.2f}':>26}" for label in labels)
+        print(f"{scale:>5}x{total:>9}  {layout:<12}{live_orders:>10}  {cells}")
+
+
+if __name__ == '__main__':
+    main()
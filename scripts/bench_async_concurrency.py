@@ -0,0 +1,85 @@
+"""Throughput and tail latency under many concurrent clients.
+
+Starts uvicorn and runs N keep-alive clients that loop over the given paths
+for a fixed duration. With --compare-ref, the same load is also run against
+the tree at that git revision (exported with `git archive`) so the async
+data-access layer can be compared with the previous sync handlers.
+
+    python scripts/bench_async_concurrency.py --clients 1000 --duration 10 --compare-ref HEAD~1
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import tempfile
+import time
+
+from loadgen import (ROOT, HTTPConnection, free_port, login, percentile, prepare_database,
+                     raise_fd_limit, start_server, stop_server)
+
+
+async def client(port, paths, deadline, results, errors, auth):
+    conn = HTTPConnection(port)
+    i = 0
+    try:
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                status, _, _ = await conn.request('GET', path, headers=auth)
+            except (ConnectionError, OSError, asyncio.IncompleteReadError):
+                errors.append(path)
+                conn.close()
+                continue
+            if status != 200:
+                errors.append(path)
+            results.setdefault(path, []).append((time.perf_counter() - started) * 1000)
+    finally:
+        conn.close()
+
+
+async def drive(port, clients, duration, paths, auth):
+    results, errors = {}, []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(client(port, paths, deadline, results, errors, auth) for _ in range(clients)))
+    return results, errors
+
+
+def run_target(label, root, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'bench.db')
+        prepare_database(database, root)
+        port = free_port()
+        server = start_server(database, port, root=root)
+        try:
+            results, errors = asyncio.run(drive(port, args.clients, args.duration, args.paths, login(port)))
+        finally:
+            stop_server(server)
+    print(f"\n{label}: {args.clients} clients, {args.duration}s, errors={len(errors)}")
+    print(f"{'path':<28}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for path in args.paths:
+        latencies = sorted(results.get(path, []))
+        print(f"{path:<28}{len(latencies) / args.duration:>10.0f}"
+              f"{percentile(latencies, 0.5):>10.1f}{percentile(latencies, 0.99):>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--paths', nargs='+', default=['/products', '/orders/user/1'])
+    parser.add_argument('--compare-ref', help='git revision to benchmark as the "before" tree')
+    args = parser.parse_args()
+    raise_fd_limit()
+
+    if args.compare_ref:
+        with tempfile.TemporaryDirectory() as before:
+            archive = subprocess.run(['git', 'archive', args.compare_ref], cwd=ROOT, check=True, capture_output=True)
+            subprocess.run(['tar', '-x', '-C', before], input=archive.stdout, check=True)
+            run_target(f"before ({args.compare_ref})", before, args)
+    run_target("after (working tree)", ROOT, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Per-request cost of session authentication.
+
+Times the pieces of the `current_session` dependency in-process: checking a
+token's signature, the in-memory session lookup, the whole dependency on the
+fast path, and the whole dependency when the session has to be reloaded from
+the database (cache miss).
+
+    python scripts/bench_auth.py --iterations 100000
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+
+from loadgen import prepare_database
+
+
+def per_call_us(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+async def per_call_us_async(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'auth.db')
+        prepare_database(database)
+        os.environ['CANTEEN_DATABASE_FILE'] = database
+
+        from starlette.requests import Request
+        import main as app_module
+        import sessions
+
+        conn = sqlite3.connect(database)
+        conn.row_factory = sqlite3.Row
+        user = conn.execute("SELECT id, role, shop_id FROM users WHERE email = 'student@example.com'").fetchone()
+        conn.close()
+        token, session = sessions.store.issue(user)
+        request = Request({'type': 'http', 'headers': [(b'authorization', f'Bearer {token}'.encode())]})
+
+        def evict_and_resolve():
+            sessions.store._sessions.pop(session.session_id, None)
+            return app_module.current_session(request)
+
+        async def run():
+            fast = await per_call_us_async(lambda: app_module.current_session(request), args.iterations)
+            slow = await per_call_us_async(evict_and_resolve, max(1, args.iterations // 50))
+            return fast, slow
+
+        rows = [
+            ('verify token signature', per_call_us(lambda: sessions.decode_token(token), args.iterations)),
+            ('session cache lookup', per_call_us(lambda: sessions.store.lookup(token), args.iterations)),
+        ]
+        fast, slow = asyncio.run(run())
+        rows += [('dependency, cached session', fast), ('dependency, reload from DB', slow)]
+        app_module.database.shutdown()
+        app_module.pool.close_all()
+
+    print(f"{'step':<30}{'us/request':>12}")
+    for label, cost in rows:
+        print(f"{label:<30}{cost:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Requests/sec for the catalog endpoints with and without the in-memory cache.
+
+Seeds a throwaway database with a larger menu and drives /products (plain,
+filtered and conditional) in-process through TestClient.
+
+    python scripts/bench_catalog_cache.py --products 2000 --requests 2000
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def seed(database, n_products):
+    import db3
+    import migrations
+    conn = sqlite3.connect(database)
+    db3.create_tables(conn)
+    migrations.migrate(conn)
+    db3.seed_data(conn)
+    conn.executemany(
+        'INSERT INTO products (name, price, description, image_url, category_id, shop_id) VALUES (?, ?, ?, ?, ?, ?)',
+        [(f'Item {i}', 1 + i % 20, 'Generated item.', '/images/cake.jpg', 1 + i % 6, 1 + i % 3) for i in range(n_products)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def measure(client, path, requests, headers=None):
+    started = time.perf_counter()
+    for _ in range(requests):
+        client.get(path, headers=headers)
+    return requests / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'catalog.db')
+        os.environ['CANTEEN_DATABASE_FILE'] = database
+        sys.path.insert(0, ROOT)
+        os.chdir(ROOT)
+        seed(database, args.products)
+
+        from fastapi.testclient import TestClient
+        import main as app_module
+
+        results = {}
+        with TestClient(app_module.app) as client:
+            for enabled in (False, True):
+                app_module.catalog.enabled = enabled
+                app_module.catalog.clear()
+                etag = client.get('/products').headers['etag']
+                results[enabled] = {
+                    '/products': measure(client, '/products', args.requests),
+                    '/products?shop_id=2&category_id=2': measure(client, '/products?shop_id=2&category_id=2', args.requests),
+                    '/products (304)': measure(client, '/products', args.requests, {'If-None-Match': etag}),
+                }
+            stats = app_module.catalog.stats()
+
+    print(f"{args.products + 9} products, {args.requests} requests per row")
+    print(f"{'endpoint':<36}{'no cache req/s':>16}{'cache req/s':>14}")
+    for path in results[True]:
+        print(f"{path:<36}{results[False][path]:>16.0f}{results[True][path]:>14.0f}")
+    print(f"cache: hits={stats['hits']} misses={stats['misses']}")
+
+
+if __name__ == '__main__':
+    main()
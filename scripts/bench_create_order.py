@@ -0,0 +1,112 @@
+"""Orders/sec for the previous per-line create_order against the batched pipeline.
+
+The legacy path is reproduced inline: one price SELECT per cart line inside
+the write transaction. The batched path is orders.price_orders() plus
+orders.insert_orders(). Both run on pooled WAL connections from several
+threads at once. The report shows that throughput, and how long each order
+holds SQLite's write lock (measured on a single uncontended thread), which is
+what concurrent checkouts queue behind.
+
+    python scripts/bench_create_order.py --orders 2000 --threads 8
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+from loadgen import prepare_database
+
+import orders
+from db_pool import ConnectionPool
+
+
+def legacy_create_order(conn, order):
+    cursor = conn.cursor()
+    locked = time.perf_counter()
+    cursor.execute(
+        'INSERT INTO orders (user_id, shop_id, total_price, status) VALUES (?, ?, ?, ?)',
+        (order.user_id, order.shop_id, 0.0, 'Pending')
+    )
+    order_id = cursor.lastrowid
+    items_data = []
+    for item in order.items:
+        product_price = cursor.execute('SELECT price FROM products WHERE id = ?', (item.id,)).fetchone()['price']
+        items_data.append((order_id, item.id, item.quantity, product_price))
+    cursor.executemany(
+        'INSERT INTO order_items (order_id, product_id, quantity, price_per_item) VALUES (?, ?, ?, ?)',
+        items_data
+    )
+    conn.commit()
+    return time.perf_counter() - locked
+
+
+def batched_create_order(conn, order):
+    priced = orders.price_orders(conn, [order])
+    locked = time.perf_counter()
+    orders.insert_orders(conn, priced)
+    return time.perf_counter() - locked
+
+
+def run(pool, create, order, total, threads):
+    held = []
+    lock = threading.Lock()
+
+    def worker(count):
+        local = 0.0
+        with pool.connection() as conn:
+            for _ in range(count):
+                local += create(conn, order)
+        with lock:
+            held.append(local)
+
+    workers = [threading.Thread(target=worker, args=(total // threads,)) for _ in range(threads)]
+    started = time.perf_counter()
+    for t in workers: t.start()
+    for t in workers: t.join()
+    elapsed = time.perf_counter() - started
+    done = (total // threads) * threads
+    return done / elapsed, sum(held) / done * 1e6
+
+
+def make_order(cart_size, product_ids):
+    items = [SimpleNamespace(id=product_ids[i % len(product_ids)], quantity=1 + i % 3) for i in range(cart_size)]
+    return SimpleNamespace(user_id=1, shop_id=1, items=items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=2000, help='orders per measurement')
+    parser.add_argument('--cart-sizes', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'orders.db')
+        prepare_database(database)
+        seed = sqlite3.connect(database)
+        seed.executemany(
+            'INSERT INTO products (name, price, description, image_url, category_id, shop_id) VALUES (?, ?, ?, ?, ?, ?)',
+            [(f'Item {i}', 1 + i % 20, '', '', 1, 1) for i in range(200)],
+        )
+        seed.commit()
+        product_ids = [row[0] for row in seed.execute('SELECT id FROM products WHERE shop_id = 1')]
+        seed.close()
+
+        pool = ConnectionPool(database=database, max_size=args.threads)
+        print(f"{args.threads} threads, {args.orders} orders per measurement")
+        print(f"{'cart size':>10}{'legacy orders/s':>18}{'lock held us':>14}{'batched orders/s':>18}{'lock held us':>14}")
+        for cart_size in args.cart_sizes:
+            order = make_order(cart_size, product_ids)
+            legacy_rate, _ = run(pool, legacy_create_order, order, args.orders, args.threads)
+            _, legacy_held = run(pool, legacy_create_order, order, args.orders // 4, 1)
+            batched_rate, _ = run(pool, batched_create_order, order, args.orders, args.threads)
+            _, batched_held = run(pool, batched_create_order, order, args.orders // 4, 1)
+            print(f"{cart_size:>10}{legacy_rate:>18.0f}{legacy_held:>14.0f}{batched_rate:>18.0f}{batched_held:>14.0f}")
+        pool.close_all()
+
+
+if __name__ == '__main__':
+    main()
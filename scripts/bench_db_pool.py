@@ -0,0 +1,107 @@
+"""Compares per-request sqlite3.connect() against the pooled WAL connections.
+
+Runs a lunch-rush style mix (mostly order-summary reads, some order inserts)
+from several threads against two fresh copies of the seeded database and
+prints p50/p99 latency for each mode.
+
+    python scripts/bench_db_pool.py --threads 16 --requests 400
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import db3
+from db_pool import ConnectionPool
+
+READ_SQL = ("SELECT o.id as order_id, o.total_price, o.status, o.order_date, u.first_name, u.last_name "
+            "FROM orders o JOIN users u ON o.user_id = u.id WHERE o.shop_id = ? ORDER BY o.order_date DESC")
+WRITE_SQL = 'INSERT INTO orders (user_id, shop_id, total_price, status) VALUES (?, ?, ?, ?)'
+
+
+def make_database(path):
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = DELETE')
+    db3.create_tables(conn)
+    db3.seed_data(conn)
+    conn.close()
+
+
+def unit_of_work(conn, i, write_ratio):
+    if i % write_ratio == 0:
+        conn.execute(WRITE_SQL, (1, 1 + i % 3, 5.5, 'Pending'))
+        conn.commit()
+    else:
+        conn.execute(READ_SQL, (1 + i % 3,)).fetchall()
+
+
+def run(open_conn, close_conn, threads, requests, write_ratio):
+    latencies = []
+    lock = threading.Lock()
+    errors = []
+
+    def worker(offset):
+        local = []
+        for i in range(offset, offset + requests):
+            started = time.perf_counter()
+            try:
+                conn = open_conn()
+                try:
+                    unit_of_work(conn, i, write_ratio)
+                finally:
+                    close_conn(conn)
+            except sqlite3.OperationalError as e:
+                errors.append(str(e))
+            local.append((time.perf_counter() - started) * 1000)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(n * requests,)) for n in range(threads)]
+    started = time.perf_counter()
+    for t in workers: t.start()
+    for t in workers: t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+    return {'p50': pick(0.50), 'p99': pick(0.99), 'rps': len(latencies) / elapsed, 'errors': len(errors)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=400, help='requests per thread')
+    parser.add_argument('--write-ratio', type=int, default=5, help='one write every N requests')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline_db = os.path.join(tmp, 'baseline.db')
+        pooled_db = os.path.join(tmp, 'pooled.db')
+        make_database(baseline_db)
+        make_database(pooled_db)
+
+        def connect_per_request():
+            conn = sqlite3.connect(baseline_db)
+            conn.row_factory = sqlite3.Row
+            return conn
+
+        baseline = run(connect_per_request, lambda c: c.close(), args.threads, args.requests, args.write_ratio)
+
+        pool = ConnectionPool(database=pooled_db, max_size=args.threads)
+        pooled = run(pool.acquire, pool.release, args.threads, args.requests, args.write_ratio)
+        stats = pool.stats()
+        pool.close_all()
+
+    print(f"{'mode':<20}{'p50 ms':>10}{'p99 ms':>10}{'req/s':>10}{'errors':>8}")
+    for name, result in (('connect-per-request', baseline), ('pooled WAL', pooled)):
+        print(f"{name:<20}{result['p50']:>10.3f}{result['p99']:>10.3f}{result['rps']:>10.0f}{result['errors']:>8}")
+    print(f"pool: created={stats['created']} reused={stats['reused']} waited={stats['waited']}")
+
+
+if __name__ == '__main__':
+    main()
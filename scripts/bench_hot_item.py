@@ -0,0 +1,98 @@
+"""Checkout throughput when every client orders the same product, with and without stock tracking.
+
+--clients keep-alive connections order product 1 back to back for --duration
+seconds against a fresh server in each mode:
+
+  untracked           product 1 has no stock count (the plain checkout path)
+  tracked             a stock count too large to run out: the cost of the
+                      conditional UPDATE on one hot row
+  sell-out            --stock units, then a stampede for an item that is gone,
+                      once answered by the stock reservations in memory and
+                      once by the database (CANTEEN_STOCK_RESERVATIONS=0)
+
+Reports placed and refused checkouts per second and p50/p99 latency.
+
+    python scripts/bench_hot_item.py --clients 100 --duration 10 --stock 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from collections import Counter
+
+from loadgen import HTTPConnection, free_port, login, percentile, prepare_database, raise_fd_limit, start_server, stop_server
+
+BASE_ENV = {'CANTEEN_SESSION_SECRET': 'bench-hot-item', 'CANTEEN_ARCHIVE': '0'}
+
+
+def modes(stock):
+    return [
+        ('untracked', None, {}),
+        ('tracked', 10 ** 9, {}),
+        ('sell-out, reservations', stock, {'CANTEEN_STOCK_RESERVATIONS': '1'}),
+        ('sell-out, database only', stock, {'CANTEEN_STOCK_RESERVATIONS': '0'}),
+    ]
+
+
+async def hot_item_load(port, auth, clients, duration):
+    body = {'user_id': 1, 'shop_id': 1, 'items': [{'id': 1, 'quantity': 1}]}
+    deadline = time.perf_counter() + duration
+    latencies, statuses = [], Counter()
+
+    async def client():
+        conn = HTTPConnection(port)
+        try:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                status, _, data = await conn.request('POST', '/orders', body=body, headers=auth)
+                latencies.append((time.perf_counter() - started) * 1000)
+                statuses[status] += 1
+        finally:
+            conn.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return statuses[201] / elapsed, statuses[409] / elapsed, percentile(latencies, 0.5), percentile(latencies, 0.99), statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--stock', type=int, default=200, help="Units on sale in the sell-out runs.")
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+    raise_fd_limit()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n, (label, stock, env) in enumerate(modes(args.stock)):
+            database = os.path.join(tmp, f'hot-item-{n}.db')
+            prepare_database(database)
+            conn = sqlite3.connect(database)
+            conn.execute("UPDATE products SET stock = ?, stock_date = DATE('now') WHERE id = 1", (stock,))
+            conn.commit()
+            conn.close()
+            port = free_port()
+            server = start_server(database, port, workers=args.workers, env={**BASE_ENV, **env})
+            try:
+                auth = login(port)
+                rows.append((label, *asyncio.run(hot_item_load(port, auth, args.clients, args.duration))))
+            finally:
+                stop_server(server)
+            os.remove(database)
+
+    print(f"{args.clients} clients, {args.workers} worker(s), {args.duration:.0f}s per run")
+    print(f"{'mode':<26}{'placed/s':>10}{'refused/s':>11}{'p50 ms':>9}{'p99 ms':>9}  other")
+    for label, placed, refused, p50, p99, statuses in rows:
+        other = {status: count for status, count in statuses.items() if status not in (201, 409)}
+        print(f"{label:<26}{placed:>10.0f}{refused:>11.0f}{p50:>9.1f}{p99:>9.1f}  {json.dumps(other) if other else '-'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Cost of the kitchen queue bookkeeping per order event as order history grows.
+
+Seeds a database, then for each history size pads the orders table with that
+many completed orders and times --events rounds of: insert one order through
+orders.insert_orders (which queues it and estimates its ready time), mark it
+Ready and mark it Completed, each in its own transaction like the endpoints.
+The per-event time should stay flat from the smallest to the largest history.
+
+    python scripts/bench_kitchen.py --history 0,100000,500000 --events 2000
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+from types import SimpleNamespace
+
+from loadgen import prepare_database
+
+import order_status
+import orders
+
+
+def pad_history(conn, count):
+    if count <= 0:
+        return
+    conn.execute('BEGIN')
+    conn.execute('''
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+        INSERT INTO orders (user_id, shop_id, total_price, status, order_date)
+        SELECT 1, 1, 5.5, 'Completed', datetime('now', '-' || (i % 365) || ' days') FROM n
+    ''', (count,))
+    conn.execute('''
+        INSERT INTO order_items (order_id, product_id, quantity, price_per_item)
+        SELECT id, 1, 1, 5.5 FROM orders WHERE id NOT IN (SELECT order_id FROM order_items)
+    ''')
+    conn.commit()
+
+
+def set_status(conn, order_id, status):
+    order_status.transition_orders(conn, [(order_id, status, None)])
+
+
+def measure(conn, events):
+    order = SimpleNamespace(user_id=1, shop_id=1, items=[SimpleNamespace(id=1, quantity=1), SimpleNamespace(id=2, quantity=2)])
+    timings = {'create': 0.0, 'ready': 0.0, 'complete': 0.0}
+    for _ in range(events):
+        started = time.perf_counter()
+        order_id, = orders.insert_orders(conn, orders.price_orders(conn, [order]))
+        created = time.perf_counter()
+        set_status(conn, order_id, 'Ready')
+        ready = time.perf_counter()
+        set_status(conn, order_id, 'Completed')
+        timings['create'] += created - started
+        timings['ready'] += ready - created
+        timings['complete'] += time.perf_counter() - ready
+    return {name: total / events * 1e6 for name, total in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--history', default='0,100000,500000', help="Comma-separated order history sizes.")
+    parser.add_argument('--events', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'kitchen.db')
+        prepare_database(database)
+        conn = sqlite3.connect(database, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+
+        print(f"{'history':>10}{'create us':>12}{'ready us':>12}{'complete us':>13}")
+        padded = 0
+        for size in sorted(int(value) for value in args.history.split(',')):
+            pad_history(conn, size - padded)
+            padded = size
+            result = measure(conn, args.events)
+            print(f"{size:>10}{result['create']:>12.0f}{result['ready']:>12.0f}{result['complete']:>13.0f}")
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Logins/sec at different password hashing cost settings.
+
+Each setting starts a fresh server with that KDF configuration and runs
+concurrent clients logging in as the seeded student. The first login upgrades
+the stored hash to the configured cost, so the rest measure a steady state.
+A separate client polls /shops throughout to show how much the hashing load
+slows ordinary requests.
+
+    python scripts/bench_login.py --settings scrypt:16384 scrypt:65536 pbkdf2_sha256:600000
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from loadgen import (HTTPConnection, free_port, percentile, prepare_database,
+                     raise_fd_limit, start_server, stop_server)
+
+CREDENTIALS = {'email': 'student@example.com', 'password': 'student123'}
+COST_SETTINGS = {'scrypt': 'CANTEEN_SCRYPT_N', 'pbkdf2_sha256': 'CANTEEN_PBKDF2_ITERATIONS'}
+
+
+async def login_client(port, deadline, latencies, failures):
+    conn = HTTPConnection(port)
+    try:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            status, _, _ = await conn.request('POST', '/login', CREDENTIALS)
+            if status != 200:
+                failures.append(status)
+            latencies.append((time.perf_counter() - started) * 1000)
+    finally:
+        conn.close()
+
+
+async def shops_client(port, deadline, latencies):
+    conn = HTTPConnection(port)
+    try:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            await conn.request('GET', '/shops')
+            latencies.append((time.perf_counter() - started) * 1000)
+            await asyncio.sleep(0.01)
+    finally:
+        conn.close()
+
+
+async def drive(port, clients, duration):
+    warmup = HTTPConnection(port)
+    await warmup.request('POST', '/login', CREDENTIALS)
+    warmup.close()
+
+    logins, failures, shops = [], [], []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(
+        *(login_client(port, deadline, logins, failures) for _ in range(clients)),
+        shops_client(port, deadline, shops),
+    )
+    return logins, failures, shops
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--settings', nargs='+', default=['scrypt:4096', 'scrypt:16384', 'scrypt:65536', 'pbkdf2_sha256:100000', 'pbkdf2_sha256:600000'],
+                        help='algorithm:cost pairs (scrypt N or PBKDF2 iterations)')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--hash-workers', type=int, default=None, help='CANTEEN_HASH_WORKERS for the server')
+    args = parser.parse_args()
+    raise_fd_limit()
+
+    print(f"{args.clients} login clients, {args.duration}s per setting")
+    print(f"{'setting':<24}{'logins/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}{'/shops p99 ms':>15}")
+    for setting in args.settings:
+        algorithm, cost = setting.split(':')
+        env = {
+            'CANTEEN_PASSWORD_HASHER': algorithm,
+            COST_SETTINGS[algorithm]: cost,
+        }
+        if args.hash_workers:
+            env['CANTEEN_HASH_WORKERS'] = str(args.hash_workers)
+        with tempfile.TemporaryDirectory() as tmp:
+            database = os.path.join(tmp, 'login.db')
+            prepare_database(database)
+            port = free_port()
+            server = start_server(database, port, env=env)
+            try:
+                logins, failures, shops = asyncio.run(drive(port, args.clients, args.duration))
+            finally:
+                stop_server(server)
+        logins.sort()
+        shops.sort()
+        print(f"{setting:<24}{len(logins) / args.duration:>10.1f}{percentile(logins, 0.5):>10.1f}"
+              f"{percentile(logins, 0.99):>10.1f}{len(failures):>8}{percentile(shops, 0.99):>15.1f}")
+
+
+if __name__ == '__main__':
+    main()
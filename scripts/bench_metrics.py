@@ -0,0 +1,117 @@
+"""Overhead of the request and SQL statement instrumentation.
+
+First times single statements in-process on a plain sqlite3 connection and
+on metrics.InstrumentedConnection. Then runs the server three times on the
+same seeded database, with CANTEEN_METRICS=0, with metrics on, and with
+metrics on and every request asking for a profile. Each run hammers a few
+read endpoints with --concurrency keep-alive connections. The runs are
+interleaved for --rounds rounds and the best round of each is reported, which
+keeps machine noise from swamping a difference of a few percent.
+
+    python scripts/bench_metrics.py --duration 10 --concurrency 16 --rounds 3
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+
+from loadgen import HTTPConnection, free_port, owner_login, percentile, prepare_database, start_server, stop_server
+
+import metrics
+
+PATHS = ['/products/1', '/orders/shop/1/live', '/dashboard/shop/1', '/shops']
+RUNS = [
+    ('metrics off', {'CANTEEN_METRICS': '0'}, {}),
+    ('metrics on', {'CANTEEN_METRICS': '1'}, {}),
+    ('metrics on + profile header', {'CANTEEN_METRICS': '1'}, {'X-Canteen-Profile': '1'}),
+]
+
+
+def statement_costs(database, iterations, rounds):
+    """Best-of-`rounds` us per statement on a plain and an instrumented connection."""
+    cases = [
+        ('point select + fetchone', lambda c: c.execute('SELECT * FROM products WHERE id = ?', (1,)).fetchone()),
+        ('select 200 rows, fetchall', lambda c: c.execute('SELECT * FROM products, categories LIMIT 200').fetchall()),
+        ('select 200 rows, iterate', lambda c: [row for row in c.execute('SELECT * FROM products, categories LIMIT 200')]),
+    ]
+    results = []
+    for label, case in cases:
+        costs = [float('inf'), float('inf')]
+        for _ in range(rounds):
+            for n, factory in enumerate((sqlite3.Connection, metrics.InstrumentedConnection)):
+                conn = sqlite3.connect(database, factory=factory)
+                conn.row_factory = sqlite3.Row
+                case(conn)
+                started = time.perf_counter()
+                for _ in range(iterations):
+                    case(conn)
+                costs[n] = min(costs[n], (time.perf_counter() - started) / iterations * 1e6)
+                conn.close()
+        results.append((label, *costs))
+    return results
+
+
+async def hammer(port, duration, concurrency, headers):
+    latencies = []
+    deadline = time.perf_counter() + duration
+
+    async def client(offset):
+        conn = HTTPConnection(port)
+        i = offset
+        try:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                await conn.request('GET', PATHS[i % len(PATHS)], headers=headers)
+                latencies.append((time.perf_counter() - started) * 1000)
+                i += 1
+        finally:
+            conn.close()
+
+    await asyncio.gather(*(client(n) for n in range(concurrency)))
+    return sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'metrics.db')
+        prepare_database(database)
+
+        print(f"{'statement':<28}{'plain us':>10}{'timed us':>10}{'overhead':>10}")
+        for label, plain, timed in statement_costs(database, args.iterations, args.rounds):
+            print(f"{label:<28}{plain:>10.2f}{timed:>10.2f}{timed - plain:>+9.2f}us")
+        print()
+
+        best = {}
+        for _ in range(args.rounds):
+            for label, env, headers in RUNS:
+                port = free_port()
+                server = start_server(database, port, env=env)
+                try:
+                    # Two of the paths are owner pages.
+                    auth = {**owner_login(port), **headers}
+                    asyncio.run(hammer(port, 1, args.concurrency, auth))  # warm up
+                    latencies = asyncio.run(hammer(port, args.duration, args.concurrency, auth))
+                finally:
+                    stop_server(server)
+                result = (len(latencies) / args.duration, percentile(latencies, 0.5), percentile(latencies, 0.99))
+                if label not in best or result[0] > best[label][0]:
+                    best[label] = result
+        results = [(label, *best[label]) for label, _, _ in RUNS]
+
+    baseline = results[0][1]
+    print(f"{'run':<30}{'req/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'vs off':>9}")
+    for label, rps, p50, p99 in results:
+        print(f"{label:<30}{rps:>10.0f}{p50:>9.2f}{p99:>9.2f}{rps / baseline - 1:>+9.1%}")
+
+
+if __name__ == '__main__':
+    main()
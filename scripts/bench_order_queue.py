@@ -0,0 +1,91 @@
+"""Sustained POST /orders throughput and latency, one transaction per order vs the group-commit queue.
+
+For each --concurrency level, that many keep-alive clients place orders
+back to back for --duration seconds against a fresh server, once with
+CANTEEN_ORDER_QUEUE=0 (each checkout takes the write lock and commits on its
+own) and once with the order queue (one writer commits micro-batches).
+Reports orders/sec, p50/p99 latency and failed requests, which is where
+"database is locked" shows up once writers queue behind the lock for longer
+than the busy timeout.
+
+    python scripts/bench_order_queue.py --concurrency 10,100,500 --duration 10 --workers 1
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+
+from loadgen import HTTPConnection, free_port, login, percentile, prepare_database, raise_fd_limit, start_server, stop_server
+
+MODES = [('per-order commit', {'CANTEEN_ORDER_QUEUE': '0'}), ('group commit', {'CANTEEN_ORDER_QUEUE': '1'})]
+BASE_ENV = {'CANTEEN_SESSION_SECRET': 'bench-order-queue', 'CANTEEN_ARCHIVE': '0'}
+
+
+async def checkout_load(port, auth, clients, duration):
+    body = {'user_id': 1, 'shop_id': 1, 'items': [{'id': 1, 'quantity': 1}, {'id': 2, 'quantity': 2}]}
+    deadline = time.perf_counter() + duration
+    latencies, errors = [], Counter()
+
+    async def client():
+        conn = HTTPConnection(port)
+        try:
+            await conn.connect()
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    status, _, data = await conn.request('POST', '/orders', body=body, headers=auth)
+                except (ConnectionError, OSError) as e:
+                    errors[type(e).__name__] += 1
+                    conn.close()
+                    continue
+                if status == 201:
+                    latencies.append((time.perf_counter() - started) * 1000)
+                else:
+                    errors[f"{status} {json.loads(data).get('detail', '')[:40]}" if data else str(status)] += 1
+        finally:
+            conn.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return len(latencies) / elapsed, percentile(latencies, 0.5), percentile(latencies, 0.99), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', default='10,100,500')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+    raise_fd_limit()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for clients in (int(value) for value in args.concurrency.split(',')):
+            for label, env in MODES:
+                database = os.path.join(tmp, f'orders-{clients}-{env["CANTEEN_ORDER_QUEUE"]}.db')
+                prepare_database(database)
+                port = free_port()
+                server = start_server(database, port, workers=args.workers, env={**BASE_ENV, **env})
+                try:
+                    auth = login(port)
+                    asyncio.run(checkout_load(port, auth, min(clients, 10), 1))
+                    rows.append((clients, label, *asyncio.run(checkout_load(port, auth, clients, args.duration))))
+                finally:
+                    stop_server(server)
+                os.remove(database)
+
+    print(f"{args.workers} worker(s), {args.duration:.0f}s per run")
+    print(f"{'clients':>8}  {'path':<18}{'orders/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'failed':>8}")
+    for clients, label, rate, p50, p99, errors in rows:
+        print(f"{clients:>8}  {label:<18}{rate:>10.0f}{p50:>9.1f}{p99:>9.1f}{sum(errors.values()):>8}")
+        for error, count in errors.most_common(3):
+            print(f"{'':>28}{count} x {error}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Time to load a large menu: one POST /products per item vs one POST /products/import.
+
+Generates --count products for shop 1 and loads them into a fresh server
+as its owner, four ways: one create_product call per item over a keep-alive
+connection (--clients of them in parallel), one JSON import, one CSV import,
+and the same JSON import again, which updates every product instead of
+inserting it. Reports the wall time, products/sec and how many catalog
+versions each run created (each version makes every worker reload the
+catalog).
+
+    python scripts/bench_product_import.py --count 10000 --clients 4
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import random
+import tempfile
+import time
+
+from loadgen import HTTPConnection, free_port, owner_login, prepare_database, start_server, stop_server
+
+SERVER_ENV = {'CANTEEN_ARCHIVE': '0'}
+
+
+def generate_products(count, seed=1):
+    rng = random.Random(seed)
+    return [{
+        'name': f'Bench Item {n}',
+        'price': round(rng.uniform(1, 20), 2),
+        'description': f'Generated menu item number {n}.',
+        'category_id': rng.randint(1, 6),
+        'shop_id': 1,
+    } for n in range(count)]
+
+
+def to_csv(products):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(products[0]))
+    writer.writeheader()
+    writer.writerows(products)
+    return buffer.getvalue().encode()
+
+
+async def catalog_version(port):
+    conn = HTTPConnection(port)
+    try:
+        _, _, data = await conn.request('GET', '/catalog/cache-stats')
+        return json.loads(data)['version']
+    finally:
+        conn.close()
+
+
+async def per_item(port, products, clients, auth):
+    queue = list(products)
+    failures = 0
+
+    async def client():
+        nonlocal failures
+        conn = HTTPConnection(port)
+        try:
+            while queue:
+                status, _, _ = await conn.request('POST', '/products', body=queue.pop(), headers=auth)
+                failures += status != 201
+        finally:
+            conn.close()
+
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return failures
+
+
+async def bulk(port, body, content_type, auth):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        headers = ''.join(f'{name}: {value}\r\n' for name, value in auth.items())
+        writer.write((f'POST /products/import HTTP/1.1\r\nHost: localhost\r\nContent-Type: {content_type}\r\n{headers}'
+                      f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n').encode() + body)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    status = int(response.split(b' ', 2)[1])
+    result = json.loads(response.split(b'\r\n\r\n', 1)[1])
+    return (0 if status == 200 else 1), result
+
+
+async def run(port, label, products, clients, auth):
+    before = await catalog_version(port)
+    started = time.perf_counter()
+    if label == 'per item':
+        failures, detail = await per_item(port, products, clients, auth), ''
+    else:
+        content_type = 'text/csv' if 'CSV' in label else 'application/json'
+        body = to_csv(products) if content_type == 'text/csv' else json.dumps(products).encode()
+        failures, result = await bulk(port, body, content_type, auth)
+        detail = f"{result.get('inserted', 0)} inserted, {result.get('updated', 0)} updated"
+    elapsed = time.perf_counter() - started
+    return label, elapsed, failures, await catalog_version(port) - before, detail
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--clients', type=int, default=4, help="Parallel connections for the per-item run.")
+    args = parser.parse_args()
+
+    products = generate_products(args.count)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for labels in (['per item'], ['JSON import', 'JSON re-import (updates)'], ['CSV import']):
+            database = os.path.join(tmp, f'import-{len(rows)}.db')
+            prepare_database(database)
+            port = free_port()
+            server = start_server(database, port, env=SERVER_ENV)
+            try:
+                auth = owner_login(port)
+                for label in labels:
+                    rows.append(asyncio.run(run(port, label, products, args.clients, auth)))
+            finally:
+                stop_server(server)
+            os.remove(database)
+
+    print(f"{args.count} products")
+    print(f"{'path':<26}{'seconds':>9}{'products/s':>12}{'versions':>10}{'failed':>8}  result")
+    for label, elapsed, failures, versions, detail in rows:
+        print(f"{label:<26}{elapsed:>9.2f}{args.count / elapsed:>12.0f}{versions:>10}{failures:>8}  {detail}")
+
+
+if __name__ == '__main__':
+    main()
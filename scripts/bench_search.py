@@ -0,0 +1,94 @@
+"""FTS5 product search against a LIKE '%q%' scan on a large generated catalog.
+
+Builds a throwaway database with the app's schema and migrations, inserts
+--products synthetic products (through the FTS sync triggers), then times
+search.search_product_ids() against two LIKE queries for a mix of common,
+rare, prefix and multi-word queries, with and without a shop filter. The
+first LIKE query stops at the first K matches in table order. The second
+ranks name matches first, like the search does, so it must read every match.
+
+    python scripts/bench_search.py --products 100000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from loadgen import prepare_database
+
+import search
+
+ADJECTIVES = ['spicy', 'crispy', 'masala', 'grilled', 'steamed', 'creamy', 'smoky', 'tangy', 'sweet', 'classic',
+              'paneer', 'garlic', 'butter', 'herbed', 'loaded', 'mini', 'jumbo', 'iced', 'hot', 'roasted']
+DISHES = ['dosa', 'idli', 'vada', 'roll', 'wrap', 'sandwich', 'burger', 'noodles', 'fried rice', 'momos',
+          'biryani', 'thali', 'coffee', 'tea', 'shake', 'brownie', 'cake', 'salad', 'pasta', 'pizza']
+FILLER = ['served', 'with', 'fresh', 'house', 'made', 'chutney', 'sauce', 'side', 'of', 'and', 'a', 'topped',
+          'seasonal', 'vegetables', 'cheese', 'onion', 'tomato', 'mint', 'coriander', 'lemon']
+
+QUERIES = ['dosa', 'masala dosa', 'choc', 'paneer roll', 'biry', 'smoky garlic noodles', 'zanzibar']
+SHOPS = 20
+
+
+def generate(conn, count, seed=42):
+    rng = random.Random(seed)
+    conn.executemany('INSERT OR IGNORE INTO shops (id, name) VALUES (?, ?)', [(i, f'Shop {i}') for i in range(1, SHOPS + 1)])
+    rows = []
+    for i in range(count):
+        name = f'{rng.choice(ADJECTIVES)} {rng.choice(ADJECTIVES)} {rng.choice(DISHES)}'.title()
+        description = ' '.join(rng.choice(FILLER + DISHES) for _ in range(12))
+        if i % 997 == 0:
+            description += ' chocolate'
+        rows.append((name, round(rng.uniform(1, 15), 2), description, '/images/cake.jpg', rng.randint(1, 6), rng.randint(1, SHOPS)))
+    conn.executemany('INSERT INTO products (name, price, description, image_url, category_id, shop_id) VALUES (?, ?, ?, ?, ?, ?)', rows)
+    conn.commit()
+
+
+def like_search(conn, text, shop_id=None, limit=search.SEARCH_DEFAULT_LIMIT, ranked=False):
+    conditions, params, name_matches = [], [], []
+    for word in text.split():
+        conditions.append('(name LIKE ? OR description LIKE ?)')
+        params += [f'%{word}%', f'%{word}%']
+        name_matches.append(f"name LIKE '%{word}%'")
+    if shop_id:
+        conditions.append('shop_id = ?')
+        params.append(shop_id)
+    params.append(limit)
+    order = f"ORDER BY ({' AND '.join(name_matches)}) DESC" if ranked else ''
+    return [row[0] for row in conn.execute(f"SELECT id FROM products WHERE {' AND '.join(conditions)} {order} LIMIT ?", params)]
+
+
+def time_ms(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - started) / repeat * 1000, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'search.db')
+        prepare_database(database)
+        conn = sqlite3.connect(database)
+        started = time.perf_counter()
+        generate(conn, args.products)
+        print(f"Inserted {args.products} products (with FTS triggers) in {time.perf_counter() - started:.1f}s")
+
+        print(f"{'query':<24}{'shop':>6}{'FTS ms':>10}{'hits':>6}{'LIKE ms':>10}{'ranked LIKE ms':>16}{'vs ranked':>11}")
+        for shop_id in (None, 7):
+            for text in QUERIES:
+                fts_ms, fts_hits = time_ms(lambda: search.search_product_ids(conn, text, shop_id=shop_id), args.repeat)
+                like_ms, _ = time_ms(lambda: like_search(conn, text, shop_id=shop_id), args.repeat)
+                ranked_ms, _ = time_ms(lambda: like_search(conn, text, shop_id=shop_id, ranked=True), args.repeat)
+                print(f"{text:<24}{shop_id or '-':>6}{fts_ms:>10.2f}{fts_hits:>6}{like_ms:>10.2f}{ranked_ms:>16.2f}{ranked_ms / fts_ms:>10.1f}x")
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
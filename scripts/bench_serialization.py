@@ -0,0 +1,87 @@
+"""Serialization cost per 1,000 products on each response path.
+
+Compares what FastAPI does for a handler returning plain dicts under
+response_model=List[Product] (validate, then dump to JSON with pydantic),
+the older jsonable_encoder + json.dumps path, and the trusted path used by
+the catalog endpoints: rows shaped once and encoded with orjson, or with
+the stdlib fallback when orjson is missing. The last two rows are what a
+warm catalog snapshot costs: joining per-product bytes (search results) and
+reusing a whole encoded body (/products).
+
+    python scripts/bench_serialization.py --products 1000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from typing import List
+
+from loadgen import prepare_database
+
+
+def per_call_ms(fn, repeat):
+    fn()
+    best = float('inf')
+    for _ in range(3):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        best = min(best, (time.perf_counter() - started) / repeat * 1000)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'serialization.db')
+        prepare_database(database)
+        os.environ['CANTEEN_DATABASE_FILE'] = database
+        os.environ['CANTEEN_ASSETS_BUILD'] = '0'
+
+        from fastapi.encoders import jsonable_encoder
+        from pydantic import TypeAdapter
+        import main as app_module
+        import serialization
+
+        rng = random.Random(1)
+        products = [{
+            'id': i, 'name': f'Product {i}', 'price': round(rng.uniform(1, 15), 2),
+            'description': 'Freshly made, served hot with a side of chutney.', 'image_url': '/images/cake.jpg',
+            'thumbnail_url': '/assets/images/cake.480w.0123abcd.jpg', 'category_id': rng.randint(1, 6), 'shop_id': rng.randint(1, 3),
+        } for i in range(1, args.products + 1)]
+        adapter = TypeAdapter(List[app_module.Product])
+        shape = app_module.product_shape
+        per_product = {p['id']: serialization.dumps(shape(p)) for p in products}
+        whole = {'body': b'[' + b','.join(per_product.values()) + b']'}
+
+        def stdlib(content):
+            return json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode()
+
+        assert json.loads(adapter.dump_json(adapter.validate_python(products))) == json.loads(serialization.dumps([shape(p) for p in products]))
+        rows = [
+            ('response_model: validate + pydantic dump_json', lambda: adapter.dump_json(adapter.validate_python(products))),
+            ('response_model: jsonable_encoder + json.dumps', lambda: stdlib(jsonable_encoder(adapter.validate_python(products)))),
+            ('trusted: shape + ' + ('orjson' if serialization.orjson else 'stdlib json'), lambda: serialization.dumps([shape(p) for p in products])),
+            ('trusted: shape + stdlib json', lambda: stdlib([shape(p) for p in products])),
+            ('trusted, encoded rows: join per-product bytes', lambda: b'[' + b','.join(per_product[p['id']] for p in products) + b']'),
+            ('trusted, encoded body: reuse snapshot bytes', lambda: whole['body']),
+        ]
+        results = [(label, per_call_ms(fn, args.repeat)) for label, fn in rows]
+        app_module.database.shutdown()
+        app_module.pool.close_all()
+
+    scale = 1000 / args.products
+    baseline = results[0][1]
+    print(f"{'path':<50}{'ms / 1000 products':>20}{'speedup':>10}")
+    for label, ms in results:
+        print(f"{label:<50}{ms * scale:>20.3f}{baseline / ms:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Status transitions per second: one PUT per order vs POST /orders/shop/{id}/status batches.
+
+Seeds --orders Pending orders per run into a fresh server's database, then
+moves them all to Ready and then to Completed, the way a shop's tablets do
+at rush hour: --clients keep-alive connections in parallel, each sending
+the version it last saw. Runs once with one PUT /orders/{id}/status per
+order and once per --batches size with the batch endpoint. Reports
+transitions/sec, p50/p99 request latency and any transition that was not
+applied.
+
+    python scripts/bench_status_transitions.py --orders 2000 --clients 4 --batches 1,20,100
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+from loadgen import HTTPConnection, free_port, owner_login, percentile, prepare_database, start_server, stop_server
+
+import orders
+
+SERVER_ENV = {'CANTEEN_ARCHIVE': '0'}
+
+
+def seed_pending(database, count):
+    """Inserts `count` Pending orders for shop 1 and returns their ids."""
+    conn = sqlite3.connect(database)
+    conn.row_factory = sqlite3.Row
+    try:
+        order = SimpleNamespace(user_id=1, shop_id=1, items=[SimpleNamespace(id=1, quantity=1)])
+        order_ids = []
+        for start in range(0, count, 500):
+            order_ids += orders.insert_orders(conn, orders.price_orders(conn, [order] * min(500, count - start)))
+        return order_ids
+    finally:
+        conn.close()
+
+
+async def transition(port, order_ids, batch, clients, auth):
+    """Moves every order Pending -> Ready -> Completed; returns (seconds, latencies ms, outcomes)."""
+    latencies, outcomes = [], Counter()
+
+    async def client(queue, status, version):
+        conn = HTTPConnection(port)
+        try:
+            while queue:
+                chunk = [queue.pop() for _ in range(min(batch or 1, len(queue)))]
+                started = time.perf_counter()
+                if batch is None:
+                    code, _, _ = await conn.request('PUT', f'/orders/{chunk[0]}/status', body={'status': status, 'version': version}, headers=auth)
+                    outcomes['updated' if code == 200 else code] += 1
+                else:
+                    code, _, data = await conn.request('POST', '/orders/shop/1/status', body={
+                        'orders': [{'order_id': order_id, 'status': status, 'version': version} for order_id in chunk]}, headers=auth)
+                    if code == 200:
+                        outcomes.update(json.loads(data)['counts'])
+                    else:
+                        outcomes[code] += len(chunk)
+                latencies.append((time.perf_counter() - started) * 1000)
+        finally:
+            conn.close()
+
+    started = time.perf_counter()
+    for status, version in (('Ready', 0), ('Completed', 1)):
+        queue = list(reversed(order_ids))
+        await asyncio.gather(*(client(queue, status, version) for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return elapsed, latencies, outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--batches', default='1,20,100', help="Comma-separated batch sizes for the batch endpoint.")
+    args = parser.parse_args()
+
+    runs = [('PUT per order', None)] + [(f'batch of {size}', size) for size in map(int, args.batches.split(','))]
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n, (label, batch) in enumerate(runs):
+            database = os.path.join(tmp, f'status-{n}.db')
+            prepare_database(database)
+            order_ids = seed_pending(database, args.orders)
+            port = free_port()
+            server = start_server(database, port, env=SERVER_ENV)
+            try:
+                auth = owner_login(port)
+                elapsed, latencies, outcomes = asyncio.run(transition(port, order_ids, batch, args.clients, auth))
+            finally:
+                stop_server(server)
+            rows.append((label, elapsed, latencies, outcomes))
+            os.remove(database)
+
+    transitions = 2 * args.orders
+    print(f"{args.orders} orders, {transitions} transitions, {args.clients} clients")
+    print(f"{'run':<16}{'seconds':>9}{'transitions/s':>15}{'p50 ms':>9}{'p99 ms':>9}  not applied")
+    for label, elapsed, latencies, outcomes in rows:
+        refused = {outcome: count for outcome, count in outcomes.items() if outcome != 'updated'}
+        print(f"{label:<16}{elapsed:>9.2f}{outcomes['updated'] / elapsed:>15.0f}"
+              f"{percentile(latencies, 0.5):>9.1f}{percentile(latencies, 0.99):>9.1f}  {refused or '-'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""EXPLAIN QUERY PLAN regression check for the endpoint queries in main.py.
+
+Drives every endpoint once against a freshly seeded and migrated database,
+captures each SQL statement the handlers run, and fails (exit status 1) if a
+filtered query falls back to a full table scan of one of the tables that grow
+with order history.
+
+    python scripts/check_query_plans.py
+"""
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+HOT_TABLES = {'orders', 'order_items', 'products', 'users', 'shop_daily_stats'}
+
+# (method, path, json body) for every endpoint that touches the database. The
+# test client keeps the session cookie of the last /login: the student's calls
+# come first, then the shop owner's.
+ENDPOINT_CALLS = [
+    ('POST', '/login', {'email': 'student@example.com', 'password': 'student123'}),
+    ('POST', '/signup', {'email': 'plan@example.com', 'password': 'x', 'first_name': 'Plan', 'last_name': 'Check'}),
+    ('PUT', '/users/1', {'first_name': 'Janny'}),
+    ('GET', '/shops', None),
+    ('GET', '/categories', None),
+    ('GET', '/products', None),
+    ('GET', '/products?shop_id=1', None),
+    ('GET', '/products?category_id=3', None),
+    ('GET', '/products?shop_id=3&category_id=3', None),
+    ('GET', '/products/shop/1', None),
+    ('GET', '/products/search?q=dosa', None),
+    ('GET', '/products/search?q=cof&shop_id=3&category_id=3', None),
+    ('GET', '/products/1', None),
+    ('POST', '/orders', {'user_id': 1, 'shop_id': 1, 'total_price': 5.5, 'items': [{'id': 1, 'quantity': 1}]}),
+    ('POST', '/orders/bulk', {'orders': [{'user_id': 1, 'shop_id': 3, 'items': [{'id': 7, 'quantity': 2}, {'id': 8, 'quantity': 1}]}]}),
+    ('GET', '/orders/user/1', None),
+    ('POST', '/login', {'email': 'dhaba@example.com', 'password': 'owner123'}),
+    ('PUT', '/shops/1', {'name': 'South Dhaba'}),
+    ('POST', '/products', {'name': 'Plan Check Dosa', 'price': 1.0, 'category_id': 1, 'shop_id': 1}),
+    ('PUT', '/products/1', {'price': 5.5}),
+    ('GET', '/products/shop/1/stock', None),
+    ('POST', '/products/import', [{'name': 'Plan Check Dosa', 'price': 2.0, 'category_id': 1, 'shop_id': 1}, {'name': 'Plan Check Tea', 'price': 1.0, 'category_id': 3}]),
+    ('POST', '/products/import?match=id', [{'id': 1, 'price': 5.5}]),
+    ('GET', '/orders/shop/1/summary', None),
+    ('GET', '/orders/shop/1/live', None),
+    ('GET', '/orders/shop/1/history?since=2000-01-01&until=2100-01-01', None),
+    ('GET', '/orders/shop/1/history?limit=1&cursor=MjEwMC0wMS0wMSAwMDowMDowMHw5OTk5OTk=', None),
+    ('GET', '/orders/shop/1/export/lines?since=2000-01-01&until=2100-01-01', None),
+    ('GET', '/orders/shop/1/export/products?format=ndjson&status=Completed', None),
+    ('GET', '/orders/shop/1/export/hourly', None),
+    ('PUT', '/orders/1/status', {'status': 'Completed'}),
+    ('POST', '/orders/shop/1/status', {'orders': [{'order_id': 1, 'status': 'Ready'}, {'order_id': 2, 'status': 'Completed', 'version': 0}]}),
+    ('GET', '/dashboard/shop/1', None),
+    ('GET', '/dashboard/shop/1/weekly-summary', None),
+]
+
+SCAN_RE = re.compile(r'^SCAN (\w+)(?! USING (?:COVERING )?INDEX)')
+
+
+def full_scans(conn, sql):
+    """Returns the hot tables a filtered SELECT reads with a full scan."""
+    aliases = {}
+    for table, alias in re.findall(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', sql, re.I):
+        aliases[(alias or table).lower()] = table.lower()
+        aliases[table.lower()] = table.lower()
+    scanned = []
+    for row in conn.execute('EXPLAIN QUERY PLAN ' + sql):
+        match = SCAN_RE.match(row[3])
+        if match:
+            table = aliases.get(match.group(1).lower(), match.group(1).lower())
+            if table in HOT_TABLES:
+                scanned.append(row[3])
+    return scanned
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'plans.db')
+        os.environ['CANTEEN_DATABASE_FILE'] = database
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+        sys.path.insert(0, root)
+        os.chdir(root)
+
+        import db3
+        import migrations
+        conn = sqlite3.connect(database)
+        db3.create_tables(conn)
+        migrations.migrate(conn)
+        db3.seed_data(conn)
+        conn.close()
+
+        from fastapi.testclient import TestClient
+        import main as app_module
+
+        statements = []
+        app_module.pool.connect_hooks.append(lambda c: c.set_trace_callback(statements.append))
+        with TestClient(app_module.app) as client:
+            for method, path, body in ENDPOINT_CALLS:
+                response = client.request(method, path, json=body)
+                # A refused session would skip the handler's queries entirely.
+                if response.status_code >= 500 or response.status_code in (401, 403):
+                    print(f"{method} {path} failed with {response.status_code}: {response.text}")
+                    return 1
+
+        checker = sqlite3.connect(database)
+        failures = []
+        seen = set()
+        for sql in statements:
+            sql = ' '.join(sql.split())
+            if sql in seen or not sql.upper().startswith('SELECT') or ' WHERE ' not in sql.upper():
+                continue
+            seen.add(sql)
+            for detail in full_scans(checker, sql):
+                failures.append((sql, detail))
+        checker.close()
+
+    if failures:
+        print("Full table scans found in filtered endpoint queries:")
+        for sql, detail in failures:
+            print(f"  {detail}\n    {sql}")
+        return 1
+    print(f"OK: {len(seen)} filtered queries checked, no full scans of {', '.join(sorted(HOT_TABLES))}.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
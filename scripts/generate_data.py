@@ -0,0 +1,197 @@
+"""Synthetic production-scale data for the canteen database.
+
+Creates (or extends) a database with the normal schema, migrations and demo
+seed, then bulk-loads extra shops, products, students and a history of
+orders. Orders are spread over --days days with a lunch-time peak and a
+configurable status mix. The daily revenue rollup and the recommendation
+counters are rebuilt at the end.
+Generated students and owners all share the password given by --password,
+hashed once, so the load tests can log in as any of them:
+
+    studentN@example.com   (N = 1 .. --users)
+    ownerN@example.com     (owner of shop N, for shops added here)
+
+    python scripts/generate_data.py --database load.db --days 365 --orders-per-day 1500
+"""
+import argparse
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+import loadgen  # noqa: F401  (puts the project root on sys.path)
+
+import db3
+import kitchen
+import migrations
+import orders
+import recommendations
+import rollup
+from passwords import hash_password
+
+ADJECTIVES = ['Spicy', 'Crispy', 'Masala', 'Grilled', 'Steamed', 'Creamy', 'Smoky', 'Tangy', 'Sweet', 'Classic',
+              'Paneer', 'Garlic', 'Butter', 'Herbed', 'Loaded', 'Mini', 'Jumbo', 'Iced', 'Hot', 'Roasted']
+DISHES = [('Dosa', 1), ('Idli', 1), ('Vada', 1), ('Roll', 2), ('Wrap', 2), ('Coffee', 3), ('Tea', 3), ('Shake', 3),
+          ('Noodles', 4), ('Fried Rice', 4), ('Momos', 4), ('Brownie', 5), ('Cake', 5), ('Sandwich', 6), ('Toastie', 6)]
+IMAGES = ['/images/cake.jpg', '/images/espresso.jpg', '/images/iced-coffee.jpg', '/images/pasta.jpg', '/images/salad.jpg',
+          '/images/salmon.jpg', '/images/sandwich.jpg', '/images/stir-fry.jpg', '/images/veggie-burger.jpg']
+FIRST_NAMES = ['Aarav', 'Diya', 'Kabir', 'Meera', 'Rohan', 'Sara', 'Vikram', 'Zoya', 'Arjun', 'Isha', 'Nikhil', 'Tara']
+LAST_NAMES = ['Sharma', 'Iyer', 'Khan', 'Patel', 'Singh', 'Das', 'Reddy', 'Mehta', 'Nair', 'Gupta']
+
+# Relative order volume by hour of day (UTC, as stored): breakfast, a lunch
+# rush and a smaller evening bump.
+HOUR_WEIGHTS = {8: 4, 9: 6, 10: 5, 11: 10, 12: 24, 13: 20, 14: 8, 15: 5, 16: 6, 17: 5, 18: 4, 19: 3}
+DEFAULT_STATUS_MIX = 'Completed=0.93,Rejected=0.05,Pending=0.01,Ready=0.01'
+# Orders placed before today are closed; open statuses are redrawn as Completed.
+OPEN_STATUSES = ('Pending', 'Ready')
+BATCH = 20000
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        status, _, weight = part.partition('=')
+        mix[status.strip()] = float(weight)
+    return mix
+
+
+def add_shops_and_products(conn, rng, shops, products_per_shop, password_hash):
+    existing = conn.execute('SELECT COUNT(*) FROM shops').fetchone()[0]
+    for number in range(existing + 1, shops + 1):
+        shop_id = conn.execute('INSERT INTO shops (name) VALUES (?)', (f'Canteen {number}',)).lastrowid
+        conn.execute(
+            'INSERT OR IGNORE INTO users (email, password, role, first_name, last_name, shop_id) VALUES (?, ?, ?, ?, ?, ?)',
+            (f'owner{shop_id}@example.com', password_hash, 'owner', rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), shop_id),
+        )
+    rows = []
+    for shop_id, count in conn.execute('SELECT s.id, COUNT(p.id) FROM shops s LEFT JOIN products p ON p.shop_id = s.id GROUP BY s.id').fetchall():
+        for _ in range(count, products_per_shop):
+            dish, category_id = rng.choice(DISHES)
+            name = f'{rng.choice(ADJECTIVES)} {dish}'
+            rows.append((name, round(rng.uniform(1.5, 12), 2), f'{name} made fresh every day.', rng.choice(IMAGES), category_id, shop_id))
+    conn.executemany('INSERT INTO products (name, price, description, image_url, category_id, shop_id) VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+
+def add_students(conn, rng, users, password_hash):
+    conn.executemany(
+        'INSERT OR IGNORE INTO users (email, password, role, first_name, last_name, shop_id) VALUES (?, ?, ?, ?, ?, NULL)',
+        ((f'student{n}@example.com', password_hash, 'student', rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)) for n in range(1, users + 1)),
+    )
+
+
+def add_orders(conn, rng, days, orders_per_day, max_items, status_mix):
+    students = [row[0] for row in conn.execute("SELECT id FROM users WHERE role = 'student'")]
+    menus = {}
+    for product_id, shop_id, price in conn.execute('SELECT id, shop_id, price FROM products'):
+        menus.setdefault(shop_id, []).append((product_id, price))
+    shop_ids = sorted(menus)
+    # A few popular shops take most of the traffic.
+    shop_weights = [1 / (rank + 1) for rank in range(len(shop_ids))]
+    hours, hour_weights = zip(*HOUR_WEIGHTS.items())
+    statuses, status_weights = zip(*status_mix.items())
+    closed = [(s, w) for s, w in status_mix.items() if s not in OPEN_STATUSES] or [('Completed', 1.0)]
+    closed_statuses, closed_weights = zip(*closed)
+
+    next_order_id = (conn.execute('SELECT MAX(id) FROM orders').fetchone()[0] or 0) + 1
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    order_rows, item_rows, total = [], [], 0
+
+    def flush():
+        conn.executemany('INSERT INTO orders (id, user_id, shop_id, total_price, status, order_date) VALUES (?, ?, ?, ?, ?, ?)', order_rows)
+        conn.executemany('INSERT INTO order_items (order_id, product_id, quantity, price_per_item) VALUES (?, ?, ?, ?)', item_rows)
+        order_rows.clear()
+        item_rows.clear()
+
+    for day_offset in range(days - 1, -1, -1):
+        day = today - timedelta(days=day_offset)
+        count = max(0, int(rng.gauss(orders_per_day, orders_per_day * 0.1)))
+        placed = sorted(day + timedelta(hours=h, seconds=rng.randrange(3600))
+                        for h in rng.choices(hours, hour_weights, k=count))
+        for when in placed:
+            if when > now:
+                break
+            shop_id = rng.choices(shop_ids, shop_weights)[0]
+            menu = menus[shop_id]
+            subtotal = 0.0
+            for product_id, price in rng.sample(menu, min(len(menu), rng.randint(1, max_items))):
+                quantity = rng.choices((1, 2, 3), (80, 15, 5))[0]
+                item_rows.append((next_order_id, product_id, quantity, price))
+                subtotal += price * quantity
+            if day_offset == 0:
+                status = rng.choices(statuses, status_weights)[0]
+            else:
+                status = rng.choices(closed_statuses, closed_weights)[0]
+            order_rows.append((next_order_id, rng.choice(students), shop_id, round(subtotal * (1 + orders.TAX_RATE), 2),
+                               status, when.strftime('%Y-%m-%d %H:%M:%S')))
+            next_order_id += 1
+            total += 1
+            if len(order_rows) >= BATCH:
+                flush()
+    flush()
+    return total
+
+
+def generate(database, shops=10, products_per_shop=40, users=5000, days=365, orders_per_day=1500,
+             max_items=4, status_mix=DEFAULT_STATUS_MIX, password='password123', seed=1):
+    """Builds the dataset in `database` and returns a dict of row counts."""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(database)
+    db3.create_tables(conn)
+    migrations.migrate(conn)
+    db3.seed_data(conn)
+
+    # The load is one big transaction; skip the rollback journal while it runs.
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -200000')
+    password_hash = hash_password(password)
+    conn.execute('BEGIN')
+    add_shops_and_products(conn, rng, shops, products_per_shop, password_hash)
+    add_students(conn, rng, users, password_hash)
+    add_orders(conn, rng, days, orders_per_day, max_items, parse_mix(status_mix) if isinstance(status_mix, str) else status_mix)
+    conn.commit()
+    rollup.rebuild(conn)
+    recommendations.rebuild(conn)
+    kitchen.rebuild(conn)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA optimize')
+    counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+              for table in ('shops', 'products', 'users', 'orders', 'order_items')}
+    conn.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', required=True)
+    parser.add_argument('--shops', type=int, default=10)
+    parser.add_argument('--products-per-shop', type=int, default=40)
+    parser.add_argument('--users', type=int, default=5000, help='generated students')
+    parser.add_argument('--days', type=int, default=365, help='days of order history, ending today')
+    parser.add_argument('--orders-per-day', type=int, default=1500)
+    parser.add_argument('--max-items', type=int, default=4, help='distinct products per order (1..N)')
+    parser.add_argument('--status-mix', default=DEFAULT_STATUS_MIX,
+                        help="status=weight pairs; Pending/Ready only apply to today's orders")
+    parser.add_argument('--password', default='password123')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--force', action='store_true', help='delete the database first if it exists')
+    args = parser.parse_args()
+
+    if os.path.exists(args.database):
+        if not args.force:
+            parser.error(f"{args.database} exists; pass --force to replace it")
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.database + suffix):
+                os.remove(args.database + suffix)
+    started = time.perf_counter()
+    counts = generate(args.database, args.shops, args.products_per_shop, args.users, args.days, args.orders_per_day,
+                      args.max_items, args.status_mix, args.password, args.seed)
+    elapsed = time.perf_counter() - started
+    print(', '.join(f'{count:,} {table}' for table, count in counts.items()))
+    print(f"Generated in {elapsed:.1f}s ({(counts['orders'] + counts['order_items']) / elapsed:,.0f} rows/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""Shared helpers for the load tests and benchmarks in this directory.
+
+Starts uvicorn against a throwaway database and provides a small keep-alive
+HTTP/1.1 client on asyncio streams, so the load tests need nothing beyond
+the app's own requirements.
+"""
+import asyncio
+import json
+import os
+import resource
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def raise_fd_limit(wanted=65536):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = min(wanted, hard) if hard != resource.RLIM_INFINITY else wanted
+    if soft < target:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+
+
+def rss_kib(pid, field='VmRSS'):
+    """Resident memory of `pid` in KiB; field='RssAnon' leaves out mapped file pages (SQLite's mmap)."""
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def prepare_database(database, root=ROOT):
+    """Creates, migrates and seeds a database using the schema code in `root`."""
+    subprocess.run(
+        [sys.executable, '-c',
+         'import sqlite3, sys, db3, migrations\n'
+         'conn = sqlite3.connect(sys.argv[1])\n'
+         'db3.create_tables(conn); migrations.migrate(conn); db3.seed_data(conn); conn.close()',
+         database],
+        cwd=root, check=True, stdout=subprocess.DEVNULL,
+    )
+
+
+def start_server(database, port, root=ROOT, workers=1, env=None):
+    """Runs `uvicorn main:app` from `root` and waits until it answers."""
+    env = dict(os.environ, CANTEEN_DATABASE_FILE=database, **(env or {}))
+    command = [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port), '--log-level', 'warning']
+    if workers > 1:
+        command += ['--workers', str(workers)]
+    proc = subprocess.Popen(command, cwd=root, env=env, preexec_fn=raise_fd_limit)
+    for _ in range(200):
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/shops', timeout=1)
+            return proc
+        except OSError:
+            if proc.poll() is not None:
+                break
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError("uvicorn did not start")
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def login(port, email='student@example.com', password='student123'):
+    """Logs in over HTTP and returns headers carrying the session token (empty if the tree has none)."""
+    request = urllib.request.Request(
+        f'http://127.0.0.1:{port}/login', data=json.dumps({'email': email, 'password': password}).encode(),
+        headers={'Content-Type': 'application/json'},
+    )
+    with urllib.request.urlopen(request) as response:
+        token = json.load(response).get('token')
+    return {'Authorization': f'Bearer {token}'} if token else {}
+
+
+def owner_login(port):
+    """Logs in as the seeded owner of shop 1, which the owner endpoints require."""
+    return login(port, 'dhaba@example.com', 'owner123')
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class HTTPConnection:
+    """A minimal keep-alive HTTP/1.1 client connection (Content-Length and chunked bodies)."""
+
+    def __init__(self, port, host='127.0.0.1'):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method, path, body=None, headers=None):
+        if self.writer is None:
+            await self.connect()
+        payload = b'' if body is None else json.dumps(body).encode()
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}', f'Content-Length: {len(payload)}']
+        if body is not None:
+            lines.append('Content-Type: application/json')
+        lines += [f'{k}: {v}' for k, v in (headers or {}).items()]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + payload)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("server closed the connection")
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode().partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+        if response_headers.get('transfer-encoding') == 'chunked':
+            data = b''
+            while True:
+                size = int((await self.reader.readline()).strip(), 16)
+                if size == 0:
+                    await self.reader.readline()
+                    break
+                data += await self.reader.readexactly(size)
+                await self.reader.readline()
+        else:
+            data = await self.reader.readexactly(int(response_headers.get('content-length', 0)))
+        if response_headers.get('connection') == 'close':
+            self.close()
+        return status, response_headers, data
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
@@ -0,0 +1,102 @@
+"""Load test for the live order feed (/orders/shop/{id}/stream).
+
+Starts uvicorn on a throwaway database, holds N idle SSE connections open for
+a while, then places orders and measures how long each event takes to reach
+every subscriber. Reports fan-out latency, delivery counts and server RSS.
+
+    python scripts/loadtest_live_feed.py --clients 500 --idle 20 --orders 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import urllib.request
+
+from loadgen import free_port, login, owner_login, percentile, prepare_database, raise_fd_limit, rss_kib, start_server, stop_server
+
+
+async def subscriber(port, shop_id, owner_auth, ready, received):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    headers = ''.join(f'{name}: {value}\r\n' for name, value in owner_auth.items())
+    writer.write(f'GET /orders/shop/{shop_id}/stream HTTP/1.1\r\nHost: localhost\r\n{headers}\r\n'.encode())
+    await writer.drain()
+    await reader.readuntil(b'\r\n\r\n')
+    ready.release()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            if line.startswith(b'data: {"type": "order_created"'):
+                order_id = json.loads(line[6:])['order']['order_id']
+                received.setdefault(order_id, []).append(time.perf_counter())
+    finally:
+        writer.close()
+
+
+def place_order(port, shop_id, auth):
+    body = json.dumps({'user_id': 1, 'shop_id': shop_id, 'total_price': 5.5, 'items': [{'id': 1, 'quantity': 1}]}).encode()
+    request = urllib.request.Request(f'http://127.0.0.1:{port}/orders', data=body, headers={'Content-Type': 'application/json', **auth})
+    sent = time.perf_counter()
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)['order_id'], sent
+
+
+async def run(args, port, server):
+    ready = asyncio.Semaphore(0)
+    received = {}
+    loop = asyncio.get_running_loop()
+    owner_auth = await loop.run_in_executor(None, owner_login, port)
+    tasks = [asyncio.create_task(subscriber(port, 1, owner_auth, ready, received)) for _ in range(args.clients)]
+    for _ in range(args.clients):
+        await asyncio.wait_for(ready.acquire(), timeout=30)
+    print(f"{args.clients} subscribers connected; idling {args.idle}s (RSS {rss_kib(server.pid) // 1024} MiB)")
+    await asyncio.sleep(args.idle)
+
+    latencies, delivered = [], 0
+    auth = await loop.run_in_executor(None, login, port)
+    for _ in range(args.orders):
+        order_id, sent = await loop.run_in_executor(None, place_order, port, 1, auth)
+        deadline = time.perf_counter() + 10
+        while len(received.get(order_id, [])) < args.clients and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+        arrivals = received.get(order_id, [])
+        delivered += len(arrivals)
+        latencies.extend((t - sent) * 1000 for t in arrivals)
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    latencies.sort()
+    print(f"delivered {delivered}/{args.clients * args.orders} events")
+    print(f"fan-out latency ms: p50={percentile(latencies, 0.5):.1f} p99={percentile(latencies, 0.99):.1f} max={percentile(latencies, 1.0):.1f}")
+    print(f"server RSS after test: {rss_kib(server.pid) // 1024} MiB")
+    return delivered == args.clients * args.orders
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=300)
+    parser.add_argument('--idle', type=float, default=5.0, help='seconds to hold connections idle')
+    parser.add_argument('--orders', type=int, default=5)
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'feed.db')
+        prepare_database(database)
+        port = free_port()
+        server = start_server(database, port)
+        try:
+            ok = asyncio.run(run(args, port, server))
+        finally:
+            stop_server(server)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
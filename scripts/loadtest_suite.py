@@ -0,0 +1,351 @@
+"""Repeatable lunch-rush load test with a machine-readable baseline.
+
+Generates a dataset with generate_data.py (or uses --database), then drives
+the app with virtual students and shop owners for a fixed duration. Students
+browse, search, check their orders and place new ones. Owners poll their live
+queue, move orders along, and look at the dashboard and history. The app runs
+either under uvicorn (default) or in-process through httpx's ASGI transport
+(--in-process).
+
+Per-endpoint throughput and p50/p95/p99 latency are written as sorted,
+rounded JSON to --output. Commit that file, and regressions show up as diffs.
+--compare checks a run against an earlier baseline and exits 1 if any
+endpoint's p95 got worse by more than --max-regression.
+
+    python scripts/loadtest_suite.py --days 365 --orders-per-day 1500 --vus 50 --duration 30
+    python scripts/loadtest_suite.py --database load.db --compare scripts/baselines/lunch_rush.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import tempfile
+import time
+
+from loadgen import ROOT, HTTPConnection, free_port, percentile, raise_fd_limit, start_server, stop_server
+
+DEFAULT_OUTPUT = os.path.join(ROOT, 'scripts', 'baselines', 'lunch_rush.json')
+DEMO_PASSWORDS = {'student@example.com': 'student123', 'dhaba@example.com': 'owner123',
+                  'frankie@example.com': 'owner123', 'sip@example.com': 'owner123'}
+
+# (endpoint label, weight). Labels are the route templates the stats are keyed by.
+STUDENT_MIX = [
+    ('GET /products', 25),
+    ('GET /products/search', 10),
+    ('GET /products/{product_id}', 10),
+    ('GET /orders/user/{user_id}', 20),
+    ('POST /orders', 15),
+]
+OWNER_MIX = [
+    ('GET /orders/shop/{shop_id}/live', 40),
+    ('PUT /orders/{order_id}/status', 25),
+    ('GET /dashboard/shop/{shop_id}', 15),
+    ('GET /dashboard/shop/{shop_id}/weekly-summary', 10),
+    ('GET /orders/shop/{shop_id}/history', 10),
+]
+LEGACY_OWNER_MIX = [('GET /orders/shop/{shop_id}/summary', 5)]
+NEXT_STATUS = {'Pending': 'Ready', 'Ready': 'Completed'}
+
+
+# ==============================================================================
+# --- Targets ---
+# ==============================================================================
+
+class ServerTarget:
+    """One keep-alive connection per virtual user to a uvicorn instance."""
+
+    def __init__(self, port):
+        self.port = port
+
+    def client(self):
+        conn = HTTPConnection(self.port)
+
+        async def request(method, path, body=None, headers=None):
+            try:
+                status, _, data = await conn.request(method, path, body, headers)
+            except (ConnectionError, OSError, asyncio.IncompleteReadError):
+                conn.close()
+                return 599, b''
+            return status, data
+        request.close = conn.close
+        return request
+
+
+class InProcessTarget:
+    """Calls the ASGI app directly; no sockets, one event loop shared with the app."""
+
+    def __init__(self, app):
+        import httpx
+        self.http = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://canteen')
+
+    def client(self):
+        async def request(method, path, body=None, headers=None):
+            response = await self.http.request(method, path, json=body, headers=headers)
+            return response.status_code, response.content
+        request.close = lambda: None
+        return request
+
+
+# ==============================================================================
+# --- Virtual Users ---
+# ==============================================================================
+
+def load_fixture(database, students, password):
+    conn = sqlite3.connect(database)
+    menus = {}
+    for product_id, shop_id, name in conn.execute('SELECT id, shop_id, name FROM products'):
+        menus.setdefault(shop_id, []).append((product_id, name))
+    student_rows = conn.execute(
+        "SELECT id, email FROM users WHERE role = 'student' AND email LIKE 'student%@example.com' ORDER BY id LIMIT ?", (students,)
+    ).fetchall()
+    owners = conn.execute("SELECT id, email, shop_id FROM users WHERE role = 'owner' AND shop_id IS NOT NULL ORDER BY shop_id").fetchall()
+    counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in ('shops', 'products', 'users', 'orders', 'order_items')}
+    conn.close()
+    words = sorted({word for items in menus.values() for _, name in items for word in name.split()})
+    return {
+        'menus': menus,
+        'students': [(user_id, email, DEMO_PASSWORDS.get(email, password)) for user_id, email in student_rows],
+        'owners': [(user_id, email, DEMO_PASSWORDS.get(email, password), shop_id) for user_id, email, shop_id in owners],
+        'words': words,
+        'counts': counts,
+    }
+
+
+async def login(request, email, password):
+    status, data = await request('POST', '/login', {'email': email, 'password': password})
+    if status != 200:
+        raise RuntimeError(f"login as {email} failed with {status}")
+    return {'Authorization': f"Bearer {json.loads(data)['token']}"}
+
+
+async def student(request, auth, fixture, account, rng, deadline, think, record):
+    user_id = account[0]
+    labels, weights = zip(*STUDENT_MIX)
+    shop_ids = list(fixture['menus'])
+    while time.perf_counter() < deadline:
+        label = rng.choices(labels, weights)[0]
+        if label == 'GET /products':
+            call = ('GET', '/products', None)
+        elif label == 'GET /products/search':
+            call = ('GET', f"/products/search?q={rng.choice(fixture['words'])[:rng.randint(3, 6)]}", None)
+        elif label == 'GET /products/{product_id}':
+            call = ('GET', f"/products/{rng.choice(fixture['menus'][rng.choice(shop_ids)])[0]}", None)
+        elif label == 'GET /orders/user/{user_id}':
+            call = ('GET', f'/orders/user/{user_id}', None)
+        else:
+            shop_id = rng.choice(shop_ids)
+            items = rng.sample(fixture['menus'][shop_id], min(3, rng.randint(1, 3), len(fixture['menus'][shop_id])))
+            call = ('POST', '/orders', {'user_id': user_id, 'shop_id': shop_id, 'items': [{'id': pid, 'quantity': 1} for pid, _ in items]})
+        await record(label, request, *call, auth)
+        if think:
+            await asyncio.sleep(rng.expovariate(1 / think))
+
+
+async def owner(request, auth, fixture, account, rng, deadline, think, record, mix):
+    shop_id = account[3]
+    labels, weights = zip(*mix)
+    live = []
+    while time.perf_counter() < deadline:
+        label = rng.choices(labels, weights)[0]
+        if label == 'PUT /orders/{order_id}/status' and live:
+            order = live.pop(rng.randrange(len(live)))
+            await record(label, request, 'PUT', f"/orders/{order['order_id']}/status", {'status': NEXT_STATUS[order['status']]}, auth)
+        elif label in ('GET /orders/shop/{shop_id}/live', 'PUT /orders/{order_id}/status'):
+            data = await record('GET /orders/shop/{shop_id}/live', request, 'GET', f'/orders/shop/{shop_id}/live', None, auth)
+            if data:
+                body = json.loads(data)
+                live = body['pending'] + body['ready']
+        else:
+            path = label.replace('{shop_id}', str(shop_id)).split(' ', 1)[1]
+            await record(label, request, 'GET', path, None, auth)
+        if think:
+            await asyncio.sleep(rng.expovariate(1 / think))
+
+
+async def drive(target, fixture, args):
+    results = {}
+    rng = random.Random(args.seed)
+    deadline = float('inf')
+
+    async def record(label, request, method, path, body, headers):
+        started = time.perf_counter()
+        status, data = await request(method, path, body, headers)
+        if time.perf_counter() <= deadline:
+            stats = results.setdefault(label, {'latencies': [], 'errors': 0})
+            stats['latencies'].append((time.perf_counter() - started) * 1000)
+            if status >= 400:
+                stats['errors'] += 1
+        return data if status < 400 else None
+
+    owner_mix = OWNER_MIX + (LEGACY_OWNER_MIX if args.include_legacy else [])
+    owners_wanted = max(1, round(args.vus * args.owner_share))
+    owner_accounts = [fixture['owners'][i % len(fixture['owners'])] for i in range(owners_wanted)]
+    student_accounts = [fixture['students'][i % len(fixture['students'])] for i in range(args.vus - owners_wanted)]
+    think = args.think_ms / 1000
+
+    # Log everyone in before the clock starts so logins are not measured.
+    users = [('owner', a) for a in owner_accounts] + [('student', a) for a in student_accounts]
+    clients = [target.client() for _ in users]
+    auths = await asyncio.gather(*(login(request, account[1], account[2]) for request, (_, account) in zip(clients, users)))
+
+    deadline = time.perf_counter() + args.duration
+    tasks = []
+    for request, auth, (role, account) in zip(clients, auths, users):
+        user_rng = random.Random(rng.random())
+        if role == 'owner':
+            tasks.append(owner(request, auth, fixture, account, user_rng, deadline, think, record, owner_mix))
+        else:
+            tasks.append(student(request, auth, fixture, account, user_rng, deadline, think, record))
+    await asyncio.gather(*tasks)
+    for request in clients:
+        request.close()
+    return results
+
+
+# ==============================================================================
+# --- Baseline ---
+# ==============================================================================
+
+def summarize(results, duration):
+    endpoints = {}
+    for label, stats in sorted(results.items()):
+        latencies = sorted(stats['latencies'])
+        endpoints[label] = {
+            'requests': len(latencies),
+            'errors': stats['errors'],
+            'rps': round(len(latencies) / duration, 1),
+            'p50_ms': round(percentile(latencies, 0.50), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+        }
+    requests = sum(e['requests'] for e in endpoints.values())
+    total = {'requests': requests, 'errors': sum(e['errors'] for e in endpoints.values()), 'rps': round(requests / duration, 1)}
+    return endpoints, total
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(endpoints, total, previous=None):
+    print(f"{'endpoint':<48}{'requests':>9}{'errors':>8}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'p95 vs base':>13}")
+    for label, e in endpoints.items():
+        change = ''
+        if previous and label in previous:
+            change = f"{e['p95_ms'] / previous[label]['p95_ms'] - 1:+.0%}"
+        print(f"{label:<48}{e['requests']:>9}{e['errors']:>8}{e['rps']:>9.1f}{e['p50_ms']:>9.2f}{e['p95_ms']:>9.2f}{e['p99_ms']:>9.2f}{change:>13}")
+    print(f"{'total':<48}{total['requests']:>9}{total['errors']:>8}{total['rps']:>9.1f}")
+
+
+def regressions(endpoints, previous, allowed):
+    return [label for label, e in endpoints.items()
+            if label in previous and e['p95_ms'] > previous[label]['p95_ms'] * (1 + allowed)]
+
+
+# ==============================================================================
+# --- Runner ---
+# ==============================================================================
+
+def run_server(database, fixture, args):
+    port = free_port()
+    server = start_server(database, port, workers=args.workers)
+    try:
+        return asyncio.run(drive(ServerTarget(port), fixture, args))
+    finally:
+        stop_server(server)
+
+
+def run_in_process(database, fixture, args):
+    import main as canteen
+
+    async def session():
+        async with canteen.app.router.lifespan_context(canteen.app):
+            target = InProcessTarget(canteen.app)
+            try:
+                return await drive(target, fixture, args)
+            finally:
+                await target.http.aclose()
+    return asyncio.run(session())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', help='existing database from generate_data.py (otherwise one is generated)')
+    parser.add_argument('--shops', type=int, default=10)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--orders-per-day', type=int, default=1500)
+    parser.add_argument('--password', default='password123', help='password of the generated accounts')
+    parser.add_argument('--vus', type=int, default=50, help='concurrent virtual users')
+    parser.add_argument('--owner-share', type=float, default=0.1, help='fraction of virtual users that are shop owners')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of measured load')
+    parser.add_argument('--think-ms', type=float, default=0, help='mean pause between a user\'s requests')
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn workers (server mode)')
+    parser.add_argument('--in-process', action='store_true', help='call the ASGI app directly instead of over HTTP')
+    parser.add_argument('--include-legacy', action='store_true', help='add the legacy /orders/shop/{id}/summary to the owner mix')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="baseline JSON to write ('-' to skip)")
+    parser.add_argument('--compare', help='earlier baseline to compare p95 latencies against')
+    parser.add_argument('--max-regression', type=float, default=0.25, help='allowed p95 increase per endpoint with --compare')
+    args = parser.parse_args()
+    raise_fd_limit()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = args.database or os.path.join(tmp, 'load.db')
+        # The app's modules read their configuration at import time, so the
+        # environment has to be in place before anything imports them.
+        os.environ.update(CANTEEN_DATABASE_FILE=os.path.abspath(database))
+        import generate_data
+
+        if args.database is None:
+            started = time.perf_counter()
+            generate_data.generate(database, shops=args.shops, users=args.users, days=args.days,
+                                   orders_per_day=args.orders_per_day, password=args.password, seed=args.seed)
+            print(f"Generated dataset in {time.perf_counter() - started:.1f}s")
+        fixture = load_fixture(database, args.vus, args.password)
+        print(', '.join(f'{count:,} {table}' for table, count in fixture['counts'].items()))
+        mode = 'in-process' if args.in_process else 'server'
+        print(f"Running {args.vus} virtual users for {args.duration:.0f}s ({mode})")
+        results = (run_in_process if args.in_process else run_server)(database, fixture, args)
+
+    endpoints, total = summarize(results, args.duration)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['endpoints']
+    print_table(endpoints, total, previous)
+
+    if args.output != '-':
+        baseline = {
+            'scenario': 'lunch-rush',
+            'config': {
+                'mode': mode, 'vus': args.vus, 'owner_share': args.owner_share, 'duration_s': args.duration,
+                'think_ms': args.think_ms, 'workers': 1 if args.in_process else args.workers,
+                'include_legacy': args.include_legacy, 'seed': args.seed, 'dataset': fixture['counts'],
+            },
+            'environment': {'git': git_revision(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+            'endpoints': endpoints,
+            'total': total,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Wrote {args.output}")
+
+    if previous:
+        slower = regressions(endpoints, previous, args.max_regression)
+        if slower:
+            print(f"p95 regressed more than {args.max_regression:.0%}: {', '.join(slower)}")
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
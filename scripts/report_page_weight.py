@@ -0,0 +1,92 @@
+"""Bytes transferred per page before and after the static asset pipeline.
+
+Starts the server twice on a freshly seeded database: once serving static/
+as-is (CANTEEN_ASSETS_BUILD=0) and once serving the built tree. For every
+page it loads the HTML, the local scripts it references, and the product
+images the page shows, with the Accept-Encoding a browser would send. It
+then counts response body bytes and how many requests a repeat visit still
+makes (resources that are not immutable get revalidated).
+
+    python scripts/report_page_weight.py
+"""
+import asyncio
+import json
+import os
+import re
+import tempfile
+
+from loadgen import HTTPConnection, free_port, prepare_database, start_server, stop_server
+
+PAGES = ['login.html', 'home.html', 'all_products.html', 'product.html', 'my_cart.html', 'orders.html',
+         'shop_dashboard.html', 'shop_orders.html', 'shop_products.html']
+# Product images each page renders: 'grid' shows every product as a tile,
+# 'popular' the four popular-product tiles on the home page, and 'detail' one
+# full-size image plus up to six related-product tiles.
+PAGE_IMAGES = {'home.html': 'popular', 'all_products.html': 'grid', 'shop_products.html': 'grid', 'product.html': 'detail'}
+ACCEPT_ENCODING = {'Accept-Encoding': 'br, gzip'}
+LOCAL_SCRIPT_RE = re.compile(r'''\bsrc=["'](\.?/?[\w./-]+\.js)["']''')
+
+
+def page_resources(html, products, kind):
+    urls = ['/' + src.lstrip('./') for src in LOCAL_SCRIPT_RE.findall(html)]
+    if kind in ('grid', 'popular'):
+        urls += [p.get('thumbnail_url') or p['image_url'] for p in products[kind]]
+    elif kind == 'detail':
+        urls.append(products['grid'][0]['image_url'])
+        urls += [p.get('thumbnail_url') or p['image_url'] for p in products['related']]
+    return list(dict.fromkeys(urls))
+
+
+async def measure(port):
+    conn = HTTPConnection(port)
+    try:
+        products = {}
+        for kind, path in (('grid', '/products'), ('popular', '/products/popular?limit=4')):
+            _, _, body = await conn.request('GET', path)
+            products[kind] = json.loads(body)
+        _, _, body = await conn.request('GET', f"/products/{products['grid'][0]['id']}/related?limit=6")
+        products['related'] = json.loads(body)
+        results = {}
+        for page in PAGES:
+            _, _, body = await conn.request('GET', '/' + page, headers=ACCEPT_ENCODING)
+            total, revalidated = len(body), 1
+            _, _, html = await conn.request('GET', '/' + page)  # uncompressed copy, only to find its scripts
+            for url in page_resources(html.decode(), products, PAGE_IMAGES.get(page)):
+                _, headers, body = await conn.request('GET', url, headers=ACCEPT_ENCODING)
+                total += len(body)
+                if 'immutable' not in headers.get('cache-control', ''):
+                    revalidated += 1
+            results[page] = (total, revalidated)
+        return results
+    finally:
+        conn.close()
+
+
+def run(database, env):
+    port = free_port()
+    server = start_server(database, port, env=env)
+    try:
+        return asyncio.run(measure(port))
+    finally:
+        stop_server(server)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'weight.db')
+        prepare_database(database)
+        before = run(database, {'CANTEEN_ASSETS_BUILD': '0'})
+        after = run(database, {'CANTEEN_ASSETS_DIR': os.path.join(tmp, 'build')})
+
+    print(f"{'page':<22}{'before KiB':>12}{'after KiB':>12}{'saved':>8}{'repeat-visit requests':>24}")
+    totals = [0, 0]
+    for page in PAGES:
+        (b_bytes, b_requests), (a_bytes, a_requests) = before[page], after[page]
+        totals[0] += b_bytes
+        totals[1] += a_bytes
+        print(f"{page:<22}{b_bytes / 1024:>12.1f}{a_bytes / 1024:>12.1f}{1 - a_bytes / b_bytes:>8.0%}{f'{b_requests} -> {a_requests}':>24}")
+    print(f"{'total':<22}{totals[0] / 1024:>12.1f}{totals[1] / 1024:>12.1f}{1 - totals[1] / totals[0]:>8.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Streams sales exports of millions of rows and checks the server's memory stays flat.
+
+Generates a database with --days of history at --orders-per-day (most of it
+for one shop), archives orders older than 90 days into the monthly tables,
+and starts the server on it. Each report (lines, products, hourly) is then
+downloaded over the whole range in CSV and NDJSON while the server's RSS is
+sampled. Every export must contain one row per order item / product / hour
+as counted directly in the database, and the server's anonymous RSS (heap,
+including SQLite's page cache) may grow by at most --max-growth MiB over
+what it used after a small warm-up export, however many rows are streamed.
+Total RSS is reported too; it also counts the database pages SQLite maps
+into memory, which are bounded by the mmap_size pragma, not by the export.
+
+    python scripts/stress_export.py --days 365 --orders-per-day 4000 --max-growth 32
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import loadgen
+from loadgen import free_port, login, rss_kib, start_server, stop_server
+
+import archive
+from generate_data import generate
+
+SERVER_ENV = {'CANTEEN_ARCHIVE': '0'}
+
+
+def expected_rows(database, shop_id):
+    """{report: rows} counted straight from the live and archive tables."""
+    conn = sqlite3.connect(database)
+    try:
+        lines, hours, products = 0, set(), set()
+        for orders_table, items_table in archive.order_tables(conn):
+            lines += conn.execute(f'SELECT COUNT(*) FROM {orders_table} o JOIN {items_table} oi ON oi.order_id = o.id WHERE o.shop_id = ?', (shop_id,)).fetchone()[0]
+            hours.update(row[0] for row in conn.execute(f'SELECT DISTINCT SUBSTR(order_date, 1, 13) FROM {orders_table} WHERE shop_id = ?', (shop_id,)))
+            products.update(row[0] for row in conn.execute(f'SELECT DISTINCT oi.product_id FROM {orders_table} o JOIN {items_table} oi ON oi.order_id = o.id WHERE o.shop_id = ?', (shop_id,)))
+        return {'lines': lines, 'products': len(products), 'hourly': len(hours)}
+    finally:
+        conn.close()
+
+
+def download(port, path, auth):
+    """(rows, bytes, seconds) for a streamed export, read 64 KiB at a time."""
+    started = time.perf_counter()
+    rows = size = 0
+    with urllib.request.urlopen(urllib.request.Request(f'http://127.0.0.1:{port}{path}', headers=auth), timeout=600) as response:
+        while chunk := response.read(65536):
+            rows += chunk.count(b'\n')
+            size += len(chunk)
+    return rows, size, time.perf_counter() - started
+
+
+class RSSSampler(threading.Thread):
+    def __init__(self, pid, interval=0.05):
+        super().__init__(daemon=True)
+        self.pid, self.interval, self.peak, self.peak_total = pid, interval, 0, 0
+        self._finished = threading.Event()
+
+    def run(self):
+        while not self._finished.is_set():
+            self.peak = max(self.peak, rss_kib(self.pid, 'RssAnon'))
+            self.peak_total = max(self.peak_total, rss_kib(self.pid))
+            time.sleep(self.interval)
+
+    def stop(self):
+        self._finished.set()
+        self.join()
+        return self.peak, self.peak_total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--orders-per-day', type=int, default=4000)
+    parser.add_argument('--max-growth', type=float, default=32, help="MiB the server's RSS may grow during an export.")
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'export.db')
+        started = time.perf_counter()
+        # One added shop: with the seeded ones, it takes about half of the orders.
+        counts = generate(database, shops=1, products_per_shop=60, users=2000, days=args.days, orders_per_day=args.orders_per_day)
+        conn = sqlite3.connect(database)
+        conn.row_factory = sqlite3.Row
+        shop_id = conn.execute('SELECT shop_id FROM orders GROUP BY shop_id ORDER BY COUNT(*) DESC LIMIT 1').fetchone()[0]
+        owner_email = conn.execute("SELECT email FROM users WHERE role = 'owner' AND shop_id = ?", (shop_id,)).fetchone()[0]
+        archived = archive.archive_shop(conn, shop_id, archive.cutoff_for(archive.ARCHIVE_AFTER_DAYS), batch_size=20000, pause=0)
+        conn.close()
+        expected = expected_rows(database, shop_id)
+        print(f"Generated {counts['orders']} orders / {counts['order_items']} items in {time.perf_counter() - started:.0f}s; "
+              f"shop {shop_id}: {expected['lines']} order lines, {archived} orders archived")
+
+        port = free_port()
+        server = start_server(database, port, env=SERVER_ENV)
+        try:
+            # Exports are the shop owner's. Generated owners (ownerN@) use generate()'s
+            # default password, the seeded ones the demo password.
+            auth = login(port, owner_email, 'password123' if owner_email.startswith('owner') else 'owner123')
+            download(port, f'/orders/shop/{shop_id}/export/lines?since=2000-01-01&until=2000-01-02', auth)
+            baseline = rss_kib(server.pid, 'RssAnon')
+            print(f"Server RSS after warm-up: {baseline / 1024:.1f} MiB anonymous, {rss_kib(server.pid) / 1024:.1f} MiB total")
+            print(f"{'report':<10}{'format':<8}{'rows':>11}{'MiB':>9}{'seconds':>9}{'rows/s':>10}{'anon RSS':>10}{'growth':>8}{'total RSS':>11}")
+            for report in ('lines', 'products', 'hourly'):
+                for fmt in ('csv', 'ndjson'):
+                    sampler = RSSSampler(server.pid)
+                    sampler.start()
+                    rows, size, elapsed = download(port, f'/orders/shop/{shop_id}/export/{report}?format={fmt}', auth)
+                    peak, peak_total = sampler.stop()
+                    rows -= fmt == 'csv'  # header
+                    growth = (peak - baseline) / 1024
+                    print(f"{report:<10}{fmt:<8}{rows:>11}{size / 2 ** 20:>9.1f}{elapsed:>9.1f}{rows / elapsed:>10.0f}{peak / 1024:>10.1f}{growth:>8.1f}{peak_total / 1024:>11.1f}")
+                    if rows != expected[report]:
+                        failures.append(f"{report}/{fmt}: {rows} rows, expected {expected[report]}")
+                    if growth > args.max_growth:
+                        failures.append(f"{report}/{fmt}: RSS grew {growth:.1f} MiB, over the {args.max_growth} MiB ceiling")
+        finally:
+            stop_server(server)
+
+    if failures:
+        print("FAILED:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print(f"OK: every export complete, server anonymous RSS within {args.max_growth} MiB of the warm-up")
+
+
+if __name__ == '__main__':
+    loadgen.raise_fd_limit()
+    main()
@@ -0,0 +1,152 @@
+"""Fires the same Idempotency-Key at POST /orders from many clients at once and checks one order is placed.
+
+For each of --keys keys, --clients keep-alive connections send the same
+order with the same key simultaneously (--repeat times each). Every response
+must be a 201 with the same body, exactly one of them must not be marked
+Idempotent-Replayed, and exactly one order row must appear. With --workers > 1
+the clients are spread over several uvicorn processes, so the key table (not
+just the in-process coalescing) has to settle the race. Finally the server is
+restarted and one key is retried, which must replay without a new order, and
+the key is reused with a different cart, which must be refused with 422.
+
+    python scripts/stress_idempotency.py --clients 50 --keys 20 --workers 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import urllib.request
+import uuid
+
+from loadgen import HTTPConnection, free_port, prepare_database, start_server, stop_server
+
+# Workers must share the secret to accept each other's session tokens.
+SERVER_ENV = {'CANTEEN_SESSION_SECRET': 'stress-idempotency'}
+
+
+def login(port, email='student@example.com', password='student123'):
+    request = urllib.request.Request(
+        f'http://127.0.0.1:{port}/login', data=json.dumps({'email': email, 'password': password}).encode(),
+        headers={'Content-Type': 'application/json'},
+    )
+    with urllib.request.urlopen(request) as response:
+        user = json.load(response)
+    return user['id'], {'Authorization': f"Bearer {user['token']}"}
+
+
+def order_count(database, user_id):
+    conn = sqlite3.connect(database)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM orders WHERE user_id = ?', (user_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def shop_products(database, shop_id=1):
+    conn = sqlite3.connect(database)
+    try:
+        return [row[0] for row in conn.execute('SELECT id FROM products WHERE shop_id = ? ORDER BY id LIMIT 3', (shop_id,))]
+    finally:
+        conn.close()
+
+
+async def fire(port, clients, repeat, body, headers):
+    """Sends `body` from `clients` connections at once; returns [(status, replayed, data)]."""
+    connections = [HTTPConnection(port) for _ in range(clients)]
+    await asyncio.gather(*(conn.connect() for conn in connections))
+    start = asyncio.Event()
+
+    async def client(conn):
+        await start.wait()
+        results = []
+        for _ in range(repeat):
+            status, response_headers, data = await conn.request('POST', '/orders', body=body, headers=headers)
+            results.append((status, response_headers.get('idempotent-replayed') == 'true', data))
+        return results
+
+    tasks = [asyncio.ensure_future(client(conn)) for conn in connections]
+    await asyncio.sleep(0)
+    start.set()
+    try:
+        return [result for results in await asyncio.gather(*tasks) for result in results]
+    finally:
+        for conn in connections:
+            conn.close()
+
+
+def check(results, before, after, failures, label):
+    statuses = {status for status, _, _ in results}
+    bodies = {data for _, _, data in results}
+    fresh = sum(1 for _, replayed, _ in results if not replayed)
+    problems = []
+    if statuses != {201}:
+        problems.append(f"statuses {sorted(statuses)}")
+    if len(bodies) != 1:
+        problems.append(f"{len(bodies)} different bodies")
+    if fresh != 1:
+        problems.append(f"{fresh} responses not marked replayed")
+    if after - before != 1:
+        problems.append(f"{after - before} orders created")
+    if problems:
+        failures.append(f"{label}: {', '.join(problems)}")
+    return bodies.pop() if len(bodies) == 1 else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--keys', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=2, help="Requests per client per key.")
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'idempotency.db')
+        prepare_database(database)
+        product_ids = shop_products(database)
+        port = free_port()
+        server = start_server(database, port, workers=args.workers, env=SERVER_ENV)
+        try:
+            user_id, auth = login(port)
+            body = {'user_id': user_id, 'shop_id': 1, 'total_price': 0, 'items': [{'id': i, 'quantity': 1} for i in product_ids]}
+            key = None
+            for n in range(args.keys):
+                key = str(uuid.uuid4())
+                before = order_count(database, user_id)
+                results = asyncio.run(fire(port, args.clients, args.repeat, body, {**auth, 'Idempotency-Key': key}))
+                check(results, before, order_count(database, user_id), failures, f"key {n}")
+            replay_body = asyncio.run(fire(port, 1, 1, body, {**auth, 'Idempotency-Key': key}))[0][2]
+            stats = json.load(urllib.request.urlopen(f'http://127.0.0.1:{port}/orders/idempotency-stats'))
+        finally:
+            stop_server(server)
+
+        server = start_server(database, port, workers=args.workers, env=SERVER_ENV)
+        try:
+            before = order_count(database, user_id)
+            (status, replayed, data), = asyncio.run(fire(port, 1, 1, body, {**auth, 'Idempotency-Key': key}))
+            if (status, replayed, data) != (201, True, replay_body) or order_count(database, user_id) != before:
+                failures.append(f"after restart: status {status}, replayed {replayed}, same body {data == replay_body}")
+            other = {**body, 'items': body['items'][:1]}
+            (status, _, _), = asyncio.run(fire(port, 1, 1, other, {**auth, 'Idempotency-Key': key}))
+            if status != 422 or order_count(database, user_id) != before:
+                failures.append(f"reused key with a different body: status {status}")
+        finally:
+            stop_server(server)
+
+    requests = args.keys * args.clients * args.repeat
+    print(f"{args.keys} keys x {args.clients} clients x {args.repeat} requests = {requests} requests on {args.workers} worker(s)")
+    print(f"idempotency stats (one worker): {stats}")
+    if failures:
+        print("FAILED:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("OK: exactly one order per key, every retry replayed the original response")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+"""Races many checkouts for one limited product and checks it is never oversold.
+
+Product 1 is given --stock units. Then --clients keep-alive connections each
+keep ordering 1-3 units of it (some orders also take an untracked product)
+until told it is sold out. Every response must be a 201 or a 409 sold-out
+error, the units in the 201s must add up to exactly --stock, the order rows
+in the database must agree, and the product must be left at 0 and listed as
+sold out by every worker. Runs once with the stock reservations and once with
+CANTEEN_STOCK_RESERVATIONS=0, each over --workers uvicorn processes.
+
+A last run sends --queue-clients checkouts straight to orders.OrderQueue in
+this process. In every run, no checkout may be refused while the database has
+enough left for it after what the checkouts in flight and not yet written
+ask for.
+
+    python scripts/stress_stock.py --stock 500 --clients 200 --workers 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+from loadgen import HTTPConnection, free_port, prepare_database, raise_fd_limit, start_server, stop_server
+
+import orders
+import stock
+from db_pool import AsyncDatabase, ConnectionPool
+
+# Workers must share the secret to accept each other's session tokens.
+SERVER_ENV = {'CANTEEN_SESSION_SECRET': 'stress-stock', 'CANTEEN_ARCHIVE': '0'}
+MODES = [('reservations', {'CANTEEN_STOCK_RESERVATIONS': '1'}), ('database only', {'CANTEEN_STOCK_RESERVATIONS': '0'})]
+PRODUCT_ID, OTHER_ID = 1, 2
+ORDERED = 'SELECT COALESCE(SUM(quantity), 0) FROM order_items WHERE product_id = ?'
+MAX_QUANTITY = 3
+
+
+class Race:
+    """What one race saw: units sold, responses, and stock refusals no hold could explain.
+
+    A refusal is false if the database still had enough left for the order
+    after what the checkouts in flight and not yet written ask for. Below
+    MAX_QUANTITY units left, an admitted order the database then refused can
+    leave stock behind, so those refusals are not checked.
+    """
+
+    def __init__(self, database, before):
+        self.db = sqlite3.connect(database)
+        self.before = before
+        self.sold, self.responses, self.false_sell_outs = [], Counter(), []
+        self.in_flight = 0
+
+    def refused(self, quantity):
+        """Checks a refusal of `quantity` units; call without yielding since its checkout left in_flight."""
+        # One statement, so the stock and the order rows come from one snapshot.
+        left, ordered = self.db.execute(f'SELECT stock, ({ORDERED}) FROM products WHERE id = ?', (PRODUCT_ID, PRODUCT_ID)).fetchone()
+        unwritten = self.in_flight - (ordered - self.before - sum(self.sold))
+        if left >= MAX_QUANTITY and left - unwritten >= quantity:
+            self.false_sell_outs.append((left, unwritten))
+
+    async def run(self, client, clients):
+        """Runs `clients` copies of `client(self)`; returns the seconds taken."""
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(client(self) for _ in range(clients)))
+        finally:
+            self.db.close()
+        return time.perf_counter() - started
+
+
+def cart():
+    quantity = random.randint(1, MAX_QUANTITY)
+    items = [{'id': PRODUCT_ID, 'quantity': quantity}]
+    if random.random() < 0.3:
+        items.append({'id': OTHER_ID, 'quantity': 1})
+    return quantity, items
+
+
+async def race(port, clients, database, before):
+    """Orders over HTTP until sold out; returns (Race, seconds taken)."""
+    conn = HTTPConnection(port)
+    _, _, data = await conn.request('POST', '/login', body={'email': 'student@example.com', 'password': 'student123'})
+    conn.close()
+    user = json.loads(data)
+    auth = {'Authorization': f"Bearer {user['token']}"}
+
+    async def client(seen):
+        conn = HTTPConnection(port)
+        try:
+            while True:
+                quantity, items = cart()
+                seen.in_flight += quantity
+                try:
+                    status, _, data = await conn.request('POST', '/orders', body={'user_id': user['id'], 'shop_id': 1, 'items': items}, headers=auth)
+                finally:
+                    seen.in_flight -= quantity
+                detail = json.loads(data).get('detail', '') if status != 201 else ''
+                seen.responses[f"{status} {detail}" if status not in (201, 409) else status] += 1
+                if status == 201:
+                    seen.sold.append(quantity)
+                    continue
+                if status == 409:
+                    seen.refused(quantity)
+                if status != 409 or detail.endswith('is sold out.'):
+                    return
+        finally:
+            conn.close()
+
+    seen = Race(database, before)
+    return seen, await seen.run(client, clients)
+
+
+async def race_in_process(clients, database, before):
+    """Orders through an OrderQueue in this process until sold out; returns (Race, seconds taken).
+
+    Unlike an HTTP client, a client here submits its next checkout as soon as
+    its order is placed, while the rest of its micro-batch may still be held.
+    """
+    queue = orders.OrderQueue(AsyncDatabase(ConnectionPool(database)))
+    writer = asyncio.ensure_future(queue.run())
+    await asyncio.sleep(0)
+
+    async def client(seen):
+        while True:
+            quantity, items = cart()
+            order = SimpleNamespace(user_id=1, shop_id=1, items=[SimpleNamespace(**item) for item in items])
+            seen.in_flight += quantity
+            try:
+                await queue.submit([order])
+            except stock.SoldOutError as e:
+                seen.in_flight -= quantity
+                seen.responses[409] += 1
+                seen.refused(quantity)
+                if not e.remaining:
+                    return
+            else:
+                seen.in_flight -= quantity
+                seen.responses[201] += 1
+                seen.sold.append(quantity)
+
+    seen = Race(database, before)
+    try:
+        return seen, await seen.run(client, clients)
+    finally:
+        writer.cancel()
+
+
+async def listings(port, workers, attempts=50):
+    """Whether the product shows up in GET /products, as seen by up to `workers` workers."""
+    seen = {}
+    for _ in range(attempts):
+        conn = HTTPConnection(port)
+        _, _, data = await conn.request('GET', '/db/change-stats')
+        origin = json.loads(data)['origin']
+        _, _, data = await conn.request('GET', '/products')
+        conn.close()
+        seen[origin] = any(p['id'] == PRODUCT_ID for p in json.loads(data))
+        if len(seen) == workers:
+            break
+    return list(seen.values())
+
+
+def prepare(database, units):
+    """A fresh database with `units` of the product; returns the units already in order_items."""
+    prepare_database(database)
+    conn = sqlite3.connect(database)
+    try:
+        conn.execute('UPDATE products SET stock = ?, stock_date = DATE(\'now\') WHERE id = ?', (units, PRODUCT_ID))
+        conn.commit()
+        return conn.execute(ORDERED, (PRODUCT_ID,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def check(label, database, before, seen, elapsed, units, failures):
+    conn = sqlite3.connect(database)
+    try:
+        left, = conn.execute('SELECT stock FROM products WHERE id = ?', (PRODUCT_ID,)).fetchone()
+        ordered = conn.execute(ORDERED, (PRODUCT_ID,)).fetchone()[0] - before
+    finally:
+        conn.close()
+    sold = sum(seen.sold)
+    print(f"{label}: {sold} units sold in {sum(seen.responses.values())} requests over {elapsed:.2f}s, stock left {left}")
+    for response, count in seen.responses.most_common():
+        print(f"  {count:>6} x {response}")
+    if sold != units or ordered != units:
+        failures.append(f"{label}: {sold} units confirmed and {ordered} in order_items, expected exactly {units}")
+    if left != 0:
+        failures.append(f"{label}: stock left at {left}, expected 0")
+    unexpected = [response for response in seen.responses if response not in (201, 409)]
+    if unexpected:
+        failures.append(f"{label}: unexpected responses {unexpected}")
+    if seen.false_sell_outs:
+        left_at, unwritten = seen.false_sell_outs[0]
+        failures.append(f"{label}: {len(seen.false_sell_outs)} checkouts refused while stock was left "
+                        f"(first: {left_at} left, {unwritten} in flight and not written)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stock', type=int, default=500)
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--queue-clients', type=int, default=20, help="Clients in the in-process OrderQueue run.")
+    args = parser.parse_args()
+    raise_fd_limit()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, env in MODES:
+            database = os.path.join(tmp, f"stock-{env['CANTEEN_STOCK_RESERVATIONS']}.db")
+            before = prepare(database, args.stock)
+            port = free_port()
+            server = start_server(database, port, workers=args.workers, env={**SERVER_ENV, **env})
+            try:
+                seen, elapsed = asyncio.run(race(port, args.clients, database, before))
+                time.sleep(0.5)  # let the sell-out reach every worker's catalog
+                listed = asyncio.run(listings(port, args.workers))
+            finally:
+                stop_server(server)
+            check(label, database, before, seen, elapsed, args.stock, failures)
+            if any(listed):
+                failures.append(f"{label}: product still listed by {sum(listed)} of {len(listed)} workers")
+
+        database = os.path.join(tmp, 'stock-queue.db')
+        before = prepare(database, args.stock)
+        seen, elapsed = asyncio.run(race_in_process(args.queue_clients, database, before))
+        check('order queue, in process', database, before, seen, elapsed, args.stock, failures)
+
+    if failures:
+        print("FAILED:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print(f"OK: exactly {args.stock} units sold in every mode, the rest refused with 409")
+
+if __name__ == '__main__':
+    main()
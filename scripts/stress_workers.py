@@ -0,0 +1,237 @@
+"""Checks that several uvicorn workers stay consistent, and how throughput scales with workers.
+
+Starts the app with --workers N on a throwaway database and opens keep-alive
+connections until it holds one to every worker (each reports its own change
+log origin at /db/change-stats). Then, for every write another worker caches
+or streams - update_product, create_product, update_shop, a logout and
+update_order_status on a new order - it times how long until each worker
+reflects it: the product or shop read back, the revoked token refused, and
+the order_created/order_status events received by a live-feed subscriber
+on each worker. Every delay must stay under --max-delay, and every worker
+must end up serving the same catalog under the same ETag.
+
+Then a read-mostly request mix is driven with --clients connections for
+--duration seconds against 1, 2, ... N workers and requests/sec is reported.
+Scaling is bounded by the CPU cores left over after the load generator.
+
+    python scripts/stress_workers.py --workers 4 --clients 32 --duration 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from loadgen import HTTPConnection, free_port, owner_login, prepare_database, start_server, stop_server
+
+# Workers must share the secret to accept each other's session tokens.
+SERVER_ENV = {'CANTEEN_SESSION_SECRET': 'stress-workers', 'CANTEEN_ARCHIVE': '0'}
+LOAD_MIX = ['/products', '/products/1', '/products?shop_id=1', '/shops', '/orders/shop/1/live', '/orders/shop/1/queue']
+
+
+async def connect_all_workers(port, workers, attempts=500):
+    """One keep-alive connection per worker, told apart by their change log origins."""
+    found, spare = {}, []
+    for _ in range(attempts):
+        conn = HTTPConnection(port)
+        _, _, data = await conn.request('GET', '/db/change-stats')
+        origin = json.loads(data)['origin']
+        if origin in found:
+            # Kept open so the busy worker is not handed the next connection again.
+            spare.append(conn)
+        else:
+            found[origin] = conn
+        if len(found) == workers:
+            break
+    for conn in spare:
+        conn.close()
+    if len(found) < workers:
+        raise RuntimeError(f"only reached {len(found)} of {workers} workers")
+    return list(found.values())
+
+
+async def login(conn, email='student@example.com', password='student123'):
+    _, _, data = await conn.request('POST', '/login', body={'email': email, 'password': password})
+    user = json.loads(data)
+    return user['id'], {'Authorization': f"Bearer {user['token']}"}
+
+
+async def propagation(conns, path, check, timeout, headers=None):
+    """Seconds until `check(status, data)` holds for `path` on every worker (None where it never did)."""
+    started = time.perf_counter()
+
+    async def wait(conn):
+        while time.perf_counter() - started < timeout:
+            status, _, data = await conn.request('GET', path, headers=headers)
+            if check(status, data):
+                return time.perf_counter() - started
+            await asyncio.sleep(0.002)
+        return None
+
+    return await asyncio.gather(*(wait(conn) for conn in conns))
+
+
+async def subscribe(conn, shop_id, owner, received):
+    """Turns a worker's connection into a live-feed subscriber recording (event type, order id) -> arrival time."""
+    headers = ''.join(f'{name}: {value}\r\n' for name, value in owner.items())
+    conn.writer.write(f'GET /orders/shop/{shop_id}/stream HTTP/1.1\r\nHost: localhost\r\n{headers}\r\n'.encode())
+    await conn.writer.drain()
+    await conn.reader.readuntil(b'\r\n\r\n')
+    while True:
+        line = await conn.reader.readline()
+        if not line:
+            return
+        if line.startswith(b'data: {'):
+            event = json.loads(line[6:])
+            order_id = event['order']['order_id'] if event['type'] == 'order_created' else event.get('order_id')
+            received.setdefault((event['type'], order_id), []).append(time.perf_counter())
+
+
+async def arrivals(received, key, count, timeout):
+    deadline = time.perf_counter() + timeout
+    while len(received.get(key, ())) < count and time.perf_counter() < deadline:
+        await asyncio.sleep(0.002)
+    return received.get(key, [])
+
+
+async def check_consistency(port, workers, max_delay):
+    """Returns ([(write, [delay per worker])], [failures])."""
+    conns = await connect_all_workers(port, workers)
+    writer = conns[0]
+    results, failures = [], []
+
+    def record(label, delays):
+        results.append((label, delays))
+        if any(delay is None or delay > max_delay for delay in delays):
+            failures.append(f"{label}: delays {delays}")
+
+    for conn in conns:
+        for path in ('/products', '/shops'):
+            await conn.request('GET', path)
+
+    # The catalog and order status writes are the shop 1 owner's.
+    _, owner = await login(writer, 'dhaba@example.com', 'owner123')
+    price = round(random.uniform(10, 99), 2)
+    await writer.request('PUT', '/products/1', body={'price': price}, headers=owner)
+    record('update_product', await propagation(conns, '/products/1', lambda s, d: json.loads(d)['price'] == price, max_delay * 5))
+
+    _, _, data = await writer.request('POST', '/products', body={'name': f'Worker special {price}', 'price': price, 'category_id': 1, 'shop_id': 1}, headers=owner)
+    new_id = json.loads(data)['id']
+    record('create_product', await propagation(conns, '/products/shop/1', lambda s, d: any(p['id'] == new_id for p in json.loads(d)), max_delay * 5))
+
+    name = f'Main Canteen {price}'
+    await writer.request('PUT', '/shops/1', body={'name': name}, headers=owner)
+    record('update_shop', await propagation(conns, '/shops', lambda s, d: any(shop['name'] == name for shop in json.loads(d)), max_delay * 5))
+
+    user_id, auth = await login(writer)
+    for conn in conns:
+        status, _, _ = await conn.request('GET', f'/orders/user/{user_id}', headers=auth)
+        if status != 200:
+            failures.append(f"session not accepted by every worker before logout (status {status})")
+    await writer.request('POST', '/logout', headers=auth)
+    record('logout', await propagation(conns, f'/orders/user/{user_id}', lambda s, d: s == 401, max_delay * 5, headers=auth))
+
+    # A fresh connection per worker for the order writes; the others become subscribers.
+    writers = await connect_all_workers(port, workers)
+    user_id, auth = await login(writers[0])
+    received = {}
+    streams = [asyncio.ensure_future(subscribe(conn, 1, owner, received)) for conn in conns]
+    await asyncio.sleep(0.5)
+    for n, conn in enumerate(writers):
+        started = time.perf_counter()
+        _, _, data = await conn.request('POST', '/orders', body={'user_id': user_id, 'shop_id': 1, 'items': [{'id': 1, 'quantity': 1}]}, headers=auth)
+        order_id = json.loads(data)['order_id']
+        created = await arrivals(received, ('order_created', order_id), workers, max_delay * 5)
+        record(f'create_order (worker {n})', [at - started for at in created] + [None] * (workers - len(created)))
+        started = time.perf_counter()
+        await writers[(n + 1) % workers].request('PUT', f'/orders/{order_id}/status', body={'status': 'Ready'}, headers=owner)
+        ready = await arrivals(received, ('order_status', order_id), workers, max_delay * 5)
+        record(f'update_order_status (worker {(n + 1) % workers})', [at - started for at in ready] + [None] * (workers - len(ready)))
+    for stream in streams:
+        stream.cancel()
+    await asyncio.gather(*streams, return_exceptions=True)
+
+    for conn in writers:
+        conn.close()
+    conns = await connect_all_workers(port, workers)
+    catalogs = set()
+    for conn in conns:
+        _, headers, data = await conn.request('GET', '/products')
+        catalogs.add((headers.get('etag'), data))
+        conn.close()
+    if len(catalogs) != 1:
+        failures.append(f"workers serve {len(catalogs)} different catalogs: {sorted(etag for etag, _ in catalogs)}")
+    return results, failures
+
+
+async def drive(port, clients, duration, auth):
+    """Requests/sec for LOAD_MIX from `clients` keep-alive connections over `duration` seconds."""
+    deadline = time.perf_counter() + duration
+    counts = []
+
+    async def client(n):
+        conn = HTTPConnection(port)
+        done = 0
+        try:
+            while time.perf_counter() < deadline:
+                await conn.request('GET', LOAD_MIX[(n + done) % len(LOAD_MIX)], headers=auth)
+                done += 1
+        finally:
+            conn.close()
+        counts.append(done)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(clients)))
+    return sum(counts) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=5, help="Seconds of load per worker count.")
+    parser.add_argument('--max-delay', type=float, default=1.0, help="Seconds a write may take to reach every worker.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'workers.db')
+        prepare_database(database)
+        port = free_port()
+        server = start_server(database, port, workers=args.workers, env=SERVER_ENV)
+        try:
+            results, failures = asyncio.run(check_consistency(port, args.workers, args.max_delay))
+        finally:
+            stop_server(server)
+
+        throughput = []
+        for workers in range(1, args.workers + 1):
+            port = free_port()
+            server = start_server(database, port, workers=workers, env=SERVER_ENV)
+            try:
+                # /live is an owner page.
+                auth = owner_login(port)
+                asyncio.run(drive(port, args.clients, 1, auth))
+                throughput.append((workers, asyncio.run(drive(port, args.clients, args.duration, auth))))
+            finally:
+                stop_server(server)
+
+    print(f"Propagation to {args.workers} workers (ms, in order of arrival):")
+    for label, delays in results:
+        print(f"  {label:<32}" + ' '.join('   never' if d is None else f"{d * 1000:8.1f}" for d in delays))
+    print(f"\nThroughput, {args.clients} clients, {os.cpu_count()} CPU(s):")
+    print(f"{'workers':>8}{'req/s':>10}{'speedup':>9}")
+    for workers, rate in throughput:
+        print(f"{workers:>8}{rate:>10.0f}{rate / throughput[0][1]:>8.2f}x")
+    if failures:
+        print("FAILED:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print(f"OK: every write reached all {args.workers} workers within {args.max_delay}s and they serve the same catalog")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import re
+
+# ==============================================================================
+# --- Product Search ---
+# ==============================================================================
+#
+# products_fts (migration 5) is an external-content FTS5 index over
+# products.name and products.description, kept in sync by triggers on
+# products. Queries are built from the words the user typed, each treated as
+# a prefix so results update as they type, and ranked with bm25.
+#
+# Products whose name matches rank above products that only match in the
+# description. The name-only query runs first, and the description pass only
+# runs when it leaves the top-K short. This keeps common words, which appear
+# in many descriptions, from scoring a large part of the catalog.
+
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+MAX_QUERY_TERMS = 8
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def fts_query(text):
+    """Turns free text into an FTS5 query matching every word as a prefix.
+
+    Each word is quoted, so FTS5 operators and punctuation in the input are
+    never interpreted. Returns None when the text contains no words.
+    """
+    words = _WORD_RE.findall(text)[:MAX_QUERY_TERMS]
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _ranked_ids(conn, match, shop_id, category_id, limit, exclude=()):
+    conditions = ['products_fts MATCH ?']
+    params = [match]
+    if shop_id:
+        conditions.append('p.shop_id = ?')
+        params.append(shop_id)
+    if category_id:
+        conditions.append('p.category_id = ?')
+        params.append(category_id)
+    if exclude:
+        conditions.append(f"products_fts.rowid NOT IN ({','.join('?'*len(exclude))})")
+        params.extend(exclude)
+    params.append(limit)
+    rows = conn.execute(f'''
+        SELECT p.id FROM products_fts JOIN products p ON p.id = products_fts.rowid
+        WHERE {' AND '.join(conditions)}
+        ORDER BY bm25(products_fts, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT})
+        LIMIT ?
+    ''', tuple(params)).fetchall()
+    return [row[0] for row in rows]
+
+
+def search_product_ids(conn, text, shop_id=None, category_id=None, limit=SEARCH_DEFAULT_LIMIT):
+    """Returns the ids of the best `limit` matching products, best first."""
+    match = fts_query(text)
+    if match is None:
+        return []
+    ids = _ranked_ids(conn, f'{{name}} : ({match})', shop_id, category_id, limit)
+    if len(ids) < limit:
+        ids += _ranked_ids(conn, match, shop_id, category_id, limit - len(ids), exclude=ids)
+    return ids
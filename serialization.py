@@ -0,0 +1,60 @@
+import json
+
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib encoder is used instead
+    orjson = None
+
+# ==============================================================================
+# --- Trusted JSON Responses ---
+# ==============================================================================
+#
+# Endpoints keep their `response_model` for the OpenAPI schema, but a handler
+# that returns a Response is sent as-is: FastAPI skips validating and
+# re-serializing it. Handlers whose data comes straight from our own tables
+# build it in the response-model shape with `shape()`, then return it through
+# TrustedJSONResponse. Catalog responses go one step further and are encoded
+# once per catalog snapshot (see CatalogSnapshot.encoded).
+
+
+def dumps(content):
+    """Encodes `content` as compact UTF-8 JSON bytes, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+
+class TrustedJSONResponse(Response):
+    """JSON response for content that is already in its response-model shape.
+
+    Accepts either a value to encode or bytes that are already encoded.
+    """
+
+    media_type = 'application/json'
+
+    def render(self, content):
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
+
+
+def shape(model):
+    """Returns a function mapping a row (dict or sqlite3.Row) to `model`'s output shape.
+
+    The result has exactly the model's fields, in declaration order, with
+    defaults for missing optional fields and floats for float fields, which is
+    what response-model serialization would have produced for a valid row.
+    """
+    fields = [(name, field.annotation is float, None if field.is_required() else field.default)
+              for name, field in model.model_fields.items()]
+
+    def project(row):
+        row = dict(row)
+        out = {}
+        for name, is_float, default in fields:
+            value = row.get(name, default)
+            out[name] = float(value) if is_float and value is not None else value
+        return out
+    return project
@@ -0,0 +1,159 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import changes
+
+# ==============================================================================
+# --- Configuration ---
+# ==============================================================================
+
+# Key for signing session tokens. Set it explicitly when running several
+# workers or to keep sessions valid across restarts; otherwise a random key is
+# generated per process.
+SESSION_SECRET = os.environ.get('CANTEEN_SESSION_SECRET') or secrets.token_hex(32)
+SESSION_TTL_S = int(os.environ.get('CANTEEN_SESSION_TTL_S', str(12 * 3600)))
+SESSION_CACHE_SIZE = int(os.environ.get('CANTEEN_SESSION_CACHE_SIZE', '10000'))
+SESSION_COOKIE = 'canteen_session'
+
+
+@dataclass(frozen=True)
+class Session:
+    """Who a request belongs to, as resolved from its session token."""
+    session_id: str
+    user_id: int
+    role: str
+    shop_id: Optional[int]
+    expires_at: int
+
+
+# ==============================================================================
+# --- Tokens ---
+# ==============================================================================
+#
+# A token is "<session id>.<user id>.<expiry>.<signature>", where the signature
+# is an HMAC-SHA256 of the first three fields. Forged, tampered or expired
+# tokens are rejected without touching the session cache or the database.
+
+def _sign(payload):
+    digest = hmac.new(SESSION_SECRET.encode(), payload.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode().rstrip('=')
+
+
+def encode_token(session_id, user_id, expires_at):
+    payload = f'{session_id}.{user_id}.{expires_at}'
+    return f'{payload}.{_sign(payload)}'
+
+
+def decode_token(token, now=None):
+    """Returns (session_id, user_id, expires_at) for a valid, unexpired token, else None."""
+    try:
+        payload, signature = token.rsplit('.', 1)
+        session_id, user_id, expires_at = payload.split('.')
+        user_id, expires_at = int(user_id), int(expires_at)
+    except (AttributeError, ValueError):
+        return None
+    if not hmac.compare_digest(signature, _sign(payload)):
+        return None
+    if expires_at <= (now if now is not None else time.time()):
+        return None
+    return session_id, user_id, expires_at
+
+
+# ==============================================================================
+# --- Session Store ---
+# ==============================================================================
+
+class SessionStore:
+    """LRU cache of live sessions, keyed by session id.
+
+    `lookup()` answers from memory. A valid token whose session has been
+    evicted is resolved again with `load()`, which reads the user and the
+    revocation table. Revoked ids are kept in the `revoked_sessions` table until
+    their tokens would have expired anyway.
+    """
+
+    def __init__(self, ttl=SESSION_TTL_S, max_size=SESSION_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'issued': 0, 'hits': 0, 'misses': 0, 'rejected': 0, 'revoked': 0, 'evicted': 0}
+
+    def _remember(self, session):
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._sessions.move_to_end(session.session_id)
+            while len(self._sessions) > self.max_size:
+                self._sessions.popitem(last=False)
+                self._stats['evicted'] += 1
+
+    def issue(self, user):
+        """Creates a session for a users row and returns (token, Session)."""
+        session = Session(secrets.token_urlsafe(16), user['id'], user['role'], user['shop_id'], int(time.time()) + self.ttl)
+        self._remember(session)
+        with self._lock:
+            self._stats['issued'] += 1
+        return encode_token(session.session_id, session.user_id, session.expires_at), session
+
+    def lookup(self, token):
+        """Fast path. Returns the cached Session, None for an invalid token, or the
+        decoded claims (a tuple) when the token is valid but not cached."""
+        claims = decode_token(token)
+        with self._lock:
+            if claims is None:
+                self._stats['rejected'] += 1
+                return None
+            session = self._sessions.get(claims[0])
+            if session is not None and session.user_id == claims[1]:
+                self._sessions.move_to_end(claims[0])
+                self._stats['hits'] += 1
+                return session
+            self._stats['misses'] += 1
+        return claims
+
+    def load(self, conn, claims):
+        """Slow path for a valid token missing from the cache. Runs on a DB worker."""
+        session_id, user_id, expires_at = claims
+        if conn.execute('SELECT 1 FROM revoked_sessions WHERE session_id = ?', (session_id,)).fetchone():
+            return None
+        user = conn.execute('SELECT id, role, shop_id FROM users WHERE id = ?', (user_id,)).fetchone()
+        if user is None:
+            return None
+        session = Session(session_id, user['id'], user['role'], user['shop_id'], expires_at)
+        self._remember(session)
+        return session
+
+    def revoke(self, conn, session):
+        """Ends a session; other workers drop it from their caches when they read the change log."""
+        with self._lock:
+            self._sessions.pop(session.session_id, None)
+            self._stats['revoked'] += 1
+        conn.execute('DELETE FROM revoked_sessions WHERE expires_at <= ?', (int(time.time()),))
+        conn.execute('INSERT OR IGNORE INTO revoked_sessions (session_id, expires_at) VALUES (?, ?)',
+                     (session.session_id, session.expires_at))
+        changes.record(conn, changes.SESSION_REVOKED, {'session_id': session.session_id})
+        conn.commit()
+
+    def forget(self, session_id):
+        """Drops a session revoked by another worker; its next request reads the revocation table."""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'cached': len(self._sessions), 'max_size': self.max_size, 'ttl_s': self.ttl}
+
+
+store = SessionStore()
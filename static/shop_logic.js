@@ -127,14 +127,22 @@ function createHistoryCardHTML(order) {
 // --- API Functions ---
 // ... (rest of the file is unchanged) ...
 
+// Status changes carry the version the page last saw, so an order another
+// tablet has already moved is refused (409) instead of being overwritten.
 async function updateStatus(orderId, newStatus) {
+    const order = typeof liveOrders !== 'undefined' ? liveOrders.get(orderId) : undefined;
     try {
         const response = await fetch(`/orders/${orderId}/status`, {
             method: 'PUT',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ status: newStatus })
+            body: JSON.stringify({ status: newStatus, version: order ? order.version : null })
         });
-        if (!response.ok) throw new Error('Failed to update status');
+        if (response.status === 409) {
+            const conflict = await response.json();
+            alert(`Order #${orderId} was not updated: ${conflict.detail}`);
+        } else if (!response.ok) {
+            throw new Error('Failed to update status');
+        }
         if(typeof fetchLiveOrders === 'function') {
             fetchLiveOrders();
         }
@@ -144,6 +152,30 @@ async function updateStatus(orderId, newStatus) {
     }
 }
 
+// Moves every live order in `fromStatus` to `newStatus` with one request.
+async function updateAllStatus(fromStatus, newStatus) {
+    const orders = [...liveOrders.values()].filter(order => order.status === fromStatus)
+        .map(order => ({ order_id: order.order_id, status: newStatus, version: order.version }));
+    if (orders.length === 0) return;
+    try {
+        const response = await fetch(`/orders/shop/${user.shop_id}/status`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ orders })
+        });
+        if (!response.ok) throw new Error('Failed to update statuses');
+        const result = await response.json();
+        const refused = result.orders.filter(order => order.outcome !== 'updated' && order.outcome !== 'unchanged');
+        if (refused.length > 0) {
+            alert(`${refused.length} order(s) were changed elsewhere and left as they are.`);
+        }
+        fetchLiveOrders();
+    } catch (error) {
+        console.error("Error updating statuses:", error);
+        alert('Could not update order statuses.');
+    }
+}
+
 
 // --- Page-Specific Logic ---
 
@@ -203,65 +235,140 @@ async function populateWeeklyChart() {
 }
 
 // Logic for shop_orders.html
+// The page loads a snapshot from /live, then applies deltas pushed over /stream.
+let liveOrders = new Map();
+
+function renderLiveOrders() {
+    const container = document.getElementById('live-orders-container');
+    container.innerHTML = '';
+    const orders = [...liveOrders.values()].sort((a, b) =>
+        (a.status === b.status ? 0 : a.status === 'Pending' ? -1 : 1) || b.order_date.localeCompare(a.order_date));
+    const pending = orders.filter(order => order.status === 'Pending').length;
+    const ready = orders.length - pending;
+    if (pending > 1 || ready > 1) {
+        container.innerHTML += `
+            <div class="flex gap-3 px-4 pt-4">
+                ${pending > 1 ? `<button onclick="updateAllStatus('Pending', 'Ready')" class="press-effect flex-1 h-10 rounded-lg bg-[#f3dd39] text-[#1c1a0d] text-sm font-bold">Accept all ${pending}</button>` : ''}
+                ${ready > 1 ? `<button onclick="updateAllStatus('Ready', 'Completed')" class="press-effect flex-1 h-10 rounded-lg bg-[#6b622c] text-white text-sm font-bold">Complete all ${ready}</button>` : ''}
+            </div>`;
+    }
+    if (orders.length > 0) {
+        orders.forEach(order => container.innerHTML += createLiveOrderCardHTML(order));
+    } else {
+        container.innerHTML = '<p class="text-center text-gray-500 py-16">No active orders right now.</p>';
+    }
+}
+
 async function fetchLiveOrders() {
     if (!user.shop_id) return;
     try {
-        const response = await fetch(`/orders/shop/${user.shop_id}/summary`);
+        const response = await fetch(`/orders/shop/${user.shop_id}/live`);
         if (!response.ok) throw new Error('Failed to fetch orders');
-        const summary = await response.json();
-        const container = document.getElementById('live-orders-container');
-        container.innerHTML = '';
-        
-        const liveOrders = [...summary.pending, ...summary.ready];
-        
-        if (liveOrders.length > 0) {
-            liveOrders.forEach(order => container.innerHTML += createLiveOrderCardHTML(order));
-        } else {
-            container.innerHTML = '<p class="text-center text-gray-500 py-16">No active orders right now.</p>';
-        }
+        const live = await response.json();
+        liveOrders = new Map([...live.pending, ...live.ready].map(order => [order.order_id, order]));
+        renderLiveOrders();
     } catch (error) {
         console.error("Error fetching orders:", error);
         document.getElementById('live-orders-container').innerHTML = '<p class="text-red-500 p-4">Could not load orders.</p>';
     }
 }
 
+function startLiveOrderStream() {
+    if (!user.shop_id) return;
+    if (!window.EventSource) { // Very old browsers: fall back to polling
+        fetchLiveOrders();
+        setInterval(fetchLiveOrders, 15000);
+        return;
+    }
+    const stream = new EventSource(`/orders/shop/${user.shop_id}/stream`);
+    // (Re)load the snapshot each time the stream (re)connects so no delta is missed.
+    stream.onopen = fetchLiveOrders;
+    stream.addEventListener('order_created', (e) => {
+        const { order } = JSON.parse(e.data);
+        if (order) {
+            liveOrders.set(order.order_id, order);
+            renderLiveOrders();
+        }
+    });
+    stream.addEventListener('order_status', (e) => {
+        const { order_id, status, version } = JSON.parse(e.data);
+        const order = liveOrders.get(order_id);
+        if (status === 'Pending' || status === 'Ready') {
+            if (!order) return fetchLiveOrders();
+            order.status = status;
+            order.version = version;
+        } else {
+            liveOrders.delete(order_id);
+        }
+        renderLiveOrders();
+    });
+    stream.addEventListener('resync', fetchLiveOrders);
+}
+
 
 // Logic for shop_order_history.html
-let allCompletedOrders = [];
+// History is filtered and paginated server-side; the cursor points at the next page.
+let historyDays = '7';
+let historyCursor = null;
 
-function renderHistory(ordersToRender) {
+function renderHistory(ordersToRender, append = false) {
     const container = document.getElementById('completed-orders-container');
-    container.innerHTML = '';
+    if (!append) container.innerHTML = '';
     if (ordersToRender.length > 0) {
         ordersToRender.forEach(order => container.innerHTML += createHistoryCardHTML(order));
-    } else {
+    } else if (!append) {
         container.innerHTML = '<p class="text-sm text-center text-gray-500 py-8">No orders found for this period.</p>';
     }
+    const loadMoreButton = document.getElementById('load-more-history');
+    if (loadMoreButton) loadMoreButton.classList.toggle('hidden', !historyCursor);
 }
 
-function filterOrdersByDays(days) {
-    const now = new Date();
+function historySince() {
+    if (historyDays >= 9999) return null; // "All Time" sends no date filter
     const cutoffDate = new Date();
-    cutoffDate.setDate(now.getDate() - parseInt(days));
-    
-    if (days >= 9999) { // "All Time"
-            renderHistory(allCompletedOrders);
-            return;
-    }
+    cutoffDate.setDate(cutoffDate.getDate() - parseInt(historyDays));
+    return cutoffDate.toISOString().slice(0, 10);
+}
+
+function historyUrl() {
+    const params = new URLSearchParams({ limit: '20' });
+    const since = historySince();
+    if (since) params.set('since', since);
+    if (historyCursor) params.set('cursor', historyCursor);
+    return `/orders/shop/${user.shop_id}/history?${params}`;
+}
 
-    const filtered = allCompletedOrders.filter(order => new Date(order.order_date) >= cutoffDate);
-    renderHistory(filtered);
+// Every order line of the selected period, streamed by the server as a CSV download.
+function updateExportLink() {
+    const link = document.getElementById('export-history');
+    if (!link) return;
+    const params = new URLSearchParams({ format: 'csv' });
+    const since = historySince();
+    if (since) params.set('since', since);
+    link.href = `/orders/shop/${user.shop_id}/export/lines?${params}`;
 }
 
-async function fetchHistory() {
+async function fetchHistory(append = false) {
     if (!user.shop_id) return;
+    if (!append) updateExportLink();
     try {
-        const response = await fetch(`/orders/shop/${user.shop_id}/summary`);
-        const summary = await response.json();
-        allCompletedOrders = summary.completed;
-        filterOrdersByDays('7'); // Default to "Last 7 Days"
+        const response = await fetch(historyUrl());
+        if (!response.ok) throw new Error('Failed to fetch order history');
+        const page = await response.json();
+        historyCursor = page.next_cursor;
+        renderHistory(page.orders, append);
     } catch (e) {
         console.error(e);
         document.getElementById('completed-orders-container').innerHTML = '<p class="text-red-500">Could not load order history.</p>';
     }
+}
+
+function filterOrdersByDays(days) {
+    historyDays = days;
+    historyCursor = null;
+    fetchHistory();
+}
+
+function loadMoreHistory() {
+    if (historyCursor) fetchHistory(true);
 }
\ No newline at end of file
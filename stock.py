@@ -0,0 +1,181 @@
+import os
+import threading
+import time
+from collections import defaultdict
+
+import changes
+
+# ==============================================================================
+# --- Configuration ---
+# ==============================================================================
+
+# Turns the in-memory reservation layer off; every checkout then goes to the
+# database to find out whether the stock is still there.
+STOCK_RESERVATIONS_ENABLED = os.environ.get('CANTEEN_STOCK_RESERVATIONS', '1') != '0'
+
+
+class SoldOutError(ValueError):
+    """A product has less stock left than an order asks for."""
+
+    def __init__(self, product_id, remaining):
+        self.product_id = product_id
+        self.remaining = max(remaining or 0, 0)
+        if self.remaining:
+            super().__init__(f"Only {self.remaining} of product {product_id} left.")
+        else:
+            super().__init__(f"Product {product_id} is sold out.")
+
+
+# ==============================================================================
+# --- Product Stock ---
+# ==============================================================================
+#
+# products.stock is the quantity left (NULL: not tracked, never sells out).
+# products.daily_stock, if set, is what the stock starts at every day:
+# stock_date is the day `stock` was counted for, and on any later day the
+# effective stock is daily_stock again. Days are UTC dates, like order_date.
+# Checkout takes the quantities off with one conditional UPDATE per tracked
+# product inside the order's write transaction, so two orders can never both
+# take the last unit, whichever worker or batch they arrive in.
+
+def today():
+    return time.strftime('%Y-%m-%d', time.gmtime())
+
+
+EFFECTIVE_STOCK = 'CASE WHEN daily_stock IS NOT NULL AND (stock_date IS NULL OR stock_date < :day) THEN daily_stock ELSE stock END'
+
+
+def effective(product, day=None):
+    """The stock a products row (dict or sqlite3.Row) has left on `day`; None if it is not tracked."""
+    daily = product['daily_stock']
+    if daily is not None and (product['stock_date'] is None or product['stock_date'] < (day or today())):
+        return daily
+    return product['stock']
+
+
+def sold_out(product, day=None):
+    stock = effective(product, day)
+    return stock is not None and stock <= 0
+
+
+def decrement(conn, lines):
+    """Takes ordered quantities off the tracked products. Call inside the order's write transaction.
+
+    `lines` are (product_id, quantity, price) tuples. Returns ({product_id:
+    stock left}, the catalog Change recorded if a product sold out, else None).
+    Raises SoldOutError, leaving the rest of the transaction to be rolled back,
+    if any product has too little left.
+    """
+    quantities = defaultdict(int)
+    for product_id, quantity, _ in lines:
+        quantities[product_id] += quantity
+    ids = sorted(quantities)
+    tracked = [row[0] for row in conn.execute(
+        f"SELECT id FROM products WHERE id IN ({','.join('?' * len(ids))}) AND (stock IS NOT NULL OR daily_stock IS NOT NULL)", ids)]
+    day, left = today(), {}
+    for product_id in tracked:
+        params = {'id': product_id, 'quantity': quantities[product_id], 'day': day}
+        row = conn.execute(f'''
+            UPDATE products SET stock = {EFFECTIVE_STOCK} - :quantity, stock_date = :day
+            WHERE id = :id AND {EFFECTIVE_STOCK} >= :quantity
+            RETURNING stock
+        ''', params).fetchall()
+        if not row:
+            remaining = conn.execute(f'SELECT {EFFECTIVE_STOCK} FROM products WHERE id = :id', params).fetchone()[0]
+            raise SoldOutError(product_id, remaining)
+        left[product_id] = row[0][0]
+    # Selling out changes what the catalog lists, so it is a catalog change.
+    change = changes.record(conn, changes.CATALOG) if 0 in left.values() else None
+    return left, change
+
+
+def levels(conn, shop_id):
+    """Current stock of a shop's tracked products, for the owner."""
+    return [{'id': row['id'], 'name': row['name'], 'stock': effective(row), 'daily_stock': row['daily_stock']} for row in conn.execute('''
+        SELECT id, name, stock, daily_stock, stock_date FROM products
+        WHERE shop_id = ? AND (stock IS NOT NULL OR daily_stock IS NOT NULL) ORDER BY id
+    ''', (shop_id,))]
+
+
+# ==============================================================================
+# --- Reservations ---
+# ==============================================================================
+
+class StockReservations:
+    """Admits checkouts for a tracked product only while the stock last seen could cover them.
+
+    When hundreds of students order the same limited item at once, the
+    database can sell only what is there; everyone else would still take a
+    place in the write queue just to be told it is gone. This layer remembers
+    the stock each committed order left and holds the quantities of orders
+    still in flight, so once they account for everything left, further
+    orders are refused in memory. The database stays the authority: a
+    product never seen here is let through, an admitted order can still be
+    refused by the conditional UPDATE (another worker sold it), and a restock
+    clears what is remembered via `forget()`.
+    """
+
+    def __init__(self, enabled=STOCK_RESERVATIONS_ENABLED):
+        self.enabled = enabled
+        self._left = {}
+        self._held = defaultdict(int)
+        self._lock = threading.Lock()
+        self._stats = {'admitted': 0, 'refused': 0, 'forgotten': 0}
+
+    def reserve(self, orders):
+        """Holds the quantities `orders` ask for; raises SoldOutError if the known stock cannot cover them.
+
+        Returns the holds, to be passed to `release()` once the orders are written or have failed.
+        """
+        if not self.enabled:
+            return {}
+        quantities = defaultdict(int)
+        for order in orders:
+            for item in order.items:
+                quantities[item.id] += item.quantity
+        day = today()
+        with self._lock:
+            holds = {}
+            for product_id, quantity in quantities.items():
+                known = self._left.get(product_id)
+                if known is None or known[0] != day:
+                    continue
+                held = self._held.get(product_id, 0)
+                if held + quantity > known[1]:
+                    self._stats['refused'] += 1
+                    raise SoldOutError(product_id, known[1] - held)
+                holds[product_id] = quantity
+            for product_id, quantity in holds.items():
+                self._held[product_id] += quantity
+            self._stats['admitted'] += 1
+        return holds
+
+    def release(self, holds, left=None):
+        """Drops the holds and records the stock left after the write (or as reported by a SoldOutError)."""
+        if not self.enabled:
+            return
+        day = today()
+        with self._lock:
+            for product_id, quantity in holds.items():
+                self._held[product_id] -= quantity
+                if self._held[product_id] <= 0:
+                    del self._held[product_id]
+            for product_id, remaining in (left or {}).items():
+                # Results can come back out of commit order; stock only goes up through forget().
+                known = self._left.get(product_id)
+                if known is not None and known[0] == day:
+                    remaining = min(known[1], remaining)
+                self._left[product_id] = (day, remaining)
+
+    def forget(self):
+        """Forgets every known stock level, e.g. after an owner changed one."""
+        with self._lock:
+            self._left.clear()
+            self._stats['forgotten'] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'enabled': self.enabled, 'known': len(self._left), 'held': dict(self._held)}
+
+
+reservations = StockReservations()